@@ -0,0 +1,155 @@
+"""
+bandit_engine.py
+Contextual bandit learner for KOKO recommendations.
+- Context is (child, detected emotion); arms are that emotion's candidate actions
+- Sufficient statistics live in the child profile, one compact entry per arm:
+    profile["bandit"]["sad:play_cheer_music"] = [count, mean_reward, m2]
+- Policy is selectable per profile via profile["bandit_policy"]:
+    "ucb"       upper confidence bound on the posterior mean reward
+    "thompson"  Gaussian Thompson sampling
+    "greedy"    original recommend_for_child / apply_feedback scores
+  Profiles without one that already learned rec_scores stay on "greedy",
+  so upgrading keeps what they learned; new profiles start on "ucb"
+- Profile preferences act as a weak prior, so liked media is tried first
+"""
+
+import numpy as np
+
+from recommender_engine import (RECOMMENDER, VALENCE, apply_feedback, recommend_batch as greedy_batch,
+                                recommend_for_child)
+
+POLICIES = ("ucb", "thompson", "greedy")
+DEFAULT_POLICY = "ucb"
+UCB_C = 1.0            # exploration weight
+PRIOR_COUNT = 1.0      # pseudo-observations behind the preference prior
+PRIOR_BONUS = 0.1      # prior mean reward per matched preference tag
+PRIOR_VAR = 0.25       # reward variance assumed before any data arrives
+VALENCE_RANGE = max(VALENCE.values()) - min(VALENCE.values())
+
+_rng = np.random.default_rng()
+
+
+def policy_of(profile):
+    """The profile's bandit policy (see the module docstring for the default)."""
+    policy = profile.get("bandit_policy")
+    if policy:
+        return policy
+    if profile.get("rec_scores") and not profile.get("bandit"):
+        return "greedy"
+    return DEFAULT_POLICY
+
+
+def stat_key(emotion, action):
+    return f"{emotion}:{action}"
+
+
+def feedback_reward(before_emotion, after_emotion):
+    """Valence change scaled to [-1, 1]."""
+    return (VALENCE.get(after_emotion, 0) - VALENCE.get(before_emotion, 0)) / VALENCE_RANGE
+
+
+def update_stats(stats, reward):
+    """Welford update of [count, mean, m2] with one reward."""
+    n, mean, m2 = stats if stats else (0, 0.0, 0.0)
+    n += 1
+    d = reward - mean
+    mean += d / n
+    m2 += d * (reward - mean)
+    return [n, mean, m2]
+
+
+def _arms(profile, emotion):
+    """Candidate actions plus count/mean/m2/prior arrays for one context."""
+    rec = RECOMMENDER
+    cand = rec.candidates[rec.emotion_index.get(emotion, rec.default_emotion)]
+    cand = cand[cand >= 0]
+    actions = [rec.actions[i] for i in cand]
+    table = profile.get("bandit", {})
+    stats = np.array([table.get(stat_key(emotion, a)) or (0, 0.0, 0.0) for a in actions],
+                     dtype=np.float64).reshape(len(actions), 3)
+    prior = PRIOR_BONUS * (rec.features[cand] @ rec.pref_vector(profile))
+    return actions, stats[:, 0], stats[:, 1], stats[:, 2], prior
+
+
+def policy_values(policy, n, mean, m2, prior, rng=None):
+    """
+    Rank values for arms from their statistics. Works on arrays of any shape;
+    the last axis holds the arms of one context.
+    """
+    count = PRIOR_COUNT + n
+    post_mean = (PRIOR_COUNT * prior + n * mean) / count
+    var = (PRIOR_COUNT * PRIOR_VAR + m2) / count
+    if policy == "ucb":
+        total = n.sum(axis=-1, keepdims=True)
+        return post_mean + UCB_C * np.sqrt(var * np.log(total + 2.0) / count)
+    if policy == "thompson":
+        return (rng or _rng).normal(post_mean, np.sqrt(var / count))
+    raise ValueError(f"Unknown bandit policy: {policy}")
+
+
+def arm_values(profile, emotion, policy=None, rng=None):
+    """Return (actions, values) used to rank the arms under the given policy."""
+    policy = policy or policy_of(profile)
+    actions, n, mean, m2, prior = _arms(profile, emotion)
+    return actions, policy_values(policy, n, mean, m2, prior, rng)
+
+
+def recommend(profile, emotion, top_k=1, rng=None):
+    """Top_k action keys for a child given the detected emotion, per the profile's policy."""
+    policy = policy_of(profile)
+    if policy == "greedy":
+        return recommend_for_child(profile, emotion, top_k)
+    actions, values = arm_values(profile, emotion, policy, rng)
+    order = np.argsort(-values, kind="stable")[:top_k]
+    return [actions[i] for i in order]
+
+
+def recommend_batch(profiles, emotions, top_k=1, rng=None):
+    """
+    Top_k action keys for several (profile, emotion) pairs, e.g. every child
+    in view. Profiles sharing a policy are scored together: their arms are
+    padded into one (children, arms) array and ranked in a single
+    policy_values call. Same output as recommend() per pair under "ucb" and
+    "greedy"; "thompson" draws are independent either way.
+    """
+    picks = [None] * len(profiles)
+    groups = {}
+    for i, profile in enumerate(profiles):
+        groups.setdefault(policy_of(profile), []).append(i)
+
+    for policy, rows in groups.items():
+        if policy == "greedy":
+            ranked = greedy_batch([profiles[i] for i in rows], [emotions[i] for i in rows], top_k)
+        else:
+            arms = [_arms(profiles[i], emotions[i]) for i in rows]
+            width = max(len(a[0]) for a in arms)
+            n, mean, m2, prior = (np.zeros((len(rows), width)) for _ in range(4))
+            valid = np.zeros((len(rows), width), dtype=bool)
+            for r, (actions, *columns) in enumerate(arms):
+                k = len(actions)
+                for out, column in zip((n, mean, m2, prior), columns):
+                    out[r, :k] = column
+                valid[r, :k] = True
+            values = np.where(valid, policy_values(policy, n, mean, m2, prior, rng), -np.inf)
+            order = np.argsort(-values, axis=1, kind="stable")[:, :top_k]
+            ranked = [[arms[r][0][j] for j in row if valid[r, j]] for r, row in enumerate(order)]
+        for i, actions in zip(rows, ranked):
+            picks[i] = actions
+    return picks
+
+
+def feedback(profile, action, before_emotion, after_emotion):
+    """
+    Learn from one interaction outcome.
+    Returns (reward, records) where records are (field, key, value) entries
+    changed in the profile, ready for ProfileStore.record (ProfileStore.update runs it under the lock).
+    """
+    if policy_of(profile) == "greedy":
+        change = apply_feedback(profile, action, before_emotion, after_emotion)
+        return change, [("rec_scores", action, profile["rec_scores"][action])]
+
+    reward = feedback_reward(before_emotion, after_emotion)
+    key = stat_key(before_emotion, action)
+    table = profile.setdefault("bandit", {})
+    table[key] = update_stats(table.get(key), reward)
+    return reward, [("bandit", key, table[key])]
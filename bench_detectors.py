@@ -0,0 +1,115 @@
+"""
+bench_detectors.py
+Compares the emotion_detector backends on the same frames.
+- Each backend runs in a fresh Python process, so import/startup time and
+  memory are measured from a cold start
+- Reports startup (imports + model load + first frame), full-frame
+  detection latency, batched classification latency for several faces,
+  and peak RSS
+
+Usage:
+    python3 bench_detectors.py --source synthetic --frames 100
+    python3 bench_detectors.py --source session.npy --backends onnx
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+T_PROCESS = time.perf_counter()
+
+BATCH_FACES = 4            # faces per frame for the classification benchmark
+
+
+def worker(backend, source_spec, n_frames):
+    """Runs in the child process: benchmark one backend, print JSON on the last line."""
+    import resource
+
+    from emotion_detector import create_detector
+    from frame_source import open_source
+    from pipeline import percentile
+
+    t0 = time.perf_counter()
+    detector = create_detector(backend)
+    source = open_source(source_spec, realtime=False).start()
+    frames = [source.read() for _ in range(n_frames)]
+    detector.detect_emotions(frames[0])
+    startup = time.perf_counter() - t0
+
+    detect, classify = [], []
+    h, w = frames[0].shape[:2]
+    size = min(w, h) // 4
+    boxes = [(x, h // 3, size, size) for x in range(0, w - size, max(1, (w - size) // BATCH_FACES))][:BATCH_FACES]
+    for frame in frames:
+        t = time.perf_counter()
+        detector.detect_emotions(frame)
+        detect.append(time.perf_counter() - t)
+        t = time.perf_counter()
+        detector.detect_emotions(frame, face_rectangles=boxes)
+        classify.append(time.perf_counter() - t)
+    detect.sort()
+    classify.sort()
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = {
+        "backend": backend,
+        "startup_s": startup,
+        "process_s": time.perf_counter() - T_PROCESS,
+        "detect_p50_ms": percentile(detect, 50) * 1000,
+        "detect_p95_ms": percentile(detect, 95) * 1000,
+        "classify_p50_ms": percentile(classify, 50) * 1000,
+        "classify_p95_ms": percentile(classify, 95) * 1000,
+        "faces_per_batch": len(boxes),
+        "peak_rss_mb": peak / 1e6 if sys.platform == "darwin" else peak / 1e3,
+    }
+    print(json.dumps(result))
+
+
+def run(backends, source_spec, n_frames):
+    results = []
+    for backend in backends:
+        cmd = [sys.executable, __file__, "--worker", backend,
+               "--source", source_spec, "--frames", str(n_frames)]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        lines = proc.stdout.strip().splitlines()
+        if proc.returncode != 0 or not lines:
+            err = proc.stderr.strip().splitlines()
+            print(f"[BENCH] {backend}: failed ({err[-1] if err else 'no output'})")
+            continue
+        results.append(json.loads(lines[-1]))
+
+    print(f"[BENCH] {n_frames} frames from {source_spec}")
+    print(f"[BENCH] {'backend':<8} {'startup':>9} {'detect p50/p95 ms':>19} "
+          f"{'classify x' + str(BATCH_FACES) + ' p50/p95 ms':>25} {'peak RSS':>9}")
+    for r in results:
+        print(f"[BENCH] {r['backend']:<8} {r['startup_s']:8.2f}s "
+              f"{r['detect_p50_ms']:9.1f}/{r['detect_p95_ms']:<9.1f} "
+              f"{r['classify_p50_ms']:12.1f}/{r['classify_p95_ms']:<12.1f} "
+              f"{r['peak_rss_mb']:7.0f}MB")
+    return results
+
+
+def main():
+    from emotion_detector import BACKENDS
+
+    parser = argparse.ArgumentParser(description="Benchmark KOKO emotion detector backends")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--source", default="synthetic")
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.source, args.frames)
+        return
+    results = run(args.backends, args.source, args.frames)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+bench_fleet.py
+Load generator for the fleet inference server (inference_server.py).
+- Simulates N robots, each with its own RemoteDetector connection and
+  FaceTracker (full detection every few frames, tracked boxes in between),
+  sending synthetic camera frames at a camera frame rate
+- Runs the server in-process, or targets a running one with --server
+- For each robot count: aggregate frames/sec, per-frame latency
+  p50 / p95 / p99, the slowest and fastest robot (fairness), the server's
+  mean batch size and dropped requests
+
+Usage:
+    python3 bench_fleet.py --backend stub --robots 1 2 4 8
+    python3 bench_fleet.py --backend onnx --workers 2 --fps 10 --seconds 20
+    python3 bench_fleet.py --server 192.168.1.20:9200 --robots 4
+"""
+
+import argparse
+import json
+import threading
+import time
+
+import cv2
+
+from face_tracker import FaceTracker
+from frame_source import SyntheticSource
+from inference_client import RemoteDetector
+from inference_server import InferenceServer
+from pipeline import StageStats, percentile
+
+LORES_SIZE = (320, 240)
+
+
+def robot_loop(index, frames, server, fps, lores, detect_every, t_end, out):
+    """One simulated robot: paced frames through FaceTracker + RemoteDetector."""
+    detector = RemoteDetector(server, robot_name=f"robot-{index:02d}")
+    tracker = FaceTracker(detector, detect_every=detect_every)
+    stats = StageStats(f"robot-{index:02d}", window=100000)
+    errors = 0
+    i = index * 7                  # robots look at different frames
+    t_next = time.monotonic()
+    while time.monotonic() < t_end:
+        if fps:
+            delay = t_next - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            t_next = max(t_next + 1.0 / fps, time.monotonic() - 1.0 / fps)
+        frame = frames[i % len(frames)]
+        i += 1
+        small = cv2.resize(frame, LORES_SIZE, interpolation=cv2.INTER_AREA) if lores else None
+        t0 = time.perf_counter()
+        try:
+            tracker.process(frame, small)
+        except ConnectionError:
+            errors += 1
+            tracker.reset()
+            continue
+        stats.record(time.perf_counter() - t0)
+    detector.close()
+    out[index] = {"stats": stats, "errors": errors, "requests": detector.stats()["requests"]}
+
+
+def run_level(robots, frames, server, fps, seconds, lores, detect_every):
+    out = {}
+    t_end = time.monotonic() + seconds
+    threads = [threading.Thread(target=robot_loop,
+                                args=(i, frames, server, fps, lores, detect_every, t_end, out))
+               for i in range(robots)]
+    t0 = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - t0
+
+    latencies = sorted(x for r in out.values() for x in r["stats"].latencies)
+    per_robot = [r["stats"].count / elapsed for r in out.values()]
+    return {
+        "robots": robots,
+        "fps": sum(per_robot),
+        "requests_per_s": sum(r["requests"] for r in out.values()) / elapsed,
+        "slowest_robot_fps": min(per_robot, default=0.0),
+        "fastest_robot_fps": max(per_robot, default=0.0),
+        "errors": sum(r["errors"] for r in out.values()),
+        "latency_ms": {f"p{q}": percentile(latencies, q) * 1000 for q in (50, 95, 99)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the fleet inference server")
+    parser.add_argument("--server", help="host:port of a running server (default: start one here)")
+    parser.add_argument("--backend", default="stub", choices=("fer", "onnx", "stub"))
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--robots", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--fps", type=float, default=15.0, help="per robot; 0 = as fast as possible")
+    parser.add_argument("--seconds", type=float, default=10.0, help="per robot count")
+    parser.add_argument("--detect-every", type=int, default=10)
+    parser.add_argument("--lores", action="store_true", help="search faces on a 320x240 copy")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    server = None
+    address = args.server
+    if address is None:
+        server = InferenceServer(port=0, backend=args.backend, workers=args.workers,
+                                 max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000).start()
+        address = f"127.0.0.1:{server.port}"
+    frames = SyntheticSource(realtime=False).frames
+
+    results = []
+    try:
+        for robots in args.robots:
+            before = server.stats() if server else None
+            level = run_level(robots, frames, address, args.fps, args.seconds, args.lores,
+                              args.detect_every)
+            if server:
+                after = server.stats()
+                n = after["batches"] - before["batches"]
+                level["mean_batch"] = (after["requests"] - before["requests"]) / n if n else 0.0
+                level["dropped"] = after["dropped"] - before["dropped"]
+            results.append(level)
+            lat = level["latency_ms"]
+            print(f"[BENCH] {robots:3d} robots: {level['fps']:7.1f} frames/s "
+                  f"({level['requests_per_s']:.1f} requests/s), latency p50 {lat['p50']:6.1f} ms  "
+                  f"p95 {lat['p95']:6.1f} ms  p99 {lat['p99']:6.1f} ms, per robot "
+                  f"{level['slowest_robot_fps']:.1f}-{level['fastest_robot_fps']:.1f} fps, "
+                  f"batch {level.get('mean_batch', 0.0):.1f}, {level['errors']} errors")
+    finally:
+        if server:
+            server.stop()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+bench_pipeline.py
+Headless benchmark of KOKO's perception and decision loop.
+- Runs the same Pipeline / FaceTracker / ChildIdentifier / EmotionAggregator / bandit stages
+  as main.py on a FrameSource, with no camera, display or robot attached
+- Frames come from a synthetic generator or a recording, at real-time
+  pace or as fast as the pipeline takes them
+- Reports frames/sec, detection latency percentiles, CPU use and peak memory
+- --adaptive runs the detector under governor.py's motion gate and pacing;
+  --away N makes the child leave for N seconds out of every 2N, to see the
+  CPU saved while nobody is there and how fast KOKO reacts on return
+
+Usage:
+    python3 bench_pipeline.py --source synthetic --seconds 20
+    python3 bench_pipeline.py --source session.npy --realtime
+    python3 bench_pipeline.py --detector onnx
+    python3 bench_pipeline.py --detector none      # capture/pipeline overhead only
+    python3 bench_pipeline.py --detector remote    # against inference_server.py on this machine
+    python3 bench_pipeline.py --detector onnx --realtime --away 10 --adaptive
+"""
+
+import argparse
+import copy
+import json
+import resource
+import sys
+import time
+
+import numpy as np
+
+import bandit_engine
+from child_identity import create_identifier
+from emotion_detector import BACKENDS, create_detector
+from emotion_state import EmotionAggregator
+from face_tracker import FaceTracker
+from frame_source import open_source
+from governor import InferenceGovernor
+from pipeline import Pipeline
+from recommender_engine import DEFAULT_PROFILES
+
+STATS_WINDOW = 100000   # keep every latency sample for the percentiles
+
+
+class NullDetector:
+    """Finds no faces; isolates capture and pipeline overhead from inference."""
+
+    def detect_emotions(self, frame, face_rectangles=None):
+        return []
+
+
+def make_detector(name):
+    if name == "none":
+        return NullDetector()
+    return create_detector(name)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == "darwin" else peak / 1e3   # bytes on macOS, KB on Linux
+
+
+def with_absences(source, away):
+    """
+    (read, release) wrapping the source's so the child is gone for `away`
+    seconds out of every 2 * away. Captured frames that are swapped for the
+    empty scene go straight back to the source; the scene itself never does.
+    """
+    t0 = time.monotonic()
+    empty = {}
+
+    def read():
+        frames = source.read_streams()
+        if int((time.monotonic() - t0) / away) % 2 == 0:
+            return frames
+        source.release(frames)
+        if "scene" not in empty:
+            # A still, face-free scene with the same size and noise level
+            rng = np.random.default_rng(0)
+            shape = frames[0].shape
+            empty["scene"] = np.clip(100 + rng.normal(0, 8, shape), 0, 255).astype(np.uint8)
+        return empty["scene"], None
+
+    def release(frames):
+        if frames[0] is not empty.get("scene"):
+            source.release(frames)
+
+    return read, release
+
+
+def run_benchmark(source, detector, seconds, detect_every=10, adaptive=False, away=None):
+    tracker = FaceTracker(detector, detect_every=detect_every)
+    identifier = create_identifier("child_001")
+    states = EmotionAggregator()
+    profile = copy.deepcopy(DEFAULT_PROFILES["child_001"])
+    governor = InferenceGovernor() if adaptive else None
+
+    def perceive(frames):
+        frame, lores = frames
+        results = tracker.process(frame, lores)
+        identifier.identify(frame, results)
+        states.observe(results)
+        if governor:
+            governor.observe(results)
+        return results
+
+    source.start()
+    if away:
+        read, release = with_absences(source, away)
+    else:
+        read, release = source.read_streams, source.release
+    # Preloaded frames never block, so at max speed only capture what the worker will take
+    on_demand = not getattr(source, "realtime", True) or adaptive
+    pipeline = Pipeline(read, perceive, window=STATS_WINDOW, on_demand=on_demand,
+                        release_fn=release,
+                        gate_fn=governor.admit if governor else None,
+                        pace_fn=governor.delay if governor else None)
+    cpu0, wall0 = time.process_time(), time.monotonic()
+    pipeline.start()
+    decisions = 0
+    previous = None
+    t_end = time.monotonic() + seconds
+    try:
+        while time.monotonic() < t_end:
+            if pipeline.next_result(timeout=0.5) is None:
+                continue
+            emotion, conf = states.current()
+
+            # Decision stage, as in main.py: recommend, then learn from the previous action
+            t0 = time.monotonic()
+            action = bandit_engine.recommend(profile, emotion)[0]
+            if previous is not None:
+                bandit_engine.feedback(profile, previous[1], previous[0], emotion)
+            pipeline.record_action(time.monotonic() - t0)
+            previous = (emotion, action)
+            decisions += 1
+    finally:
+        pipeline.stop()
+        source.stop()
+    cpu_percent = (time.process_time() - cpu0) / (time.monotonic() - wall0) * 100
+
+    summaries = {s["stage"]: s for s in pipeline.report()}
+    capture, inference, e2e = summaries["capture"], summaries["inference"], summaries["end_to_end"]
+    results = {
+        "seconds": seconds,
+        "capture_fps": capture["rate"],
+        "detections_per_sec": inference["rate"],
+        "decisions": decisions,
+        "frames_dropped": capture["dropped"],
+        "inference_ms": {k: inference[f"{k}_ms"] for k in ("p50", "p95", "p99", "max")},
+        "end_to_end_ms": {k: e2e[f"{k}_ms"] for k in ("p50", "p95", "p99", "max")},
+        "tracker": tracker.stats(),
+        "identity": identifier.stats(),
+        "cpu_percent": cpu_percent,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if governor:
+        results["governor"] = governor.stats()
+        results["frames_gated"] = pipeline.gated
+    print(f"[BENCH] capture {results['capture_fps']:.1f} fps, "
+          f"{results['detections_per_sec']:.1f} detections/s, {decisions} decisions")
+    for name in ("inference_ms", "end_to_end_ms"):
+        p = results[name]
+        print(f"[BENCH] {name[:-3]:<11} p50 {p['p50']:7.1f} ms  p95 {p['p95']:7.1f} ms  "
+              f"p99 {p['p99']:7.1f} ms  max {p['max']:7.1f} ms")
+    print(f"[BENCH] CPU {cpu_percent:.0f}%, peak RSS {results['peak_rss_mb']:.0f} MB")
+    if governor:
+        governor.report()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless KOKO pipeline benchmark")
+    parser.add_argument("--source", default="synthetic",
+                        help='"synthetic", "picamera", or a .npy/video/image-directory path')
+    parser.add_argument("--detector", default="fer", choices=BACKENDS + ("remote", "none"))
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--realtime", action="store_true", help="pace recorded frames to their fps")
+    parser.add_argument("--detect-every", type=int, default=10)
+    parser.add_argument("--adaptive", action="store_true", help="gate and pace detection (governor.py)")
+    parser.add_argument("--away", type=float, help="child leaves for this many seconds, every other period")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    kwargs = {} if args.source == "picamera" else {"realtime": args.realtime}
+    source = open_source(args.source, **kwargs)
+    results = run_benchmark(source, make_detector(args.detector), args.seconds, args.detect_every,
+                            args.adaptive, args.away)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
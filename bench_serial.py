@@ -0,0 +1,191 @@
+"""
+bench_serial.py
+Serial link benchmark: RobotController against the koko.ino emulator.
+- No Arduino needed: koko_emulator.py stands in on a pseudo-terminal, so
+  this runs on a laptop or in CI
+- round trip   STATUS request -> reply, one at a time (p50 / p95 / max)
+- throughput   STATUS requests queued back to back, commands/sec
+- burst        many actions sent at once, then a preempting stream of them
+               (binary): how many were coalesced, preempted, finished or
+               failed, and how long the link took to drain
+- Link faults (latency, baud, dropped bytes) and the old blocking firmware
+  can be switched on to see how the controller copes
+
+Usage:
+    python3 bench_serial.py
+    python3 bench_serial.py --protocol text --latency 0.005
+    python3 bench_serial.py --drop 0.01 --json serial.json
+    python3 bench_serial.py --blocking --burst 20
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+from concurrent.futures import CancelledError
+
+from koko_emulator import KokoEmulator
+from robot_controller import DONE_TIMEOUT, RobotController
+from serial_protocol import ACTIONS, BAUD_RATES
+
+BOOT_DELAY = 0.2        # emulated bootloader time; the real board needs ~2 s
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {"p50": 0.0, "p95": 0.0, "max": 0.0}
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {"p50": pick(0.50) * 1000, "p95": pick(0.95) * 1000, "max": ordered[-1] * 1000}
+
+
+def wait_ready(robot, timeout=5.0):
+    """Wait for the controller's reset delay and baud negotiation to finish."""
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            robot.status().result(timeout=1.0)
+            return True
+        except Exception:
+            pass
+    return False
+
+
+def round_trip(robot, count):
+    samples, failed = [], 0
+    for _ in range(count):
+        t0 = time.perf_counter()
+        try:
+            robot.status().result(timeout=2.0)
+            samples.append(time.perf_counter() - t0)
+        except Exception:
+            failed += 1
+    return {"count": count, "failed": failed, **percentiles(samples)}
+
+
+def throughput(robot, count, pipelined=True):
+    """
+    STATUS requests per second. Pipelined sends them all before waiting;
+    the text protocol matches replies by command name, so there they go
+    one at a time.
+    """
+    t0 = time.perf_counter()
+    ok = 0
+    futures = [robot.status() for _ in range(count)] if pipelined else []
+    for i in range(count):
+        try:
+            (futures[i] if pipelined else robot.status()).result(timeout=5.0)
+            ok += 1
+        except Exception:
+            pass
+    elapsed = time.perf_counter() - t0
+    return {"count": count, "ok": ok, "seconds": elapsed, "commands_per_s": ok / elapsed}
+
+
+def burst(robot, count, preempt, interval=0.0):
+    outcomes = {"done": 0, "preempted": 0, "coalesced": 0, "failed": 0}
+    t0 = time.perf_counter()
+    futures = []
+    for i in range(count):
+        futures.append(robot.send_action(ACTIONS[i % len(ACTIONS)], preempt=preempt))
+        time.sleep(interval)
+    for future in futures:
+        try:
+            result = future.result(timeout=DONE_TIMEOUT + 2.0)
+        except CancelledError:
+            outcomes["coalesced"] += 1
+            continue
+        except Exception:
+            outcomes["failed"] += 1
+            continue
+        response = result["response"]
+        if response == "preempted" or str(response).startswith("Interrupted"):
+            outcomes["preempted"] += 1
+        else:
+            outcomes["done"] += 1
+    return {"count": count, "preempt": preempt, "interval_s": interval, **outcomes,
+            "drain_s": time.perf_counter() - t0}
+
+
+def run_benchmark(emulator_args, protocol="binary", target_baud=115200, rounds=200, burst_size=10,
+                  interval=0.02, verbose=False):
+    emulator = KokoEmulator(reset_delay=BOOT_DELAY, **emulator_args).start()
+    # RobotController logs every command; keep the benchmark output readable
+    log = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with log:
+            robot = RobotController(emulator.port, reset_delay=BOOT_DELAY + 0.1,
+                                    protocol=protocol, target_baud=target_baud)
+            if not wait_ready(robot):
+                raise RuntimeError("emulated Arduino never answered")
+            results = {
+                "protocol": protocol,
+                "baud": emulator.baud,
+                "emulator": emulator_args,
+                "round_trip_ms": round_trip(robot, rounds),
+                "throughput": throughput(robot, rounds, pipelined=protocol == "binary"),
+                "burst": burst(robot, burst_size, preempt=False),
+            }
+            if protocol == "binary":
+                results["burst_preempt"] = burst(robot, burst_size, preempt=True, interval=interval)
+            results["controller"] = robot.stats()
+            robot.close()
+        results["link"] = dict(emulator.counts)
+    finally:
+        emulator.stop()
+    return results
+
+
+def print_results(r):
+    rt = r["round_trip_ms"]
+    print(f"[BENCH] {r['protocol']} protocol at {r['baud']} baud, emulator {r['emulator']}")
+    print(f"[BENCH] round trip   p50 {rt['p50']:6.2f} ms  p95 {rt['p95']:6.2f} ms  "
+          f"max {rt['max']:6.2f} ms  ({rt['failed']} failed)")
+    print(f"[BENCH] throughput   {r['throughput']['commands_per_s']:7.1f} commands/s "
+          f"({r['throughput']['ok']}/{r['throughput']['count']} answered)")
+    for key in ("burst", "burst_preempt"):
+        if key in r:
+            b = r[key]
+            print(f"[BENCH] {key:<12} {b['count']} actions: {b['done']} done, {b['preempted']} preempted, "
+                  f"{b['coalesced']} coalesced, {b['failed']} failed, drained in {b['drain_s']:.2f}s")
+    link = r["link"]
+    print(f"[BENCH] link         {link['bytes_in']} B in, {link['bytes_out']} B out, "
+          f"{link['dropped']} dropped, {link['overflow']} overflowed, {link['bad_frames']} bad frames")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the serial link against the koko.ino emulator")
+    parser.add_argument("--protocol", default="binary", choices=("binary", "text"))
+    parser.add_argument("--target-baud", type=int, default=115200, choices=BAUD_RATES)
+    parser.add_argument("--max-baud", type=int, default=max(BAUD_RATES), choices=BAUD_RATES,
+                        help="highest rate the emulated board accepts")
+    parser.add_argument("--latency", type=float, default=0.0, help="one-way latency, seconds")
+    parser.add_argument("--drop", type=float, default=0.0, help="byte drop probability")
+    parser.add_argument("--step-ms", type=int, default=50, help="motion step length on the emulator")
+    parser.add_argument("--blocking", action="store_true", help="emulate the old delay()-based firmware")
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--interval", type=float, default=0.02, help="seconds between preempting actions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="show RobotController's log")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    emulator_args = {"latency": args.latency, "max_baud": args.max_baud, "drop_rate": args.drop,
+                     "step_ms": args.step_ms, "blocking": args.blocking, "seed": args.seed}
+    try:
+        results = run_benchmark(emulator_args, args.protocol, args.target_baud,
+                                args.rounds, args.burst, args.interval, args.verbose)
+    except RuntimeError as e:
+        print(f"[BENCH] Failed: {e}")
+        sys.exit(1)
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,16 @@
-from picamera2 import Picamera2
+from frame_source import PicameraSource
 import cv2
 
-picam2 = Picamera2()
-picam2.configure(picam2.create_preview_configuration(
-    main={"format": "XRGB8888", "size": (640, 480)}
-))
-picam2.start()
+camera = PicameraSource(size=(640, 480), color="bgr", warmup=0)  # upright, BGR for imshow
+camera.start()
 
 while True:
-    frame = picam2.capture_array()
-    frame = cv2.rotate(frame, cv2.ROTATE_180)  # ?? Rotate 180 degrees
+    frame = camera.read()
     cv2.imshow("RPi 5 Camera", frame)
+    camera.release(frame)  # buffer is reused for a later frame
     
     if cv2.waitKey(1) & 0xFF == ord('q'):
         break
 
+camera.stop()
 cv2.destroyAllWindows()
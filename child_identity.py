@@ -0,0 +1,308 @@
+"""
+child_identity.py
+Works out which child each tracked face belongs to.
+- A face crop becomes a small L2-normalised embedding: OpenCV's SFace
+  recognizer if models/ has it, otherwise a grid of local-binary-pattern
+  histograms that needs no model at all
+- Reference embeddings per child live in an in-memory nearest-neighbour
+  index (cosine similarity), saved to child_faces.npz
+- Identification runs once per FaceTracker track: the answer is cached by
+  track_id, so later frames of the same face cost a dict lookup
+- Faces that match nobody are routed to a default child
+
+Enroll a child from the camera (or a recording):
+    python3 child_identity.py --enroll child_002 --samples 20
+    python3 child_identity.py --list
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from emotion_detector import MODEL_DIR
+
+INDEX_PATH = Path(__file__).with_name("child_faces.npz")
+SFACE_MODEL = "face_recognition_sface_2021dec.onnx"
+SFACE_SIZE = 112           # SFace input: 112x112 colour crop
+LBP_SIZE = 64              # LBP crop side; split into LBP_GRID x LBP_GRID cells
+LBP_GRID = 4
+LBP_BINS = 32              # 256 patterns folded into 32 bins per cell
+MATCH_THRESHOLD = {        # minimum cosine similarity to accept a match
+    "sface": 0.363,        # OpenCV's recommended SFace threshold
+    "lbp": 0.9,
+}
+ID_RETRIES = 5             # frames an unmatched track is retried before it stays unknown
+CACHE_MAX_AGE = 5.0        # seconds; cached identities of unseen tracks are dropped
+
+
+def _crop(frame, box, margin=0.0):
+    h, w = frame.shape[:2]
+    x, y, bw, bh = (int(v) for v in box)
+    mx, my = int(bw * margin), int(bh * margin)
+    x0, y0 = max(0, x - mx), max(0, y - my)
+    x1, y1 = min(w, x + bw + mx), min(h, y + bh + my)
+    return frame[y0:y1, x0:x1] if x1 > x0 and y1 > y0 else frame
+
+
+def _normalise(rows):
+    norms = np.linalg.norm(rows, axis=1, keepdims=True)
+    return rows / np.maximum(norms, 1e-12)
+
+
+# ---------------- Embedders ----------------
+
+class LBPEmbedder:
+    """Grid of LBP histograms over a grayscale face crop; cheap and model-free."""
+
+    name = "lbp"
+    dim = LBP_GRID * LBP_GRID * LBP_BINS
+
+    def __init__(self, color="rgb"):
+        self.gray_code = cv2.COLOR_RGB2GRAY if color == "rgb" else cv2.COLOR_BGR2GRAY
+        cell = LBP_SIZE // LBP_GRID
+        self.cell = cell
+        self.offsets = (np.arange(LBP_GRID * LBP_GRID) * LBP_BINS)[:, None]
+
+    def embed(self, frame, boxes):
+        """(n, dim) float32 embeddings, one row per (x, y, w, h) box."""
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, self.gray_code)
+        out = np.empty((len(boxes), self.dim), dtype=np.float32)
+        size = LBP_SIZE + 2
+        for i, box in enumerate(boxes):
+            crop = cv2.resize(_crop(gray, box), (size, size), interpolation=cv2.INTER_AREA)
+            crop = cv2.equalizeHist(crop)
+            centre = crop[1:-1, 1:-1]
+            code = np.zeros((LBP_SIZE, LBP_SIZE), dtype=np.uint8)
+            for bit, (dy, dx) in enumerate(((-1, -1), (-1, 0), (-1, 1), (0, 1),
+                                            (1, 1), (1, 0), (1, -1), (0, -1))):
+                neighbour = crop[1 + dy:1 + dy + LBP_SIZE, 1 + dx:1 + dx + LBP_SIZE]
+                code |= (neighbour >= centre).astype(np.uint8) << bit
+            cells = (code >> 3).reshape(LBP_GRID, self.cell, LBP_GRID, self.cell)
+            cells = cells.transpose(0, 2, 1, 3).reshape(LBP_GRID * LBP_GRID, -1)
+            hist = np.bincount((cells + self.offsets).ravel(), minlength=self.dim)
+            out[i] = np.sqrt(hist)
+        return _normalise(out)
+
+
+class SFaceEmbedder:
+    """OpenCV Zoo SFace recognizer (128-d); all crops of a frame in one forward pass."""
+
+    name = "sface"
+    dim = 128
+
+    def __init__(self, path, color="rgb"):
+        self.net = cv2.dnn.readNetFromONNX(str(path))
+        # The model expects RGB input; blobFromImages swaps channels for BGR frames
+        self.swap_rb = color == "bgr"
+
+    def embed(self, frame, boxes):
+        crops = [cv2.resize(_crop(frame, box, margin=0.1), (SFACE_SIZE, SFACE_SIZE))
+                 for box in boxes]
+        if frame.ndim == 2:
+            crops = [cv2.cvtColor(c, cv2.COLOR_GRAY2BGR) for c in crops]
+        blob = cv2.dnn.blobFromImages(crops, 1.0, (SFACE_SIZE, SFACE_SIZE), swapRB=self.swap_rb)
+        self.net.setInput(blob)
+        return _normalise(self.net.forward().reshape(len(boxes), -1).astype(np.float32))
+
+
+def create_embedder(model_dir=MODEL_DIR, color="rgb"):
+    """SFace if its model file is present, otherwise the LBP embedder."""
+    path = Path(model_dir) / SFACE_MODEL
+    if path.exists():
+        return SFaceEmbedder(path, color)
+    return LBPEmbedder(color)
+
+
+# ---------------- Index ----------------
+
+class ChildIndex:
+    """
+    Reference embeddings for every enrolled child, several per child.
+    query() is a brute-force cosine nearest-neighbour search: one matrix
+    product for all faces, which stays well under a millisecond for a
+    household's worth of children.
+    """
+
+    def __init__(self, embedder_name, dim):
+        self.embedder_name = embedder_name
+        self.labels = []
+        self.matrix = np.zeros((0, dim), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def children(self):
+        return sorted(set(self.labels))
+
+    def add(self, child_id, embeddings):
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        self.matrix = np.vstack([self.matrix, embeddings])
+        self.labels.extend([child_id] * len(embeddings))
+
+    def remove(self, child_id):
+        keep = [i for i, label in enumerate(self.labels) if label != child_id]
+        self.matrix = self.matrix[keep]
+        self.labels = [self.labels[i] for i in keep]
+
+    def query(self, embeddings, threshold):
+        """[(child_id or None, similarity), ...], one per embedding row."""
+        if not len(embeddings):
+            return []
+        if not self.labels:
+            return [(None, 0.0)] * len(embeddings)
+        sims = embeddings @ self.matrix.T
+        best = sims.argmax(axis=1)
+        scores = sims[np.arange(len(best)), best]
+        return [(self.labels[j] if s >= threshold else None, float(s))
+                for j, s in zip(best, scores)]
+
+    def save(self, path=INDEX_PATH):
+        np.savez(path, embedder=self.embedder_name, labels=np.array(self.labels),
+                 matrix=self.matrix)
+
+    @classmethod
+    def load(cls, embedder, path=INDEX_PATH):
+        """Load the index built with this embedder; empty if missing or built with another."""
+        index = cls(embedder.name, embedder.dim)
+        path = Path(path)
+        if not path.exists():
+            return index
+        data = np.load(path)
+        if str(data["embedder"]) != embedder.name or data["matrix"].shape[1] != embedder.dim:
+            print(f"[IDENTITY] {path} was built with {data['embedder']}, not {embedder.name}; "
+                  "re-enroll the children")
+            return index
+        index.labels = [str(label) for label in data["labels"]]
+        index.matrix = data["matrix"].astype(np.float32)
+        return index
+
+
+# ---------------- Per-track identification ----------------
+
+class ChildIdentifier:
+    """
+    Sets face['child_id'] on FaceTracker results. Faces of new tracks are
+    embedded together in one batch and looked up in the index; the answer
+    is cached per track_id. A track that matches nobody is retried for
+    `retries` frames (the first crop may be blurred or turned away), then
+    stays on `default_child`.
+    """
+
+    def __init__(self, embedder, index, default_child, retries=ID_RETRIES, max_age=CACHE_MAX_AGE):
+        self.embedder = embedder
+        self.index = index
+        self.default_child = default_child
+        self.threshold = MATCH_THRESHOLD.get(embedder.name, 0.5)
+        self.retries = retries
+        self.max_age = max_age
+        self.cache = {}           # track_id -> {"child", "similarity", "attempts", "seen"}
+        self.lookups = 0
+        self.hits = 0
+
+    def identify(self, frame, faces, t=None):
+        t = time.monotonic() if t is None else t
+        pending = []
+        for face in faces:
+            if face.get('track_id') is None:
+                continue
+            entry = self.cache.get(face['track_id'])
+            if entry is None or (entry["child"] is None and entry["attempts"] < self.retries):
+                pending.append(face)
+            else:
+                self.hits += 1
+
+        if pending and len(self.index):
+            embeddings = self.embedder.embed(frame, [face['box'] for face in pending])
+            self.lookups += len(pending)
+            for face, (child, similarity) in zip(pending, self.index.query(embeddings, self.threshold)):
+                entry = self.cache.setdefault(face['track_id'], {"child": None, "similarity": 0.0,
+                                                                 "attempts": 0, "seen": t})
+                entry["attempts"] += 1
+                if child is not None:
+                    entry["child"] = child
+                    entry["similarity"] = similarity
+                    print(f"[IDENTITY] Track {face['track_id']} is {child} (similarity {similarity:.2f})")
+
+        for face in faces:
+            entry = self.cache.get(face.get('track_id'))
+            if entry is not None:
+                entry["seen"] = t
+            child = entry["child"] if entry else None
+            face['child_id'] = child or self.default_child
+            face['identified'] = child is not None
+
+        stale = [k for k, e in self.cache.items() if t - e["seen"] > self.max_age]
+        for key in stale:
+            del self.cache[key]
+        return faces
+
+    def stats(self):
+        return {"lookups": self.lookups, "cache_hits": self.hits, "cached_tracks": len(self.cache)}
+
+
+def create_identifier(default_child, model_dir=MODEL_DIR, index_path=INDEX_PATH, color="rgb"):
+    embedder = create_embedder(model_dir, color)
+    index = ChildIndex.load(embedder, index_path)
+    print(f"[IDENTITY] {embedder.name} embeddings, {len(index)} references for "
+          f"{len(index.children())} children")
+    return ChildIdentifier(embedder, index, default_child)
+
+
+# ---------------- Enrollment ----------------
+
+def enroll(child_id, source, detector, samples=20, interval=0.2, index_path=INDEX_PATH):
+    """Add `samples` embeddings of the largest face in view to the index under child_id."""
+    embedder = create_embedder()
+    index = ChildIndex.load(embedder, index_path)
+    collected = []
+    last = 0.0
+    source.start()
+    try:
+        while len(collected) < samples:
+            frame = source.read()
+            if time.monotonic() - last >= interval:
+                boxes = detector.find_faces(frame)
+                if boxes:
+                    box = max(boxes, key=lambda b: b[2]*b[3])
+                    collected.append(embedder.embed(frame, [box])[0])
+                    last = time.monotonic()
+                    print(f"[IDENTITY] {child_id}: sample {len(collected)}/{samples}")
+            source.release(frame)
+    finally:
+        source.stop()
+    index.add(child_id, np.array(collected))
+    index.save(index_path)
+    print(f"[IDENTITY] Enrolled {child_id}; index has {len(index)} references")
+    return index
+
+
+def main():
+    from emotion_detector import BACKENDS, create_detector
+    from frame_source import open_source
+
+    parser = argparse.ArgumentParser(description="Enroll children for KOKO face identification")
+    parser.add_argument("--enroll", metavar="CHILD_ID", help="child id from profiles.json")
+    parser.add_argument("--remove", metavar="CHILD_ID")
+    parser.add_argument("--list", action="store_true")
+    parser.add_argument("--samples", type=int, default=20)
+    parser.add_argument("--source", default="picamera")
+    parser.add_argument("--detector", default="onnx", choices=BACKENDS)
+    args = parser.parse_args()
+
+    if args.enroll:
+        enroll(args.enroll, open_source(args.source), create_detector(args.detector), args.samples)
+    index = ChildIndex.load(create_embedder())
+    if args.remove:
+        index.remove(args.remove)
+        index.save()
+        print(f"[IDENTITY] Removed {args.remove}")
+    if args.list or not (args.enroll or args.remove):
+        for child in index.children():
+            print(f"[IDENTITY] {child}: {index.labels.count(child)} references")
+
+
+if __name__ == "__main__":
+    main()
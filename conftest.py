@@ -0,0 +1,2 @@
+# camera_test.py is a hands-on PiCamera script, not a test module
+collect_ignore = ["camera_test.py"]
@@ -2,138 +2,392 @@
 display_eyes_reactive.py
 Emotion-reactive glowing rectangular eyes using Pygame.
 Robot reacts visually to user's detected emotion.
+Composited glow+eye sprites are prerendered once and cached (LRU);
+each frame only the regions the eyes occupied are redrawn.
+A dedicated render thread owns the window and its events and draws at a
+fixed, paced frame rate; callers only hand over the emotion to show.
+Emotion changes tween smoothly (height, tilt, color, blink) with easing.
+While a video plays (media_engine.py), its frames replace the eyes.
 Press ESC or Q to exit safely.
 """
 
 import pygame
 import time
 import math
+import queue
 import threading
-import sys
+from collections import OrderedDict
+
+import profiler
+
+SPRITE_CACHE_SIZE = 160   # prerendered eye sprites kept in memory (LRU)
+HEIGHT_STEP = 8           # eye heights are quantized to this many pixels for caching
+TARGET_FPS = 60
+FRAME_BUCKETS_MS = (2, 4, 8, 16, 33, 50, 100)   # frame-time histogram upper bounds
+TRANSITION_TIME = 0.35    # seconds to tween between emotions
+TWEEN_STEPS = 8           # color/tilt transition steps (keeps sprites cacheable)
+
+# Visual style for each emotion
+EMOTION_STYLES = {
+    "happy":    {"height": 0.45, "tilt": 0,  "color": (0, 255, 180), "blink": 0.2, "brightness": 1.0},
+    "sad":      {"height": 0.25, "tilt": 10, "color": (100, 150, 255), "blink": 0.2, "brightness": 0.7},
+    "angry":    {"height": 0.55, "tilt": -10, "color": (255, 60, 60), "blink": 0.5, "brightness": 1.0},
+    "neutral":  {"height": 0.4, "tilt": 0,  "color": (180, 180, 255), "blink": 0.2, "brightness": 0.8},
+    "surprise": {"height": 0.6, "tilt": 0,  "color": (255, 255, 100), "blink": 0.3, "brightness": 1.0},
+    "fear":     {"height": 0.3, "tilt": 0,  "color": (200, 100, 255), "blink": 0.2, "brightness": 0.8}
+}
+
+
+def ease_in_out(f):
+    """Cubic ease-in-out on [0, 1]."""
+    return 4 * f * f * f if f < 0.5 else 1 - (-2 * f + 2) ** 3 / 2
+
+
+def compile_style(style):
+    """Flatten a style into (height, tilt, r, g, b, blink) with brightness applied."""
+    r, g, b = (int(c * style["brightness"]) for c in style["color"])
+    return (style["height"], style["tilt"], r, g, b, style["blink"])
+
+
+class EmotionTween:
+    """
+    Interpolates compiled eye parameters from the current state to the
+    target emotion over `duration` seconds. Evaluation updates one reused
+    list in place. Color and tilt move in TWEEN_STEPS discrete steps so the
+    in-between sprites can be cached too.
+    """
+
+    def __init__(self, duration=TRANSITION_TIME, easing=ease_in_out, steps=TWEEN_STEPS):
+        self.duration = duration
+        self.easing = easing
+        self.steps = steps
+        self.table = {emo: compile_style(style) for emo, style in EMOTION_STYLES.items()}
+        self.default = self.table["neutral"]
+        self.emotion = "neutral"
+        self.prev_emotion = "neutral"
+        self.target = self.default
+        self.start = list(self.default)
+        self.current = list(self.default)
+        self.t0 = 0.0
+        self.eased = 1.0
+
+    def set_target(self, emotion, now):
+        if emotion == self.emotion:
+            return
+        self.start[:] = self.current
+        self.prev_emotion = self.emotion
+        self.emotion = emotion
+        self.target = self.table.get(emotion, self.default)
+        self.t0 = now
+
+    def evaluate(self, now):
+        """Return the parameter list for time `now` (same list object every call)."""
+        f = (now - self.t0) / self.duration if self.duration > 0 else 1.0
+        cur = self.current
+        if f >= 1.0:
+            cur[:] = self.target
+            self.eased = 1.0
+            return cur
+        e = self.easing(max(f, 0.0))
+        eq = round(e * self.steps) / self.steps
+        start, target = self.start, self.target
+        cur[0] = start[0] + (target[0] - start[0]) * e
+        for i in (1, 2, 3, 4):
+            cur[i] = start[i] + (target[i] - start[i]) * eq
+        cur[5] = start[5] + (target[5] - start[5]) * e
+        self.eased = e
+        return cur
+
+
+class SpriteCache:
+    """Bounded LRU cache of prerendered eye sprites."""
+
+    def __init__(self, max_items=SPRITE_CACHE_SIZE):
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, render):
+        sprite = self.items.get(key)
+        if sprite is not None:
+            self.items.move_to_end(key)
+            self.hits += 1
+            return sprite
+        self.misses += 1
+        sprite = render()
+        self.items[key] = sprite
+        if len(self.items) > self.max_items:
+            self.items.popitem(last=False)
+        return sprite
+
+
+class FrameStats:
+    """Frame-time histogram and dropped-frame count for the render loop."""
+
+    def __init__(self, target_fps):
+        self.target_fps = target_fps
+        self.buckets = [0] * (len(FRAME_BUCKETS_MS) + 1)
+        self.frames = 0
+        self.dropped = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, frame_time):
+        ms = frame_time * 1000
+        i = 0
+        while i < len(FRAME_BUCKETS_MS) and ms > FRAME_BUCKETS_MS[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.frames += 1
+        self.total_time += frame_time
+        self.max_time = max(self.max_time, frame_time)
+
+    def summary(self):
+        labels = [f"<={b}ms" for b in FRAME_BUCKETS_MS] + [f">{FRAME_BUCKETS_MS[-1]}ms"]
+        return {
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "avg_ms": self.total_time / self.frames * 1000 if self.frames else 0.0,
+            "max_ms": self.max_time * 1000,
+            "histogram": dict(zip(labels, self.buckets)),
+        }
+
 
 class EyeDisplay:
-    def __init__(self, width=1024, height=768, fullscreen=False):
-        pygame.init()
+    def __init__(self, width=1024, height=768, fullscreen=False, target_fps=TARGET_FPS,
+                 height_step=HEIGHT_STEP, cache_size=SPRITE_CACHE_SIZE,
+                 transition_time=TRANSITION_TIME):
         self.width = width
         self.height = height
-        flags = pygame.FULLSCREEN if fullscreen else 0
-        self.screen = pygame.display.set_mode((width, height), flags)
-        pygame.display.set_caption("KOKO Emotion-Reactive Eyes")
-        self.clock = pygame.time.Clock()
+        self.fullscreen = fullscreen
+        self.target_fps = target_fps
         self.running = True
         self.current_emotion = "neutral"
-        self.lock = threading.Lock()
         self.bg_color = (10, 10, 20)
-        self._start_thread()
+        self.height_step = height_step
+        self.sprites = SpriteCache(cache_size)
+        self.tween = EmotionTween(transition_time)
+        self.stats = FrameStats(target_fps)
+        self._blink_phase = 0.0
+        self._last_t = None
+        self.screen = None
+        self._prev_rects = []
+        self._full_redraw = True
+        self._keys = queue.Queue()
+        self.video = None          # VideoStream shown instead of the eyes
+        self._video_buf = None
+        self._ready = threading.Event()
+        self._error = None         # why the window could not be opened
+        self._thread = threading.Thread(target=self._render_loop, daemon=True)
+        self._thread.start()
+        if not self._ready.wait(timeout=5.0):
+            self.running = False
+            raise RuntimeError("display window did not open within 5 s")
+        if self._error is not None:
+            raise self._error
 
-    def _start_thread(self):
-        """Start background thread for key handling."""
-        thread = threading.Thread(target=self._event_loop, daemon=True)
-        thread.start()
+    def _render_loop(self):
+        """Own the window: create it, pace frames, draw and handle events."""
+        try:
+            pygame.init()
+            flags = pygame.FULLSCREEN if self.fullscreen else 0
+            self.screen = pygame.display.set_mode((self.width, self.height), flags)
+            pygame.display.set_caption("KOKO Emotion-Reactive Eyes")
+        except Exception as e:
+            # No display or a bad driver: __init__ re-raises it on the caller's thread
+            self._error = e
+            self.running = False
+            return
+        finally:
+            self._ready.set()
 
-    def _event_loop(self):
-        """Handle ESC/Q press to quit."""
+        period = 1.0 / self.target_fps
+        next_frame = time.monotonic()
         while self.running:
-            for ev in pygame.event.get():
-                if ev.type == pygame.QUIT:
-                    self.stop()
-                elif ev.type == pygame.KEYDOWN:
-                    if ev.key in (pygame.K_ESCAPE, pygame.K_q):
-                        self.stop()
-            time.sleep(0.02)
+            self._handle_events()
+            t0 = time.monotonic()
+            dirty = self.draw_frame(time.monotonic())
+            if self._full_redraw:
+                pygame.display.flip()
+                self._full_redraw = False
+            else:
+                pygame.display.update(dirty)
+            self.stats.record(time.monotonic() - t0)
+            profiler.record("display.frame", time.monotonic() - t0)
+
+            # Frame pacing: sleep to the next slot; if we overran, count the
+            # slots we missed and resynchronise instead of bursting to catch up
+            next_frame += period
+            delay = next_frame - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                missed = int(-delay // period)
+                if missed:
+                    self.stats.dropped += missed
+                    next_frame = time.monotonic()
+        pygame.quit()
+
+    def _handle_events(self):
+        """ESC/Q or closing the window quits; other key presses go to poll_keys()."""
+        for ev in pygame.event.get():
+            if ev.type == pygame.QUIT:
+                self.running = False
+            elif ev.type == pygame.KEYDOWN:
+                if ev.key in (pygame.K_ESCAPE, pygame.K_q):
+                    self.running = False
+                else:
+                    self._keys.put(ev.key)
+
+    def poll_keys(self):
+        """Return key presses (pygame key codes) received since the last call."""
+        keys = []
+        while True:
+            try:
+                keys.append(self._keys.get_nowait())
+            except queue.Empty:
+                return keys
 
     def stop(self):
         self.running = False
-        pygame.quit()
-        sys.exit(0)
 
     def show_emotion(self, emotion):
-        with self.lock:
-            self.current_emotion = emotion
-
-    def _emotion_params(self, emotion):
-        """Define visual style for each emotion."""
-        params = {
-            "happy":    {"height": 0.45, "tilt": 0,  "color": (0, 255, 180), "blink": 0.2, "brightness": 1.0},
-            "sad":      {"height": 0.25, "tilt": 10, "color": (100, 150, 255), "blink": 0.2, "brightness": 0.7},
-            "angry":    {"height": 0.55, "tilt": -10, "color": (255, 60, 60), "blink": 0.5, "brightness": 1.0},
-            "neutral":  {"height": 0.4, "tilt": 0,  "color": (180, 180, 255), "blink": 0.2, "brightness": 0.8},
-            "surprise": {"height": 0.6, "tilt": 0,  "color": (255, 255, 100), "blink": 0.3, "brightness": 1.0},
-            "fear":     {"height": 0.3, "tilt": 0,  "color": (200, 100, 255), "blink": 0.2, "brightness": 0.8}
-        }
-        return params.get(emotion, params["neutral"])
+        # Single reference assignment; the render thread picks it up next frame
+        self.current_emotion = emotion
 
-    def draw_eyes(self, t):
-        with self.lock:
-            emo = self.current_emotion
-        p = self._emotion_params(emo)
+    def play_video(self, stream):
+        """Show a VideoStream's frames instead of the eyes until it ends."""
+        self.video = stream
 
-        self.screen.fill(self.bg_color)
-        margin_x = int(self.width * 0.18)
-        eye_w = int(self.width * 0.25)
-        eye_h = int(self.height * p["height"])
-        base_left_center = (margin_x + eye_w//2, self.height//2)
-        base_right_center = (self.width - margin_x - eye_w//2, self.height//2)
+    def stop_video(self, stream=None):
+        """Back to the eyes (only if `stream`, when given, is the one showing)."""
+        if stream is None or self.video is stream:
+            self.video = None
 
-        # Subtle movement animations per emotion
+    def draw_frame(self, t):
+        """Draw the video frame or the eyes for time t; returns the dirty rects."""
+        video = self.video
+        if video is not None and not video.done:
+            frame = video.frame(t)
+            if frame is None:
+                return []
+            size = self.screen.get_size()
+            if self._video_buf is None or self._video_buf.get_size() != size:
+                self._video_buf = pygame.Surface(size, 0, frame)
+            pygame.transform.scale(frame, size, self._video_buf)
+            self.screen.blit(self._video_buf, (0, 0))
+            self._full_redraw = True       # the eyes repaint the whole screen afterwards
+            return [self.screen.get_rect()]
+        if video is not None:
+            self.stop_video(video)
+        return self.draw_eyes(t)
+
+    def _motion_offset(self, emo, t):
+        """Subtle movement animation per emotion: (left dx, left dy, right dx, right dy)."""
         if emo == "happy":
             jitter_x = int(8 * math.sin(t * 10))
             jitter_y = int(5 * math.cos(t * 8))
-            left_center = (base_left_center[0] + jitter_x, base_left_center[1] + jitter_y)
-            right_center = (base_right_center[0] + jitter_x, base_right_center[1] + jitter_y)
+            return jitter_x, jitter_y, jitter_x, jitter_y
         elif emo == "sad":
-            left_center = (base_left_center[0], base_left_center[1] + 20)
-            right_center = (base_right_center[0], base_right_center[1] + 20)
+            return 0, 20, 0, 20
         elif emo == "angry":
             offset = int(10 * math.sin(t * 15))
-            left_center = (base_left_center[0] - offset, base_left_center[1])
-            right_center = (base_right_center[0] + offset, base_right_center[1])
+            return -offset, 0, offset, 0
         elif emo == "surprise":
             offset = int(8 * math.sin(t * 20))
-            left_center = (base_left_center[0], base_left_center[1] - offset)
-            right_center = (base_right_center[0], base_right_center[1] - offset)
-        else:
-            left_center = base_left_center
-            right_center = base_right_center
+            return 0, -offset, 0, -offset
+        return 0, 0, 0, 0
+
+    def draw_eyes(self, t):
+        """Draw one frame for monotonic time t; returns the dirty rects."""
+        tween = self.tween
+        tween.set_target(self.current_emotion, t)
+        height, tilt, r, g, b, blink = tween.evaluate(t)
+        emo = tween.emotion
+
+        margin_x = int(self.width * 0.18)
+        eye_w = int(self.width * 0.25)
+        eye_h = int(self.height * height)
+        base_left_center = (margin_x + eye_w//2, self.height//2)
+        base_right_center = (self.width - margin_x - eye_w//2, self.height//2)
 
-        # Blink (for angry/fear)
+        # Movement animation, blended from the previous emotion's during a transition
+        lx, ly, rx, ry = self._motion_offset(emo, t)
+        if tween.eased < 1.0:
+            e = tween.eased
+            plx, ply, prx, pry = self._motion_offset(tween.prev_emotion, t)
+            lx, ly = int(plx + (lx - plx) * e), int(ply + (ly - ply) * e)
+            rx, ry = int(prx + (rx - prx) * e), int(pry + (ry - pry) * e)
+        left_center = (base_left_center[0] + lx, base_left_center[1] + ly)
+        right_center = (base_right_center[0] + rx, base_right_center[1] + ry)
+
+        # Blink: integrate the phase so rate changes never jump the lids
+        dt = t - self._last_t if self._last_t is not None else 0.0
+        self._last_t = t
+        self._blink_phase += blink * 5 * dt
         blink_open = 1.0
-        if p["blink"] > 0:
-            blink_open = abs(math.sin(t * p["blink"] * 5))
-            blink_open = max(0.2, blink_open)
+        if blink > 0:
+            blink_open = max(0.2, abs(math.sin(self._blink_phase)))
 
-        # Draw both eyes
+        # Draw both eyes: clear where they were last frame, blit cached sprites
+        eye_h_q = max(self.height_step,
+                      int(eye_h * blink_open) // self.height_step * self.height_step)
+        color = (int(r), int(g), int(b))
+        tilt = round(tilt, 1)
+        if self._full_redraw:
+            self.screen.fill(self.bg_color)
+        else:
+            for rect in self._prev_rects:
+                self.screen.fill(self.bg_color, rect)
+        dirty = self._prev_rects
+        self._prev_rects = []
         for i, center in enumerate([left_center, right_center]):
-            cx, cy = center
-            rect_h = int(eye_h * blink_open)
-            tilt = p["tilt"]
-            color = tuple(int(c * p["brightness"]) for c in p["color"])
-
-            # Glow effect
-            for glow in range(4, 0, -1):
-                alpha = max(20, 60 - glow * 10)
-                glow_rect = pygame.Surface((eye_w + glow*10, rect_h + glow*6), pygame.SRCALPHA)
-                glow_color = (*color, alpha)
-                pygame.draw.rect(glow_rect, glow_color, glow_rect.get_rect(), border_radius=20)
-                rotated = pygame.transform.rotate(glow_rect, tilt if i == 0 else -tilt)
-                rect = rotated.get_rect(center=(cx, cy))
-                self.screen.blit(rotated, rect)
-
-            # Main eye
-            eye_surface = pygame.Surface((eye_w, rect_h), pygame.SRCALPHA)
-            pygame.draw.rect(eye_surface, color, eye_surface.get_rect(), border_radius=20)
-            rotated_eye = pygame.transform.rotate(eye_surface, tilt if i == 0 else -tilt)
-            rect = rotated_eye.get_rect(center=(cx, cy))
-            self.screen.blit(rotated_eye, rect)
-
-    def update(self, fps=30):
-        t = time.time()
-        self.draw_eyes(t)
-        pygame.display.flip()
-        self.clock.tick(fps)
+            angle = tilt if i == 0 else -tilt
+            sprite = self.sprites.get((color, eye_h_q, angle),
+                                      lambda: self._render_eye(eye_w, eye_h_q, color, angle))
+            rect = self.screen.blit(sprite, sprite.get_rect(center=center))
+            self._prev_rects.append(rect)
+        return dirty + self._prev_rects
+
+    def _render_eye(self, eye_w, rect_h, color, angle):
+        """Composite the glow layers and main eye, rotated, onto the background color."""
+        layers = []
+        # Glow effect
+        for glow in range(4, 0, -1):
+            alpha = max(20, 60 - glow * 10)
+            glow_rect = pygame.Surface((eye_w + glow*10, rect_h + glow*6), pygame.SRCALPHA)
+            glow_color = (*color, alpha)
+            pygame.draw.rect(glow_rect, glow_color, glow_rect.get_rect(), border_radius=20)
+            layers.append(pygame.transform.rotate(glow_rect, angle))
+
+        # Main eye
+        eye_surface = pygame.Surface((eye_w, rect_h), pygame.SRCALPHA)
+        pygame.draw.rect(eye_surface, color, eye_surface.get_rect(), border_radius=20)
+        layers.append(pygame.transform.rotate(eye_surface, angle))
+
+        # Same per-layer centering as blitting each layer at the eye center
+        w = max(layer.get_width() for layer in layers)
+        h = max(layer.get_height() for layer in layers)
+        sprite = pygame.Surface((w, h)).convert()
+        sprite.fill(self.bg_color)
+        for layer in layers:
+            sprite.blit(layer, (w//2 - layer.get_width()//2, h//2 - layer.get_height()//2))
+        return sprite
+
+    def report(self):
+        s = self.stats.summary()
+        print(f"[DISPLAY] {s['frames']} frames, {s['dropped']} dropped, "
+              f"avg {s['avg_ms']:.2f} ms, max {s['max_ms']:.2f} ms, "
+              f"sprite cache {self.sprites.hits} hits / {self.sprites.misses} misses")
+        print(f"[DISPLAY] Frame times: {s['histogram']}")
+        return s
 
     def close(self):
         self.stop()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2.0)
+        self.report()
 
 
 # --- Emotion Mapping Logic ---
@@ -158,7 +412,7 @@ if __name__ == "__main__":
     last_switch = time.time()
 
     while disp.running:
-        disp.update()
+        time.sleep(0.1)
         if time.time() - last_switch > 2:
             user_emotion = user_emotions[idx]
             robot_emotion = get_robot_reaction(user_emotion)
@@ -0,0 +1,252 @@
+"""
+emotion_detector.py
+Pluggable face + emotion detectors for KOKO.
+- Every backend returns FER-style results: [{'box': (x, y, w, h), 'emotions': {...}}]
+  with FER's seven emotion keys, so FaceTracker and main.py don't care which runs
+- "fer":  the original fer.FER with MTCNN (needs torch; slow to import and start)
+- "onnx": OpenCV YuNet face detector (Haar cascade if the model file is missing)
+  plus the int8-quantized FER+ emotion classifier, run with ONNX Runtime or,
+  if that isn't installed, cv2.dnn. All face crops of a frame are classified
+  in one batched call
+- Backend packages are imported only when that backend is created
+- Model files live in models/ (setup_instructions.sh downloads them)
+- "remote": frames go to an inference server (inference_client.py), which
+  runs one of the backends above for several robots
+"""
+
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+BACKENDS = ("fer", "onnx")
+EMOTIONS = ("angry", "disgust", "fear", "happy", "sad", "surprise", "neutral")   # FER's keys
+
+MODEL_DIR = Path(__file__).with_name("models")
+YUNET_MODEL = "face_detection_yunet_2023mar.onnx"
+FERPLUS_MODEL = "emotion-ferplus-12-int8.onnx"
+FERPLUS_LABELS = ("neutral", "happy", "surprise", "sad", "angry", "disgust", "fear", "contempt")
+FERPLUS_SIZE = 64          # classifier input: 64x64 grayscale, raw 0-255 pixels
+FACE_MARGIN = 0.1          # crop padding around a face box, as a fraction of its size
+SCORE_THRESHOLD = 0.7      # YuNet face confidence
+MIN_FACE = 40              # pixels; smaller Haar detections are ignored
+
+
+class EmotionDetector:
+    """
+    Interface used by FaceTracker and main.py.
+
+    find_faces(frame) -> [(x, y, w, h), ...]
+    classify(frame, boxes) -> [{emotion: score}, ...]   one dict per box
+    classify_many([(frame, boxes), ...]) -> one classify() result per frame
+    detect_emotions(frame, face_rectangles=None) -> FER-style results; faces
+    are searched for only when face_rectangles is None.
+    """
+
+    name = None
+
+    def find_faces(self, frame, bgr=False):
+        raise NotImplementedError
+
+    def classify(self, frame, boxes):
+        raise NotImplementedError
+
+    def classify_many(self, items):
+        """Classify the boxes of several frames; backends may batch them in one call."""
+        return [self.classify(frame, boxes) if boxes else [] for frame, boxes in items]
+
+    def warm_up(self, size=(640, 480), lores_size=None):
+        """
+        One dummy face search and one classification, so lazy initialisation
+        (graph building, allocator growth) happens before the first real frame.
+        """
+        w, h = size
+        frame = np.zeros((h, w, 3), dtype=np.uint8)
+        if lores_size:
+            self.find_faces(np.zeros((lores_size[1], lores_size[0], 3), dtype=np.uint8))
+        else:
+            self.find_faces(frame)
+        self.classify(frame, [(w // 4, h // 4, w // 4, h // 4)])
+
+    def detect_emotions(self, frame, face_rectangles=None):
+        boxes = self.find_faces(frame) if face_rectangles is None else face_rectangles
+        boxes = [tuple(int(v) for v in box) for box in boxes]
+        if not boxes:
+            return []
+        return [{"box": box, "emotions": emotions}
+                for box, emotions in zip(boxes, self.classify(frame, boxes))]
+
+
+# ---------------- FER (MTCNN) ----------------
+
+class FERDetector(EmotionDetector):
+    """The original fer.FER detector behind the EmotionDetector interface."""
+
+    name = "fer"
+
+    def __init__(self, mtcnn=True):
+        from fer import FER
+
+        self.fer = FER(mtcnn=mtcnn)
+
+    def find_faces(self, frame, bgr=False):
+        return self.fer.find_faces(frame, bgr=bgr)
+
+    def classify(self, frame, boxes):
+        return [r["emotions"] for r in self.fer.detect_emotions(frame, face_rectangles=boxes)]
+
+    def detect_emotions(self, frame, face_rectangles=None):
+        return self.fer.detect_emotions(frame, face_rectangles=face_rectangles)
+
+
+# ---------------- ONNX (YuNet / Haar + FER+) ----------------
+
+class OnnxDetector(EmotionDetector):
+    """
+    Lightweight CPU backend: YuNet (or Haar) face detection and a quantized
+    FER+ classifier. Frames are RGB unless color="bgr".
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_dir=MODEL_DIR, color="rgb", runtime=None):
+        model_dir = Path(model_dir)
+        self.color = color
+        self.gray_code = cv2.COLOR_RGB2GRAY if color == "rgb" else cv2.COLOR_BGR2GRAY
+        self._init_face_detector(model_dir / YUNET_MODEL)
+        self._init_classifier(model_dir / FERPLUS_MODEL, runtime)
+        print(f"[DETECTOR] onnx backend: {self.face_backend} faces, {self.runtime} classifier")
+
+    def _init_face_detector(self, path):
+        self.yunet = None
+        self.cascade = None
+        if path.exists() and hasattr(cv2, "FaceDetectorYN"):
+            # YuNet expects BGR like the rest of OpenCV
+            self.yunet = cv2.FaceDetectorYN.create(str(path), "", (320, 240), SCORE_THRESHOLD)
+            self.yunet_size = (320, 240)
+            self.face_backend = "yunet"
+        else:
+            cascade_path = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+            self.cascade = cv2.CascadeClassifier(cascade_path)
+            if self.cascade.empty():
+                raise FileNotFoundError(f"No face detector: neither {path} nor {cascade_path} could be loaded")
+            self.face_backend = "haar"
+
+    def _init_classifier(self, path, runtime):
+        if not path.exists():
+            raise FileNotFoundError(f"Emotion model not found: {path} (run setup_instructions.sh)")
+        if runtime in (None, "onnxruntime"):
+            try:
+                import onnxruntime as ort
+
+                self.session = ort.InferenceSession(str(path), providers=["CPUExecutionProvider"])
+                model_input = self.session.get_inputs()[0]
+                self.input_name = model_input.name
+                # A symbolic batch dimension takes any number of crops; a fixed one doesn't
+                self.batched = not isinstance(model_input.shape[0], int)
+                self.runtime = "onnxruntime"
+                return
+            except ImportError:
+                if runtime:
+                    raise
+        self.session = None
+        self.net = cv2.dnn.readNetFromONNX(str(path))
+        self.batched = True        # cv2.dnn hides the input shape; see classify_many
+        self.runtime = "cv2.dnn"
+
+    def find_faces(self, frame, bgr=False):
+        h, w = frame.shape[:2]
+        if self.yunet is not None:
+            if self.yunet_size != (w, h):
+                self.yunet.setInputSize((w, h))
+                self.yunet_size = (w, h)
+            if frame.ndim == 2:
+                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+            elif not (bgr or self.color == "bgr"):
+                frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+            _, faces = self.yunet.detect(frame)
+            if faces is None:
+                return []
+            # YuNet boxes can run past the frame edge; trackers and scaling need them inside
+            boxes = (clip_box([int(v) for v in f[:4]], w, h) for f in faces)
+            return [box for box in boxes if box is not None]
+        code = cv2.COLOR_BGR2GRAY if bgr else self.gray_code
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, code)
+        faces = self.cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5,
+                                              minSize=(MIN_FACE, MIN_FACE))
+        return [tuple(int(v) for v in f) for f in faces]
+
+    def _crops(self, frame, boxes):
+        """(n, 1, 64, 64) float32 batch of padded grayscale face crops."""
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, self.gray_code)
+        h, w = gray.shape
+        batch = np.empty((len(boxes), 1, FERPLUS_SIZE, FERPLUS_SIZE), dtype=np.float32)
+        for i, (x, y, bw, bh) in enumerate(boxes):
+            mx, my = int(bw * FACE_MARGIN), int(bh * FACE_MARGIN)
+            x0, y0 = max(0, x - mx), max(0, y - my)
+            x1, y1 = min(w, x + bw + mx), min(h, y + bh + my)
+            crop = gray[y0:y1, x0:x1] if x1 > x0 and y1 > y0 else gray
+            batch[i, 0] = cv2.resize(crop, (FERPLUS_SIZE, FERPLUS_SIZE), interpolation=cv2.INTER_AREA)
+        return batch
+
+    def _run(self, batch):
+        if self.session is not None:
+            return self.session.run(None, {self.input_name: batch})[0]
+        self.net.setInput(batch)
+        return self.net.forward()
+
+    def _run_each(self, batch):
+        return np.concatenate([self._run(batch[i:i + 1]) for i in range(len(batch))])
+
+    def classify(self, frame, boxes):
+        return self.classify_many([(frame, boxes)])[0]
+
+    def classify_many(self, items):
+        """Face crops of all frames go through the classifier as one batch."""
+        crops = [self._crops(frame, boxes) for frame, boxes in items if boxes]
+        if not crops:
+            return [[] for _ in items]
+        batch = np.concatenate(crops)
+        try:
+            logits = self._run(batch) if self.batched else self._run_each(batch)
+        except cv2.error as e:
+            # cv2.dnn (no input shape to check) rejects batches from models
+            # exported with a fixed batch size of 1
+            if self.session is not None or len(batch) == 1:
+                raise
+            print(f"[DETECTOR] Batched classification failed, classifying one crop at a time: {e}")
+            self.batched = False
+            logits = self._run_each(batch)
+        rows = iter(logits.reshape(len(batch), -1))
+        return [[ferplus_emotions(next(rows)) for _ in boxes] for _, boxes in items]
+
+
+def clip_box(box, w, h):
+    """(x, y, bw, bh) clipped to a w x h frame, or None if nothing is left."""
+    x, y, bw, bh = box
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(w, x + bw), min(h, y + bh)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return (x0, y0, x1 - x0, y1 - y0)
+
+
+def ferplus_emotions(logits):
+    """FER+ logits -> FER-style emotion dict (contempt dropped, rounded like FER)."""
+    e = np.exp(logits - logits.max())
+    probs = dict(zip(FERPLUS_LABELS, e / e.sum()))
+    total = sum(probs[k] for k in EMOTIONS)
+    return {k: round(float(probs[k] / total), 2) for k in EMOTIONS}
+
+
+def create_detector(backend="fer", **kwargs):
+    """EmotionDetector for a backend name in BACKENDS, or "remote"."""
+    if backend == "fer":
+        return FERDetector(**kwargs)
+    if backend == "onnx":
+        return OnnxDetector(**kwargs)
+    if backend == "remote":
+        from inference_client import RemoteDetector
+
+        return RemoteDetector(**kwargs)
+    raise ValueError(f"Unknown emotion backend: {backend} (choose from {BACKENDS + ('remote',)})")
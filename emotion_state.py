@@ -0,0 +1,107 @@
+"""
+emotion_state.py
+Streaming emotion aggregation for KOKO.
+- Keeps an exponentially weighted distribution over FER's emotion vector per tracked face
+- O(1) update per reading, time-aware so it behaves the same at any inference rate
+- Confidence gating drops low-confidence readings
+- Hysteresis keeps the dominant emotion from flickering between close scores
+"""
+
+import math
+import threading
+import time
+
+
+class EmotionState:
+    """Exponentially weighted emotion distribution for one face."""
+
+    def __init__(self, tau=0.5, min_confidence=0.4, hysteresis=0.1):
+        self.tau = tau                      # seconds; time constant of the average
+        self.min_confidence = min_confidence
+        self.hysteresis = hysteresis
+        self.dist = {}
+        self.emotion = "neutral"
+        self.confidence = 0.0
+        self.samples = 0
+        self.updated = None
+
+    def update(self, emotions, t=None):
+        """Fold one FER emotion vector into the state. Returns True if accepted."""
+        t = time.monotonic() if t is None else t
+        if not emotions or max(emotions.values()) < self.min_confidence:
+            return False
+
+        if self.updated is None:
+            self.dist = dict(emotions)
+        else:
+            alpha = 1.0 - math.exp(-max(t - self.updated, 0.0) / self.tau)
+            for key, value in emotions.items():
+                self.dist[key] = self.dist.get(key, 0.0) + alpha * (value - self.dist.get(key, 0.0))
+        self.updated = t
+        self.samples += 1
+
+        leader = max(self.dist, key=self.dist.get)
+        current = self.dist.get(self.emotion, 0.0)
+        if self.samples == 1 or self.dist[leader] - current > self.hysteresis:
+            self.emotion = leader
+        self.confidence = self.dist.get(self.emotion, 0.0)
+        return True
+
+    def snapshot(self):
+        return {"emotion": self.emotion, "confidence": self.confidence,
+                "dist": dict(self.dist), "samples": self.samples}
+
+
+class EmotionAggregator:
+    """
+    Thread-safe map of track_id -> EmotionState. Fed from the inference stage,
+    read from the action stage. Tracks not updated within max_age seconds are
+    treated as gone.
+    """
+
+    def __init__(self, max_age=2.0, **state_kwargs):
+        self.max_age = max_age
+        self.state_kwargs = state_kwargs
+        self.states = {}
+        self.last_track = None
+        self.lock = threading.Lock()
+
+    def observe(self, results, t=None):
+        """Update per-track states from FER-style results carrying 'track_id'."""
+        t = time.monotonic() if t is None else t
+        with self.lock:
+            for face in results or []:
+                track_id = face.get('track_id')
+                if track_id is None:
+                    continue
+                state = self.states.get(track_id)
+                if state is None:
+                    state = self.states[track_id] = EmotionState(**self.state_kwargs)
+                if state.update(face['emotions'], t):
+                    self.last_track = track_id
+            self._prune(t)
+
+    def _prune(self, t):
+        stale = [k for k, s in self.states.items()
+                 if s.updated is None or t - s.updated > self.max_age]
+        for key in stale:
+            del self.states[key]
+        if self.last_track not in self.states:
+            self.last_track = None
+
+    def current(self, track_id=None, t=None):
+        """
+        Return (emotion, confidence) for a track (default: the most recently
+        updated one), or ("neutral", 0.0) if there is no live track.
+        """
+        t = time.monotonic() if t is None else t
+        with self.lock:
+            self._prune(t)
+            state = self.states.get(self.last_track if track_id is None else track_id)
+            if state is None:
+                return "neutral", 0.0
+            return state.emotion, state.confidence
+
+    def tracks(self):
+        with self.lock:
+            return {k: s.snapshot() for k, s in self.states.items()}
@@ -0,0 +1,168 @@
+"""
+event_log.py
+Append-only interaction history for KOKO.
+- One fixed-size NumPy record per child per action: before/after emotion,
+  confidence and smoothed emotion vector, the action, its reward, policy
+  and latencies (see EVENT_DTYPE)
+- record() only appends a dict to an in-memory buffer; a background thread
+  packs buffered events into a record array and appends the raw bytes to
+  the current file, so the main loop never touches the disk
+- Files rotate by size and by day: events/events-v1-20261018T093000.bin,
+  named after the earliest event in the batch that opened them. Events are
+  recorded when an action's outcome window closes, stamped with the time
+  the action started, so each batch is sorted but a file can still hold
+  events older than its name; event_query.py reads each file's own range.
+  Files are headerless, so event_query.py can np.memmap any of them (even
+  the one being written) and a torn last record is simply ignored
+- Files are never rewritten; delete old ones to free space
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+EVENT_DIR = Path(__file__).with_name("events")
+EVENT_VERSION = 1
+DIST_KEYS = ("angry", "disgust", "fear", "happy", "sad", "surprise", "neutral")   # FER's keys
+
+EVENT_DTYPE = np.dtype([
+    ("t", "<f8"),                       # wall-clock seconds (time.time()) when the action was sent
+    ("child", "S16"),
+    ("track", "<i4"),                   # FaceTracker track id, -1 if none
+    ("action", "S24"),
+    ("policy", "S8"),
+    ("emotion", "S8"),                  # smoothed emotion before the action
+    ("conf", "<f2"),
+    ("dist", "<f2", (len(DIST_KEYS),)),
+    ("after_emotion", "S8"),            # averaged over the action's outcome window; empty without readings
+    ("after_conf", "<f2"),
+    ("after_dist", "<f2", (len(DIST_KEYS),)),
+    ("reward", "<f4"),                  # valence change scaled to [-1, 1]; NaN if no after reading
+    ("target", "?"),                    # the child the action was chosen for
+    ("learned", "?"),                   # feedback was applied to this child's profile
+    ("perceive_ms", "<f4"),             # capture -> smoothed emotion for the frame acted on
+    ("decide_ms", "<f4"),               # recommend + send
+])
+
+_DEFAULTS = {"track": -1, "target": False, "learned": False}
+
+
+def file_name(t):
+    return f"events-v{EVENT_VERSION}-{datetime.fromtimestamp(t).strftime('%Y%m%dT%H%M%S')}.bin"
+
+
+def pack(events):
+    """List of event dicts -> EVENT_DTYPE record array (missing fields: NaN / empty)."""
+    out = np.zeros(len(events), dtype=EVENT_DTYPE)
+    for name in EVENT_DTYPE.names:
+        if name in ("dist", "after_dist"):
+            out[name] = [[(e.get(name) or {}).get(k, np.nan) for k in DIST_KEYS] for e in events]
+            continue
+        kind = EVENT_DTYPE[name].kind
+        default = _DEFAULTS.get(name, np.nan if kind == "f" else "")
+        column = [e.get(name, default) for e in events]
+        if kind == "S":
+            column = [(v or "").encode() for v in column]
+        out[name] = [default if v is None else v for v in column]
+    return out
+
+
+class EventLog:
+    def __init__(self, log_dir=EVENT_DIR, flush_interval=5.0, batch_size=256,
+                 max_file_bytes=8 * 1024 * 1024):
+        self.log_dir = Path(log_dir)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_file_bytes = max_file_bytes
+        self.lock = threading.Lock()
+        self._buffer = []
+        self._wake = threading.Event()
+        self._file = None
+        self._file_day = None
+        self._file_bytes = 0
+        self._running = False
+        self._thread = None
+        self.written = 0
+        self.flushes = 0
+
+    # ---------------- Recording ----------------
+
+    def record(self, **event):
+        """Queue one event (fields of EVENT_DTYPE; dist values may be emotion dicts)."""
+        event.setdefault("t", time.time())
+        with self.lock:
+            self._buffer.append(event)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    # ---------------- Writing ----------------
+
+    def flush(self):
+        """Pack buffered events and append them to the current file."""
+        with self.lock:
+            events, self._buffer = self._buffer, []
+        if not events:
+            return 0
+        events.sort(key=lambda e: e["t"])
+        data = pack(events).tobytes()
+        self._rotate(events[0]["t"], len(data))
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file_bytes += len(data)
+        self.written += len(events)
+        self.flushes += 1
+        return len(events)
+
+    def _rotate(self, t, incoming):
+        day = datetime.fromtimestamp(t).date()
+        if (self._file is not None and day == self._file_day
+                and self._file_bytes + incoming <= self.max_file_bytes):
+            return
+        if self._file is not None:
+            self._file.close()
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        path = self.log_dir / file_name(t)
+        self._file = open(path, "ab")
+        self._file_day = day
+        self._file_bytes = path.stat().st_size
+        print(f"[EVENTS] Writing {path.name}")
+
+    def _run(self):
+        while self._running:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[EVENTS] Background flush failed: {e}")
+
+    def start(self):
+        """Start the background flush thread."""
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        """Stop the background thread and write whatever is still buffered."""
+        self._running = False
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=self.flush_interval + 1.0)
+            self._thread = None
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        print(f"[EVENTS] {self.written} events written in {self.flushes} flushes.")
+
+    def stats(self):
+        with self.lock:
+            buffered = len(self._buffer)
+        return {"written": self.written, "buffered": buffered, "flushes": self.flushes}
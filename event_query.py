@@ -0,0 +1,180 @@
+"""
+event_query.py
+Analytics over the interaction history written by event_log.py.
+- Files are opened with np.memmap, and only those overlapping the requested
+  time range, so months of history never have to fit in RAM. Each file's
+  range comes from its own t column (events are not in order across
+  files) and is cached; only records appended since are read again
+- effectiveness() aggregates count / mean reward / improvement rate per
+  child, action, emotion (any combination), one file at a time
+- sessions() yields events in recommender_sim's replay format, so logged
+  history can be replayed: python3 recommender_sim.py --replay events/
+- frame() returns a pandas DataFrame for a (small) selection, for plotting
+
+Usage:
+    python3 event_query.py --by child action
+    python3 event_query.py --by action --child child_001 --since 2026-09-01
+"""
+
+import argparse
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from event_log import DIST_KEYS, EVENT_DIR, EVENT_DTYPE, EVENT_VERSION
+
+GROUP_FIELDS = ("child", "action", "emotion", "after_emotion", "policy")
+
+
+def parse_time(value):
+    """Seconds since the epoch from a number or an ISO date/time string; None passes through."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return datetime.fromisoformat(value).timestamp()
+
+
+class EventHistory:
+    def __init__(self, log_dir=EVENT_DIR):
+        self.log_dir = Path(log_dir)
+        self._ranges = {}          # path -> (records read, first t, last t)
+
+    def time_range(self, path):
+        """(earliest, latest) event time in a file, or None if it has no events."""
+        n = path.stat().st_size // EVENT_DTYPE.itemsize
+        done, first, last = self._ranges.get(path, (0, np.inf, -np.inf))
+        if n < done:               # file was replaced; read it again
+            done, first, last = 0, np.inf, -np.inf
+        if n > done:
+            t = np.memmap(path, dtype=EVENT_DTYPE, mode="r", shape=(n,))["t"][done:]
+            first, last = min(first, float(t.min())), max(last, float(t.max()))
+        self._ranges[path] = (n, first, last)
+        return (first, last) if n else None
+
+    def files(self, since=None, until=None):
+        """[(earliest_time, path)] of event files holding events in [since, until)."""
+        since, until = parse_time(since), parse_time(until)
+        selected = []
+        for path in sorted(self.log_dir.glob(f"events-v{EVENT_VERSION}-*.bin")):
+            span = self.time_range(path)
+            if span is None:
+                continue
+            first, last = span
+            if (until is None or first < until) and (since is None or last >= since):
+                selected.append((first, path))
+        return selected
+
+    def chunks(self, since=None, until=None, child=None, action=None):
+        """Memory-mapped record arrays, one per file, filtered to the selection."""
+        since, until = parse_time(since), parse_time(until)
+        for _, path in self.files(since, until):
+            n = path.stat().st_size // EVENT_DTYPE.itemsize
+            if n == 0:
+                continue
+            events = np.memmap(path, dtype=EVENT_DTYPE, mode="r", shape=(n,))
+            mask = np.ones(n, dtype=bool)
+            if since is not None:
+                mask &= events["t"] >= since
+            if until is not None:
+                mask &= events["t"] < until
+            if child is not None:
+                mask &= events["child"] == child.encode()
+            if action is not None:
+                mask &= events["action"] == action.encode()
+            yield events if mask.all() else events[mask]
+
+    def count(self, **selection):
+        return sum(len(c) for c in self.chunks(**selection))
+
+    def effectiveness(self, by=("child", "action"), learned_only=False, **selection):
+        """
+        Per-group outcome statistics over events with an after reading:
+        {group_tuple: {"count", "mean_reward", "improved", "worsened"}}, where
+        improved/worsened are the fractions of positive/negative rewards.
+        """
+        totals = {}
+        for chunk in self.chunks(**selection):
+            reward = chunk["reward"]
+            valid = ~np.isnan(reward)
+            if learned_only:
+                valid &= chunk["learned"]
+            if not valid.any():
+                continue
+            keys = np.rec.fromarrays([chunk[f][valid] for f in by], names=list(by))
+            groups, inverse = np.unique(keys, return_inverse=True)
+            inverse = inverse.ravel()
+            r = reward[valid].astype(np.float64)
+            sums = np.bincount(inverse, weights=r)
+            counts = np.bincount(inverse)
+            ups = np.bincount(inverse, weights=r > 0)
+            downs = np.bincount(inverse, weights=r < 0)
+            for i, group in enumerate(groups):
+                key = tuple(_text(v) for v in group)
+                acc = totals.setdefault(key, [0, 0.0, 0.0, 0.0])
+                acc[0] += counts[i]
+                acc[1] += sums[i]
+                acc[2] += ups[i]
+                acc[3] += downs[i]
+        return {key: {"count": int(n), "mean_reward": float(s / n), "improved": float(u / n),
+                      "worsened": float(d / n)}
+                for key, (n, s, u, d) in sorted(totals.items())}
+
+    def sessions(self, learned_only=True, **selection):
+        """Events as recommender_sim replay dicts (child_id, emotion, action, after_emotion)."""
+        for chunk in self.chunks(**selection):
+            rows = chunk[chunk["learned"]] if learned_only else chunk[chunk["after_emotion"] != b""]
+            for child, emotion, action, after in zip(rows["child"], rows["emotion"],
+                                                      rows["action"], rows["after_emotion"]):
+                yield {"child_id": child.decode(), "emotion": emotion.decode(),
+                       "action": action.decode(), "after_emotion": after.decode()}
+
+    def frame(self, **selection):
+        """pandas DataFrame of the selected events (loads them into memory)."""
+        import pandas as pd
+
+        chunks = list(self.chunks(**selection))
+        events = np.concatenate(chunks) if chunks else np.zeros(0, dtype=EVENT_DTYPE)
+        columns = {}
+        for name in EVENT_DTYPE.names:
+            column = events[name]
+            if name in ("dist", "after_dist"):
+                prefix = "" if name == "dist" else "after_"
+                for j, key in enumerate(DIST_KEYS):
+                    columns[f"{prefix}{key}"] = column[:, j].astype(np.float32)
+            elif column.dtype.kind == "S":
+                columns[name] = np.char.decode(column)
+            else:
+                columns[name] = column
+        df = pd.DataFrame(columns)
+        df["time"] = pd.to_datetime(df["t"], unit="s")
+        return df
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query KOKO's interaction history")
+    parser.add_argument("--dir", default=str(EVENT_DIR))
+    parser.add_argument("--by", nargs="+", default=["child", "action"], choices=GROUP_FIELDS)
+    parser.add_argument("--child")
+    parser.add_argument("--action")
+    parser.add_argument("--since", help="ISO date/time, e.g. 2026-09-01")
+    parser.add_argument("--until")
+    parser.add_argument("--learned", action="store_true", help="only events that updated a profile")
+    args = parser.parse_args()
+
+    history = EventHistory(args.dir)
+    selection = {"since": args.since, "until": args.until, "child": args.child, "action": args.action}
+    table = history.effectiveness(by=tuple(args.by), learned_only=args.learned, **selection)
+    print(f"[QUERY] {history.count(**selection)} events in "
+          f"{len(history.files(args.since, args.until))} files")
+    print(f"[QUERY] {' / '.join(args.by):<40} {'count':>6} {'reward':>7} {'better':>7} {'worse':>7}")
+    for key, row in table.items():
+        print(f"[QUERY] {' / '.join(key):<40} {row['count']:6d} {row['mean_reward']:+7.3f} "
+              f"{row['improved']:7.0%} {row['worsened']:7.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+face_tracker.py
+Detect-then-track face following for KOKO.
+- Runs full FER/MTCNN face detection only every N frames or when tracking is lost
+- Follows every face (up to max_faces) between detections with a cheap
+  OpenCV tracker per face
+- Runs only the emotion classifier on the tracked face boxes, all in one call
+- Optionally finds faces on a downscaled (lores) frame and classifies the
+  matching boxes on the full frame
+- Returns FER-style results: [{'box': (x, y, w, h), 'emotions': {...}}];
+  each tracked face also carries a 'track_id' that survives re-detection
+"""
+
+import cv2
+
+import profiler
+
+
+def largest_face(results):
+    """Return the detection with the largest face box, or None if there is none."""
+    if not results:
+        return None
+    return max(results, key=lambda x: x['box'][2]*x['box'][3])
+
+
+def box_iou(a, b):
+    """Intersection-over-union of two (x, y, w, h) boxes."""
+    ax1, ay1 = a[0] + a[2], a[1] + a[3]
+    bx1, by1 = b[0] + b[2], b[1] + b[3]
+    iw = max(0, min(ax1, bx1) - max(a[0], b[0]))
+    ih = max(0, min(ay1, by1) - max(a[1], b[1]))
+    inter = iw * ih
+    union = a[2]*a[3] + b[2]*b[3] - inter
+    return inter / union if union > 0 else 0.0
+
+
+def create_tracker():
+    """Create the cheapest available OpenCV single-object tracker."""
+    legacy = getattr(cv2, "legacy", None)
+    for module, name in ((legacy, "TrackerMOSSE_create"),
+                         (cv2, "TrackerKCF_create"),
+                         (legacy, "TrackerKCF_create"),
+                         (cv2, "TrackerCSRT_create")):
+        factory = getattr(module, name, None) if module is not None else None
+        if factory is not None:
+            return factory()
+    raise RuntimeError("No OpenCV tracker available (install opencv-contrib-python)")
+
+
+class FaceTracker:
+    """
+    Wraps an emotion detector so full face detection runs only every
+    `detect_every` frames. In between, each face (up to `max_faces`, largest
+    first) is followed by its own tracker and the emotion classifier runs on
+    all tracked boxes in one call. Detection is re-run early when a tracker
+    loses its face or a face's top score drops below `min_confidence`.
+    """
+
+    def __init__(self, detector, detect_every=10, min_confidence=0.3, match_iou=0.3, max_faces=4):
+        self.detector = detector
+        self.detect_every = detect_every
+        self.min_confidence = min_confidence
+        self.match_iou = match_iou
+        self.max_faces = max_faces
+        self.tracks = []          # [{"id", "box", "tracker"}], largest face first
+        self.track_id = 0         # last id handed out
+        self.frames_since_detect = 0
+        self.detections = 0
+        self.tracked = 0
+
+    def reset(self):
+        self.tracks = []
+        self.frames_since_detect = 0
+
+    def process(self, frame, lores=None):
+        """
+        Return FER-style emotion results for this frame. `lores`, a downscaled
+        copy of the same frame, makes full detections search the small image.
+        """
+        if not self.tracks or self.frames_since_detect >= self.detect_every:
+            return self._detect(frame, lores)
+
+        boxes = []
+        for track in self.tracks:
+            ok, box = track["tracker"].update(frame)
+            box = self._clip_box(box, frame) if ok else None
+            if box is None:
+                return self._detect(frame, lores)
+            boxes.append(box)
+
+        with profiler.span("tracker.classify"):
+            results = self.detector.detect_emotions(frame, face_rectangles=boxes)
+        if len(results) != len(boxes) or any(
+                max(face['emotions'].values()) < self.min_confidence for face in results):
+            return self._detect(frame, lores)
+
+        for track, face, box in zip(self.tracks, results, boxes):
+            face['track_id'] = track["id"]
+            track["box"] = box
+        self.frames_since_detect += 1
+        self.tracked += 1
+        return results
+
+    def _detect(self, frame, lores=None):
+        with profiler.span("tracker.detect"):
+            if lores is not None and hasattr(self.detector, "find_faces"):
+                boxes = self._find_faces_scaled(frame, lores)
+                results = self.detector.detect_emotions(frame, face_rectangles=boxes) if boxes else []
+            else:
+                results = self.detector.detect_emotions(frame)
+        self.detections += 1
+        self.frames_since_detect = 0
+
+        # Greedy IoU matching, largest face first, so ids survive re-detection
+        faces = sorted(results, key=lambda x: x['box'][2]*x['box'][3], reverse=True)
+        unmatched = list(self.tracks)
+        tracks = []
+        for face in faces[:self.max_faces]:
+            box = tuple(int(v) for v in face['box'])
+            best = max(unmatched, key=lambda t: box_iou(box, t["box"]), default=None)
+            if best is not None and box_iou(box, best["box"]) >= self.match_iou:
+                unmatched.remove(best)
+                track_id = best["id"]
+            else:
+                self.track_id += 1
+                track_id = self.track_id
+            face['track_id'] = track_id
+            tracker = create_tracker()
+            tracker.init(frame, box)
+            tracks.append({"id": track_id, "box": box, "tracker": tracker})
+        self.tracks = tracks
+        return results
+
+    def _find_faces_scaled(self, frame, lores):
+        """Face boxes found on the lores frame, scaled and clipped to the full frame."""
+        sx = frame.shape[1] / lores.shape[1]
+        sy = frame.shape[0] / lores.shape[0]
+        boxes = []
+        for x, y, w, h in self.detector.find_faces(lores, bgr=False):
+            box = self._clip_box((x * sx, y * sy, w * sx, h * sy), frame)
+            if box is not None:
+                boxes.append(box)
+        return boxes
+
+    @staticmethod
+    def _clip_box(box, frame):
+        """Clip a tracker box to the frame; None if it is empty."""
+        h, w = frame.shape[:2]
+        x, y, bw, bh = (int(round(v)) for v in box)
+        x0, y0 = max(0, x), max(0, y)
+        x1, y1 = min(w, x + bw), min(h, y + bh)
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            return None
+        return (x0, y0, x1 - x0, y1 - y0)
+
+    def stats(self):
+        total = self.detections + self.tracked
+        return {
+            "detections": self.detections,
+            "tracked": self.tracked,
+            "track_ratio": self.tracked / total if total else 0.0,
+            "faces": len(self.tracks),
+        }
@@ -0,0 +1,375 @@
+"""
+frame_source.py
+Pluggable camera frame sources for KOKO.
+- FrameSource.read() returns the next (h, w, 3) uint8 frame, upright and in
+  RGB order (color="bgr" for OpenCV windows), or None when a finite source ends
+- PicameraSource: the robot's PiCamera (picamera2 is imported only when used);
+  the camera delivers upright 3-channel frames, copied once into pooled
+  buffers, plus an optional downscaled stream for face detection
+- RecordedSource: a video file, a directory of images, or a .npy recording
+  (memory-mapped); served at real-time pace or as fast as the reader asks
+- SyntheticSource: a generated moving face, for headless benchmarking
+- Preloaded frames are handed out as read-only views, never copied per frame
+- Record the camera for later replay:
+    python3 frame_source.py --record session.npy --frames 300
+"""
+
+import argparse
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import profiler
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+SYNTHETIC_FRAMES = 30      # frames pre-rendered by SyntheticSource (looped)
+POOL_SIZE = 4              # spare frame buffers kept for reuse
+
+# Picamera2 names 24-bit formats by their little-endian word: "BGR888" arrays are [R, G, B]
+PICAMERA_FORMATS = {"rgb": "BGR888", "bgr": "RGB888"}
+
+
+class FrameSource:
+    """Base class for frame sources; also usable as a context manager and iterator."""
+
+    fps = None
+
+    def start(self):
+        return self
+
+    def read(self):
+        raise NotImplementedError
+
+    def read_streams(self):
+        """(frame, lores) from one capture; lores is None for sources without a lores stream."""
+        return self.read(), None
+
+    def release(self, frames):
+        """Hand frames from read()/read_streams() back once nothing uses them any more."""
+
+    def stop(self):
+        pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def __iter__(self):
+        while True:
+            frame = self.read()
+            if frame is None:
+                return
+            yield frame
+
+
+# ---------------- PiCamera ----------------
+
+class BufferPool:
+    """Recycles frame buffers of one shape so steady-state capture allocates nothing."""
+
+    def __init__(self, shape, keep=POOL_SIZE):
+        self.shape = shape
+        self.keep = keep
+        self.free = []
+        self.allocated = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.free:
+                return self.free.pop()
+            self.allocated += 1
+        return np.empty(self.shape, dtype=np.uint8)
+
+    def release(self, buf):
+        if buf is None or buf.shape != self.shape:
+            return
+        with self.lock:
+            if len(self.free) < self.keep and not any(b is buf for b in self.free):
+                self.free.append(buf)
+
+
+class PicameraSource(FrameSource):
+    """
+    Frames from Picamera2, rotated 180 degrees (KOKO's camera is mounted upside down).
+
+    The camera is configured to flip the image on the sensor and to deliver
+    3-channel RGB (or BGR), so a frame costs one copy out of the camera
+    buffer into a pooled array. If the sensor can't flip or the format isn't
+    offered, conversion and rotation run on the host into that same array.
+    lores_size adds a downscaled stream from the same request for face
+    detection, returned by read_streams().
+    """
+
+    def __init__(self, size=(640, 480), rotate_180=True, color="rgb", warmup=2.0, lores_size=None):
+        from libcamera import Transform
+        from picamera2 import MappedArray, Picamera2
+
+        self.size = size
+        self.rotate_180 = rotate_180
+        self.color = color
+        self.warmup = warmup
+        self.lores_size = lores_size
+        self._mapped_array = MappedArray
+        self.picam2 = Picamera2()
+        self._configure(Transform(hflip=rotate_180, vflip=rotate_180))
+        w, h = size
+        self.pool = BufferPool((h, w, 3))
+        self.lores_pool = BufferPool((lores_size[1], lores_size[0], 3)) if lores_size else None
+
+    def _configure(self, transform):
+        fmt = PICAMERA_FORMATS[self.color]
+        if self.lores_size:
+            # Some ISPs only offer YUV420 on the lores stream
+            attempts = [(fmt, fmt), (fmt, "YUV420"), ("XRGB8888", "YUV420")]
+        else:
+            attempts = [(fmt, None), ("XRGB8888", None)]
+        for main_fmt, lores_fmt in attempts:
+            streams = {"main": {"format": main_fmt, "size": self.size}}
+            if lores_fmt:
+                streams["lores"] = {"format": lores_fmt, "size": self.lores_size}
+            try:
+                self.picam2.configure(self.picam2.create_preview_configuration(transform=transform, **streams))
+                break
+            except Exception as e:
+                print(f"[CAMERA] {main_fmt}/{lores_fmt} not available: {e}")
+        else:
+            raise RuntimeError("Could not configure the camera")
+
+        actual = self.picam2.camera_configuration()
+        flipped = actual["transform"].hflip and actual["transform"].vflip
+        self.host_rotate = self.rotate_180 and not flipped
+        self.host_convert = actual["main"]["format"] != fmt
+        self.lores_gray = bool(self.lores_size) and actual["lores"]["format"] == "YUV420"
+        print(f"[CAMERA] main {actual['main']['format']} {self.size}"
+              f"{f', lores {self.lores_size}' if self.lores_size else ''}; "
+              f"rotation on {'host' if self.host_rotate else 'sensor'}, "
+              f"conversion on {'host' if self.host_convert else 'ISP'}")
+
+    def start(self):
+        self.picam2.start()
+        time.sleep(self.warmup)  # Allow camera to warm up
+        return self
+
+    def read(self):
+        with profiler.span("camera.read"), self.picam2.captured_request() as request:
+            return self._copy_main(request)
+
+    def read_streams(self):
+        with profiler.span("camera.read"), self.picam2.captured_request() as request:
+            frame = self._copy_main(request)
+            lores = self._copy_lores(request) if self.lores_size else None
+        return frame, lores
+
+    def _copy_main(self, request):
+        """One pass from the camera buffer into a pooled frame (plus an in-place flip if needed)."""
+        w, h = self.size
+        out = self.pool.acquire()
+        with profiler.span("camera.copy"), self._mapped_array(request, "main") as m:
+            src = m.array[:h, :w]   # drop stride padding
+            if self.host_convert:
+                code = cv2.COLOR_BGRA2RGB if self.color == "rgb" else cv2.COLOR_BGRA2BGR
+                cv2.cvtColor(src, code, dst=out)
+            else:
+                np.copyto(out, src)
+        if self.host_rotate:
+            with profiler.span("camera.rotate"):
+                cv2.flip(out, -1, dst=out)
+        return out
+
+    def _copy_lores(self, request):
+        w, h = self.lores_size
+        out = self.lores_pool.acquire()
+        with self._mapped_array(request, "lores") as m:
+            if self.lores_gray:
+                cv2.cvtColor(m.array[:h, :w], cv2.COLOR_GRAY2RGB, dst=out)   # Y plane
+            else:
+                np.copyto(out, m.array[:h, :w])
+        if self.host_rotate:
+            cv2.flip(out, -1, dst=out)
+        return out
+
+    def release(self, frames):
+        if isinstance(frames, tuple):
+            frame, lores = frames
+            self.pool.release(frame)
+            if self.lores_pool:
+                self.lores_pool.release(lores)
+        else:
+            self.pool.release(frames)
+
+    def stop(self):
+        self.picam2.stop()
+
+
+# ---------------- Preloaded Frames ----------------
+
+class PreloadedSource(FrameSource):
+    """
+    Serves frames from one (n, h, w, 3) array as read-only views.
+
+    realtime=True paces read() to `fps` like a camera; realtime=False returns
+    frames as fast as they are asked for (benchmarks). loop=False ends the
+    source after one pass.
+    """
+
+    def __init__(self, frames, fps=30.0, realtime=True, loop=True):
+        if frames.flags.writeable:
+            frames.flags.writeable = False
+        self.frames = frames
+        self.fps = fps
+        self.realtime = realtime
+        self.loop = loop
+        self.index = 0
+        self.served = 0
+        self.t_start = None
+
+    def start(self):
+        self.index = 0
+        self.served = 0
+        self.t_start = time.monotonic()
+        return self
+
+    def read(self):
+        if self.index >= len(self.frames):
+            if not self.loop or not len(self.frames):
+                return None
+            self.index = 0
+        if self.realtime and self.fps:
+            if self.t_start is None:
+                self.t_start = time.monotonic()
+            delay = self.t_start + self.served / self.fps - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        frame = self.frames[self.index]
+        self.index += 1
+        self.served += 1
+        return frame
+
+
+class RecordedSource(PreloadedSource):
+    """
+    Frames recorded earlier: a .npy file of RGB frames (memory-mapped, so
+    only the pages actually read are loaded), a video file, or a directory
+    of images. Videos and images are decoded once up front.
+    """
+
+    def __init__(self, path, fps=None, realtime=True, loop=True, max_frames=None, color="rgb"):
+        self.path = path
+        if path.endswith(".npy"):
+            frames = np.load(path, mmap_mode="r")[:max_frames]
+            if color != "rgb":
+                frames = np.ascontiguousarray(frames[..., ::-1])
+        elif os.path.isdir(path):
+            frames = self._load_images(path, max_frames, color)
+        else:
+            frames, video_fps = self._load_video(path, max_frames, color)
+            fps = fps or video_fps
+        print(f"[SOURCE] {path}: {len(frames)} frames, {frames.nbytes / 1e6:.0f} MB")
+        super().__init__(frames, fps or 30.0, realtime, loop)
+
+    @staticmethod
+    def _load_images(path, max_frames, color):
+        names = sorted(n for n in os.listdir(path) if n.lower().endswith(IMAGE_EXTENSIONS))
+        images = [cv2.imread(os.path.join(path, n)) for n in names[:max_frames]]
+        if not images:
+            raise ValueError(f"No images in {path}")
+        frames = np.stack(images)
+        if color == "rgb":
+            frames = frames[..., ::-1]
+        return np.ascontiguousarray(frames)
+
+    @staticmethod
+    def _load_video(path, max_frames, color):
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise ValueError(f"Could not open video {path}")
+        fps = cap.get(cv2.CAP_PROP_FPS) or None
+        images = []
+        while max_frames is None or len(images) < max_frames:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if color == "rgb":
+                cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)
+            images.append(frame)
+        cap.release()
+        if not images:
+            raise ValueError(f"No frames in {path}")
+        return np.stack(images), fps
+
+
+class SyntheticSource(PreloadedSource):
+    """
+    A face-like blob drifting over a noisy background. The loop of
+    `n_frames` frames is rendered once at start-up.
+    """
+
+    def __init__(self, size=(640, 480), fps=30.0, realtime=True, n_frames=SYNTHETIC_FRAMES, seed=0):
+        w, h = size
+        rng = np.random.default_rng(seed)
+        frames = np.empty((n_frames, h, w, 3), dtype=np.uint8)
+        gradient = np.linspace(60, 140, w, dtype=np.float32)[None, :, None]
+        for i in range(n_frames):
+            frame = frames[i]
+            frame[:] = np.clip(gradient + rng.normal(0, 8, (h, w, 1)), 0, 255)
+            phase = 2 * np.pi * i / n_frames
+            cx = int(w / 2 + w / 6 * np.sin(phase))
+            cy = int(h / 2 + h / 10 * np.sin(2 * phase))
+            r = h // 6
+            cv2.ellipse(frame, (cx, cy), (r, int(r * 1.3)), 0, 0, 360, (224, 172, 140), -1)
+            for dx in (-r // 2, r // 2):
+                cv2.circle(frame, (cx + dx, cy - r // 3), r // 8, (40, 30, 30), -1)
+            cv2.ellipse(frame, (cx, cy + r // 2), (r // 2, r // 5), 0, 0, 180, (120, 40, 40), 3)
+        super().__init__(frames, fps, realtime, loop=True)
+
+
+def open_source(spec="picamera", **kwargs):
+    """
+    FrameSource from a short spec: "picamera", "synthetic", or a path to a
+    .npy recording, a video file, or an image directory.
+    """
+    if spec == "picamera":
+        return PicameraSource(**kwargs)
+    if spec == "synthetic":
+        return SyntheticSource(**kwargs)
+    return RecordedSource(spec, **kwargs)
+
+
+def record(source, path, n_frames):
+    """Write n_frames from a source to a .npy file that RecordedSource can memory-map."""
+    first = source.read()
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(n_frames,) + first.shape)
+    out[0] = first
+    count = 1
+    while count < n_frames:
+        frame = source.read()
+        if frame is None:
+            break
+        out[count] = frame
+        count += 1
+    out.flush()
+    if count < n_frames:
+        np.save(path, np.array(out[:count]))
+    del out
+    print(f"[SOURCE] Recorded {count} frames to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record KOKO camera frames for replay")
+    parser.add_argument("--source", default="picamera")
+    parser.add_argument("--record", required=True, help="output .npy file")
+    parser.add_argument("--frames", type=int, default=300)
+    args = parser.parse_args()
+
+    with open_source(args.source) as source:
+        record(source, args.record, args.frames)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+governor.py
+Adaptive inference rate for KOKO, driven by scene activity.
+- A motion gate compares a tiny grayscale copy of each frame (64x48) with
+  a running background; the face detector runs only when the gate, or the
+  schedule below, lets a frame through
+- Child in view: every frame while emotions change quickly, easing off to
+  CALM_INTERVAL while they are steady
+- Nobody in view: frames are only checked by the gate (GATE_INTERVAL);
+  the detector runs at once when motion starts, at most every
+  MOTION_INTERVAL while it goes on, and otherwise on an exponentially
+  growing interval (IDLE_INTERVAL doubling up to MAX_INTERVAL)
+- Hot CPU: every interval is stretched as the temperature climbs from
+  TEMP_SOFT to TEMP_HARD, and to the maximum while the Pi reports
+  throttling (readings come from profiler's sampler thread)
+- Pipeline hooks: admit() is its gate_fn, delay() its pace_fn; perceive
+  calls observe() with each result
+- Reports the detector duty cycle and energy proxies (detector and process
+  CPU seconds per minute), time spent with and without a child, and the
+  wake latency from first motion to the first detected face
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+import profiler
+from pipeline import StageStats
+
+GATE_SIZE = (64, 48)       # motion gate resolution
+MOTION_DELTA = 18          # grey levels a pixel must change to count as moving
+MOTION_FRACTION = 0.01     # fraction of moving pixels that counts as motion
+BACKGROUND_ALPHA = 0.05    # background adaptation rate per gate check
+FAST_INTERVAL = 0.0        # seconds between detections while emotions change
+CALM_INTERVAL = 0.2        # ... while a child's emotions are steady
+VOLATILE = 0.15            # reading-to-reading emotion change (0-1) that counts as fast
+GATE_INTERVAL = 0.2        # seconds between motion checks while nobody is in view
+MOTION_INTERVAL = 0.5      # detections at most this often during motion without faces
+IDLE_INTERVAL = 0.5        # first detection interval without motion or faces...
+MAX_INTERVAL = 4.0         # ... doubling up to this
+BACKOFF = 2.0
+TEMP_SOFT = 70.0           # C; intervals start stretching here
+TEMP_HARD = 80.0           # C; the Pi throttles at 80-85 C
+MAX_STRETCH = 4.0          # interval multiplier at TEMP_HARD or while throttled
+HOT_FLOOR = 0.05           # seconds; shortest interval while stretched
+
+
+class MotionGate:
+    """Fraction of moving pixels in a downscaled frame against a running background."""
+
+    def __init__(self, size=GATE_SIZE, delta=MOTION_DELTA, alpha=BACKGROUND_ALPHA):
+        self.size = size
+        self.delta = delta
+        self.alpha = alpha
+        self.background = None
+
+    def motion(self, frame):
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY) if small.ndim == 3 else small
+        gray = cv2.GaussianBlur(gray, (3, 3), 0)
+        if self.background is None:
+            self.background = gray.astype(np.float32)
+            return 1.0
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self.background))
+        cv2.accumulateWeighted(gray, self.background, self.alpha)
+        return np.count_nonzero(diff > self.delta) / diff.size
+
+    def reset(self):
+        self.background = None
+
+
+class InferenceGovernor:
+    """
+    Decides which frames reach the detector and how long the pipeline waits
+    between frames. Call observe() from the inference stage with every result.
+    """
+
+    def __init__(self, gate=None, motion_fraction=MOTION_FRACTION):
+        self.gate = gate or MotionGate()
+        self.motion_fraction = motion_fraction
+        self.present = False       # faces in the last detection
+        self.moving = False        # motion at the last gate check
+        self.interval = CALM_INTERVAL
+        self.idle_interval = IDLE_INTERVAL
+        self.volatility = 0.0
+        self.last_readings = {}    # track_id -> emotion vector
+        self.t_detect = 0.0        # last detection admitted
+        self.t_admit = None
+        self.t_motion = None       # first motion since nobody was in view
+        self.t0 = time.monotonic()
+        self.cpu0 = time.process_time()
+        self.t_mode = self.t0
+        self.mode_time = {"child": 0.0, "empty": 0.0}
+        self.counts = {"checked": 0, "detected": 0, "gated": 0, "motion": 0}
+        self.busy = 0.0            # seconds spent in the detector
+        self.wake = StageStats("wake")
+
+    # ---------------- Thermal ----------------
+
+    def stretch(self):
+        """Interval multiplier from the latest CPU temperature and throttle flags."""
+        snap = profiler.system()
+        throttle = snap.get("throttle") or {}
+        if throttle.get("throttled") or throttle.get("soft_temp_limit"):
+            return MAX_STRETCH
+        temp = snap.get("cpu_temp_c")
+        if temp is None or temp <= TEMP_SOFT:
+            return 1.0
+        hot = min(1.0, (temp - TEMP_SOFT) / (TEMP_HARD - TEMP_SOFT))
+        return 1.0 + hot * (MAX_STRETCH - 1.0)
+
+    def _stretched(self, interval):
+        factor = self.stretch()
+        return interval if factor == 1.0 else max(interval, HOT_FLOOR) * factor
+
+    # ---------------- Pipeline hooks ----------------
+
+    def delay(self):
+        """pace_fn: seconds the pipeline waits before taking the next frame."""
+        return self._stretched(self.interval if self.present else GATE_INTERVAL)
+
+    def admit(self, frames):
+        """gate_fn: True if this frame ((frame, lores) or a frame) should go to the detector."""
+        now = time.monotonic()
+        self.counts["checked"] += 1
+        if self.present:
+            self._admitted(now)
+            return True
+        frame = frames
+        if isinstance(frames, tuple):
+            frame = frames[1] if frames[1] is not None else frames[0]
+        moving = self.gate.motion(frame) >= self.motion_fraction
+        started = moving and not self.moving
+        self.moving = moving
+        since = now - self.t_detect
+        if moving:
+            self.counts["motion"] += 1
+            if self.t_motion is None:
+                self.t_motion = now
+        if (started or (moving and since >= self._stretched(MOTION_INTERVAL))
+                or since >= self._stretched(self.idle_interval)):
+            self._admitted(now)
+            return True
+        self.counts["gated"] += 1
+        return False
+
+    def _admitted(self, now):
+        self.counts["detected"] += 1
+        self.t_detect = now
+        self.t_admit = now
+
+    def observe(self, results):
+        """Feed each detection result (FER-style faces with 'track_id') back in."""
+        now = time.monotonic()
+        if self.t_admit is not None:
+            self.busy += now - self.t_admit
+            self.t_admit = None
+        present = bool(results)
+        self.mode_time["child" if self.present else "empty"] += now - self.t_mode
+        self.t_mode = now
+
+        if not present:
+            if self.present:
+                self.gate.reset()
+                self.idle_interval = IDLE_INTERVAL
+            else:
+                self.idle_interval = min(MAX_INTERVAL, self.idle_interval * BACKOFF)
+            self.present = False
+            self.last_readings = {}
+            self.volatility = 0.0
+            if not self.moving:
+                self.t_motion = None
+            return
+
+        if not self.present and self.t_motion is not None:
+            dt = now - self.t_motion
+            self.wake.record(dt)
+            profiler.record("governor.wake", dt)
+        self.present = True
+        self.t_motion = None
+
+        # Largest reading-to-reading change of any face (total variation, 0-1)
+        change = 0.0
+        readings = {}
+        for face in results:
+            track_id = face.get("track_id")
+            emotions = face.get("emotions") or {}
+            previous = self.last_readings.get(track_id)
+            if previous is not None:
+                change = max(change, sum(abs(v - previous.get(k, 0.0)) for k, v in emotions.items()) / 2)
+            readings[track_id] = emotions
+        self.last_readings = readings
+        self.volatility += 0.5 * (change - self.volatility)
+        if self.volatility >= VOLATILE:
+            self.interval = FAST_INTERVAL
+        else:
+            self.interval = min(CALM_INTERVAL, max(self.interval * BACKOFF, 0.05))
+
+    # ---------------- Metrics ----------------
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.t0, 1e-9)
+        cpu = time.process_time() - self.cpu0
+        wake = self.wake.summary()
+        return {
+            **self.counts,
+            "mode": "child" if self.present else "empty",
+            "interval_s": self.delay(),
+            "stretch": self.stretch(),
+            "duty_cycle": self.busy / elapsed,
+            "detector_s_per_min": self.busy / elapsed * 60,
+            "cpu_s_per_min": cpu / elapsed * 60,
+            "cpu_percent": cpu / elapsed * 100,
+            "child_time_s": self.mode_time["child"],
+            "empty_time_s": self.mode_time["empty"],
+            "wake_p50_ms": wake["p50_ms"],
+            "wake_max_ms": wake["max_ms"],
+        }
+
+    def report(self):
+        s = self.stats()
+        print(f"[GOVERNOR] {s['mode']}: next frame in {s['interval_s']:.2f}s (x{s['stretch']:.1f} thermal), "
+              f"detector duty {s['duty_cycle']:.0%}, CPU {s['cpu_percent']:.0f}% "
+              f"({s['cpu_s_per_min']:.1f} CPU s/min)")
+        print(f"[GOVERNOR] {s['detected']} detections, {s['gated']} frames gated, "
+              f"child in view {s['child_time_s']:.0f}s / empty {s['empty_time_s']:.0f}s, "
+              f"wake p50 {s['wake_p50_ms']:.0f} ms (max {s['wake_max_ms']:.0f} ms)")
+        return s
@@ -0,0 +1,136 @@
+"""
+inference_client.py
+Robot side of the fleet inference mode (inference_server.py).
+- RemoteDetector is an EmotionDetector: FaceTracker, main.py and the
+  benchmarks use it exactly like the local backends
+- Frames are JPEG-encoded and sent over one persistent TCP connection;
+  the tracked face boxes go along, so tracked frames only need the
+  classifier, and lores frames are sent as they are for face searches
+- One request at a time per robot; a timeout or lost connection raises
+  ConnectionError (the pipeline skips that frame) and the next call
+  reconnects, at most once every RECONNECT_DELAY seconds
+"""
+
+import itertools
+import socket
+import threading
+import time
+
+import cv2
+
+import profiler
+from emotion_detector import EmotionDetector
+from inference_server import DEFAULT_PORT, recv_message, send_message
+from pipeline import StageStats
+
+DEFAULT_SERVER = f"127.0.0.1:{DEFAULT_PORT}"
+JPEG_QUALITY = 80
+REQUEST_TIMEOUT = 2.0      # seconds to wait for a reply
+RECONNECT_DELAY = 1.0      # seconds between connection attempts
+
+
+def parse_address(address):
+    """(host, port) from "host:port" or a (host, port) tuple."""
+    if isinstance(address, str):
+        host, _, port = address.rpartition(":")
+        return host or "127.0.0.1", int(port or DEFAULT_PORT)
+    return tuple(address)
+
+
+class RemoteDetector(EmotionDetector):
+    """EmotionDetector whose model runs on an inference server."""
+
+    name = "remote"
+
+    def __init__(self, address=DEFAULT_SERVER, robot_name=None, quality=JPEG_QUALITY,
+                 timeout=REQUEST_TIMEOUT):
+        self.address = parse_address(address)
+        self.robot_name = robot_name or socket.gethostname()
+        self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        self.timeout = timeout
+        self.sock = None
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.last_attempt = 0.0
+        self.rtt = StageStats("remote", window=500)
+        self.errors = 0
+        self.bytes_sent = 0
+        self.last_reply = {}
+
+    # ---------------- Connection ----------------
+
+    def _connect(self):
+        now = time.monotonic()
+        if now - self.last_attempt < RECONNECT_DELAY:
+            raise ConnectionError("inference server unavailable")
+        self.last_attempt = now
+        try:
+            sock = socket.create_connection(self.address, timeout=self.timeout)
+        except OSError as e:
+            raise ConnectionError(f"cannot reach inference server {self.address[0]}:{self.address[1]}: {e}")
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        send_message(sock, {"op": "hello", "name": self.robot_name})
+        self.sock = sock
+        print(f"[REMOTE] Connected to inference server {self.address[0]}:{self.address[1]}")
+
+    def close(self):
+        with self.lock:
+            self._drop_connection()
+
+    def _drop_connection(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _request(self, op, frame, boxes=None):
+        ok, jpeg = cv2.imencode(".jpg", frame, self.encode_params)
+        if not ok:
+            raise ValueError("could not JPEG-encode the frame")
+        body = jpeg.tobytes()
+        with self.lock:
+            if self.sock is None:
+                self._connect()
+            request_id = next(self.ids)
+            header = {"id": request_id, "op": op,
+                      "boxes": [list(map(int, box)) for box in boxes] if boxes is not None else None}
+            t0 = time.perf_counter()
+            try:
+                send_message(self.sock, header, body)
+                while True:
+                    reply, _ = recv_message(self.sock)
+                    # Replies to requests that timed out earlier are skipped
+                    if reply.get("id") == request_id:
+                        break
+            except (OSError, ValueError) as e:
+                self.errors += 1
+                self._drop_connection()
+                raise ConnectionError(f"inference request failed: {e}")
+            rtt = time.perf_counter() - t0
+        self.bytes_sent += len(body)
+        if "error" in reply:
+            self.errors += 1
+            raise ConnectionError(f"inference server: {reply['error']}")
+        self.rtt.record(rtt)
+        profiler.record("remote.rtt", rtt)
+        self.last_reply = reply
+        return reply
+
+    # ---------------- EmotionDetector ----------------
+
+    def find_faces(self, frame, bgr=False):
+        return [tuple(box) for box in self._request("find", frame)["faces"]]
+
+    def classify(self, frame, boxes):
+        return [face["emotions"] for face in self.detect_emotions(frame, face_rectangles=boxes)]
+
+    def detect_emotions(self, frame, face_rectangles=None):
+        if face_rectangles is not None and len(face_rectangles) == 0:
+            return []
+        results = self._request("detect", frame, face_rectangles)["results"]
+        return [{"box": tuple(face["box"]), "emotions": face["emotions"]} for face in results]
+
+    def stats(self):
+        s = self.rtt.summary()
+        return {"requests": s["count"], "errors": self.errors, "rtt_p50_ms": s["p50_ms"],
+                "rtt_p95_ms": s["p95_ms"], "server_ms": self.last_reply.get("server_ms", 0.0),
+                "batch": self.last_reply.get("batch", 0), "kb_sent": self.bytes_sent / 1024}
@@ -0,0 +1,399 @@
+"""
+inference_server.py
+Shared emotion inference for a fleet of KOKO robots.
+- Each robot runs main.py with EMOTION_BACKEND = "remote"; its
+  RemoteDetector (inference_client.py) keeps one TCP connection open and
+  sends JPEG frames (full or lores) with the face boxes it is tracking
+- A process pool runs the detector backend ("onnx", "fer", or "stub", a
+  fixed-cost stand-in for tests); each worker loads the model once
+- Micro-batching: requests waiting from all robots are gathered for up to
+  max_wait seconds (or max_batch requests) and their face crops are
+  classified in one call (EmotionDetector.classify_many)
+- Fairness: batches are filled round-robin, one request per robot per
+  round, so a fast robot cannot crowd out the others
+- Backpressure: at most one batch per worker is in flight; each robot may
+  have max_pending requests queued, and beyond that its oldest one is
+  answered "dropped" (latest frame wins, like pipeline.py's queues)
+- Replies are FER-style: {'box': (x, y, w, h), 'emotions': {...}}
+  Recommendation stays on the robot (recommender_engine)
+
+Wire format, both ways: 8-byte header (JSON length, body length, big
+endian), a JSON header, then the body (the JPEG for requests).
+
+Usage:
+    python3 inference_server.py --backend onnx --workers 2
+    python3 inference_server.py --backend stub --port 9200    # no model needed
+"""
+
+import argparse
+import itertools
+import json
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from emotion_detector import EMOTIONS, EmotionDetector, create_detector
+from pipeline import StageStats
+
+DEFAULT_PORT = 9200
+HEADER = struct.Struct("!II")     # JSON header length, body length
+MAX_MESSAGE = 8 * 1024 * 1024     # bytes; larger messages close the connection
+
+
+# ---------------- Wire format ----------------
+
+def send_message(sock, header, body=b""):
+    data = json.dumps(header, separators=(",", ":")).encode()
+    sock.sendall(HEADER.pack(len(data), len(body)) + data + body)
+
+
+def _recv_exact(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    while n:
+        got = sock.recv_into(view, n)
+        if not got:
+            raise ConnectionError("connection closed")
+        view = view[got:]
+        n -= got
+    return bytes(buf)
+
+
+def recv_message(sock):
+    """(header dict, body bytes); raises ConnectionError when the peer goes away."""
+    header_len, body_len = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    if header_len + body_len > MAX_MESSAGE:
+        raise ConnectionError(f"message too large ({header_len + body_len} bytes)")
+    header = json.loads(_recv_exact(sock, header_len))
+    return header, _recv_exact(sock, body_len) if body_len else b""
+
+
+# ---------------- Workers ----------------
+
+class StubDetector(EmotionDetector):
+    """
+    Model-free stand-in with a fixed cost: one face in the middle of every
+    frame, found in find_ms; a classify call costs batch_ms plus face_ms per face.
+    """
+
+    name = "stub"
+
+    def __init__(self, find_ms=10.0, batch_ms=5.0, face_ms=1.0):
+        self.find_ms = find_ms
+        self.batch_ms = batch_ms
+        self.face_ms = face_ms
+
+    def find_faces(self, frame, bgr=False):
+        time.sleep(self.find_ms / 1000)
+        h, w = frame.shape[:2]
+        return [(w // 3, h // 4, w // 3, h // 2)]
+
+    def classify(self, frame, boxes):
+        return self.classify_many([(frame, boxes)])[0]
+
+    def classify_many(self, items):
+        faces = sum(len(boxes) for _, boxes in items)
+        time.sleep((self.batch_ms + self.face_ms * faces) / 1000)
+        neutral = {k: (0.7 if k == "neutral" else 0.05) for k in EMOTIONS}
+        return [[dict(neutral) for _ in boxes] for _, boxes in items]
+
+
+_detector = None
+
+
+def _init_worker(backend, options):
+    global _detector
+    _detector = StubDetector(**options) if backend == "stub" else create_detector(backend, **options)
+
+
+def _infer_batch(requests):
+    """
+    Run one micro-batch in a worker: [(op, boxes, jpeg)] -> [reply dict].
+    "find" returns face boxes; "detect" classifies the given boxes (or the
+    faces it finds) with one classify_many() call for the whole batch.
+    """
+    t0 = time.perf_counter()
+    frames, replies = [], []
+    for op, boxes, jpeg in requests:
+        frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            frames.append((None, []))
+            replies.append({"error": "could not decode frame"})
+            continue
+        if boxes is None:
+            boxes = _detector.find_faces(frame)
+        boxes = [tuple(int(v) for v in box) for box in boxes]
+        frames.append((frame, boxes if op == "detect" else []))
+        replies.append({"faces": boxes} if op == "find" else None)
+    emotions = _detector.classify_many(frames)
+    for i, ((_, boxes), scores) in enumerate(zip(frames, emotions)):
+        if replies[i] is None:
+            replies[i] = {"results": [{"box": box, "emotions": e} for box, e in zip(boxes, scores)]}
+    infer_ms = (time.perf_counter() - t0) * 1000
+    for reply in replies:
+        reply["infer_ms"] = infer_ms
+    return replies
+
+
+# ---------------- Server ----------------
+
+class _Client:
+    def __init__(self, client_id, sock, address):
+        self.id = client_id
+        self.name = f"{address[0]}:{address[1]}"
+        self.sock = sock
+        self.send_lock = threading.Lock()
+        self.pending = deque()     # (header, body, t_arrival)
+        self.stats = StageStats(self.name)   # arrival -> reply, drops
+
+    def send(self, header, body=b""):
+        with self.send_lock:
+            try:
+                send_message(self.sock, header, body)
+            except OSError:
+                pass              # the read loop notices and drops the client
+
+
+class InferenceServer:
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, backend="onnx", workers=2,
+                 max_batch=8, max_wait=0.005, max_pending=2, detector_options=None):
+        self.host = host
+        self.port = port
+        self.backend = backend
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_pending = max_pending
+        self.detector_options = detector_options or {}
+        self.cond = threading.Condition()
+        self.clients = {}
+        self.ids = itertools.count(1)
+        self.rr = 0                # round-robin start position
+        self.slots = threading.Semaphore(max(1, workers))
+        self.executor = None
+        self.sock = None
+        self.running = False
+        self.batches = 0
+        self.batched_requests = 0
+        self.dropped = 0
+        self.queue_stats = StageStats("queue")
+        self.infer_stats = StageStats("infer")
+
+    # ---------------- Lifecycle ----------------
+
+    def start(self):
+        """Load the model in every worker, then start accepting robots."""
+        initargs = (self.backend, self.detector_options)
+        if self.workers > 0:
+            self.executor = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=initargs)
+        else:
+            # In-process, for tests and single-machine setups
+            self.executor = ThreadPoolExecutor(1, initializer=_init_worker, initargs=initargs)
+        # One empty batch per worker, so no robot waits for a model load
+        for future in [self.executor.submit(_infer_batch, []) for _ in range(max(1, self.workers))]:
+            future.result()
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen()
+        self.port = self.sock.getsockname()[1]
+        self.running = True
+        for target in (self._accept_loop, self._batch_loop):
+            threading.Thread(target=target, daemon=True).start()
+        print(f"[SERVER] {self.backend} inference on {self.host}:{self.port} "
+              f"({self.workers or 'in-process'} workers, batches of up to {self.max_batch})")
+        return self
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+            clients = list(self.clients.values())
+        if self.sock is not None:
+            self.sock.close()
+        for client in clients:
+            try:
+                client.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            client.sock.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ---------------- Connections ----------------
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                sock, address = self.sock.accept()
+            except OSError:
+                break
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = _Client(next(self.ids), sock, address)
+            with self.cond:
+                self.clients[client.id] = client
+            threading.Thread(target=self._read_loop, args=(client,), daemon=True).start()
+
+    def _read_loop(self, client):
+        try:
+            while self.running:
+                header, body = recv_message(client.sock)
+                if header.get("op") == "hello":
+                    client.name = str(header.get("name", client.name))
+                    client.stats.name = client.name
+                    print(f"[SERVER] Robot {client.name} connected")
+                    continue
+                dropped = None
+                with self.cond:
+                    if len(client.pending) >= self.max_pending:
+                        dropped = client.pending.popleft()
+                        client.stats.drop()
+                        self.dropped += 1
+                    client.pending.append((header, body, time.perf_counter()))
+                    self.cond.notify_all()
+                if dropped is not None:
+                    client.send({"id": dropped[0].get("id"), "error": "dropped"})
+        except (ConnectionError, OSError, ValueError) as e:
+            if self.running:
+                print(f"[SERVER] Robot {client.name} disconnected ({e})")
+        finally:
+            with self.cond:
+                self.clients.pop(client.id, None)
+            client.sock.close()
+
+    # ---------------- Batching ----------------
+
+    def _waiting(self):
+        return sum(len(c.pending) for c in self.clients.values())
+
+    def _take_batch(self):
+        """Round-robin over robots, one request each per round, up to max_batch."""
+        clients = list(self.clients.values())
+        if not clients:
+            return []
+        start = self.rr % len(clients)
+        order = clients[start:] + clients[:start]
+        self.rr += 1
+        batch = []
+        while len(batch) < self.max_batch:
+            took = False
+            for client in order:
+                if client.pending and len(batch) < self.max_batch:
+                    batch.append((client, *client.pending.popleft()))
+                    took = True
+            if not took:
+                break
+        return batch
+
+    def _batch_loop(self):
+        while self.running:
+            # Backpressure: wait for a free worker before collecting requests
+            self.slots.acquire()
+            with self.cond:
+                while self.running and not self._waiting():
+                    self.cond.wait(0.1)
+                # Give robots without a queued request a moment to join the batch
+                deadline = time.perf_counter() + self.max_wait
+                while (self.running and self._waiting() < self.max_batch
+                       and any(not c.pending for c in self.clients.values())):
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                batch = self._take_batch()
+            if not self.running or not batch:
+                self.slots.release()
+                continue
+            now = time.perf_counter()
+            for _, _, _, t_arrival in batch:
+                self.queue_stats.record(now - t_arrival)
+            requests = [(h.get("op", "detect"), h.get("boxes"), body) for _, h, body, _ in batch]
+            try:
+                future = self.executor.submit(_infer_batch, requests)
+            except RuntimeError:
+                self.slots.release()
+                break
+            future.add_done_callback(lambda f, batch=batch: self._deliver(batch, f))
+            self.batches += 1
+            self.batched_requests += len(batch)
+
+    def _deliver(self, batch, future):
+        self.slots.release()
+        try:
+            replies = future.result()
+        except Exception as e:
+            replies = [{"error": f"inference failed: {e}"}] * len(batch)
+        now = time.perf_counter()
+        for (client, header, _, t_arrival), reply in zip(batch, replies):
+            reply = dict(reply, id=header.get("id"), batch=len(batch),
+                         server_ms=(now - t_arrival) * 1000)
+            client.stats.record(now - t_arrival)
+            client.send(reply)
+        if replies:
+            self.infer_stats.record(replies[0].get("infer_ms", 0.0) / 1000)
+
+    # ---------------- Stats ----------------
+
+    def stats(self):
+        with self.cond:
+            clients = list(self.clients.values())
+        return {
+            "clients": len(clients),
+            "batches": self.batches,
+            "requests": self.batched_requests,
+            "dropped": self.dropped,
+            "mean_batch": self.batched_requests / self.batches if self.batches else 0.0,
+            "queue": self.queue_stats.summary(),
+            "infer": self.infer_stats.summary(),
+            "robots": {c.name: c.stats.summary() for c in clients},
+        }
+
+    def report(self):
+        s = self.stats()
+        print(f"[SERVER] {s['clients']} robots, {s['batches']} batches (mean {s['mean_batch']:.1f} requests), "
+              f"queue p95 {s['queue']['p95_ms']:.1f} ms, infer p95 {s['infer']['p95_ms']:.1f} ms")
+        for name, r in s["robots"].items():
+            print(f"[SERVER]   {name:<20} {r['rate']:5.1f} fps  p50 {r['p50_ms']:6.1f} ms  "
+                  f"p95 {r['p95_ms']:6.1f} ms  dropped {r['dropped']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve emotion inference to several KOKO robots")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--backend", default="onnx", choices=("fer", "onnx", "stub"))
+    parser.add_argument("--workers", type=int, default=2, help="detector processes; 0 = in-process")
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="how long a batch may wait to fill")
+    parser.add_argument("--max-pending", type=int, default=2, help="queued requests per robot")
+    parser.add_argument("--report", type=float, default=30.0, help="seconds between stats reports")
+    args = parser.parse_args()
+
+    server = InferenceServer(args.host, args.port, args.backend, args.workers, args.max_batch,
+                             args.max_wait_ms / 1000, args.max_pending).start()
+    try:
+        while True:
+            time.sleep(args.report)
+            server.report()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
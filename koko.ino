@@ -1,18 +1,38 @@
 /*
   KOKO_EmotionTest.ino
   ---------------------
-  Use this to manually test KOKO robot’s motion system from the Serial Monitor.
+  KOKO robot motion firmware.
 
-  Type one of these in the Serial Monitor (set NL & CR, 9600 baud):
-    HAPPY
-    SAD
-    ANGRY
-    NEUTRAL
-    SURPRISE
+  Commands arrive either as binary frames from robot_controller.py (see
+  serial_protocol.py / koko_protocol.h) or as text lines typed into the
+  Serial Monitor (set NL & CR, 9600 baud), e.g.:
+    REWARD_LEARNING
+    GENTLE_FORWARD
+    SLOW_BACK
+    INTERACTIVE_PROMPT
+    SHOW_SURPRISED_EYES
+    STOP
+    STATUS
+  Every action key in KOKO_ACTION_NAMES is accepted.
 
-  The robot will perform the corresponding action.
+  The robot will perform the corresponding action. Actions are tables of
+  motion steps run by a millis() scheduler, so serial input is read while
+  the robot moves: a new action or STOP interrupts the running one at once.
+
+  Text replies:
+    Emotion received: <COMMAND>     as soon as a command line is read
+    Done: <COMMAND>                 when the action has finished
+    Interrupted: <COMMAND>          when a newer command stopped it
+    Unknown emotion! Try again.     for commands with no action
+  Binary replies are 6-byte frames: ack, done, preempted, unknown, bad frame,
+  status (running action + current step).
+
+  koko_protocol.h is generated from the Python action table, with the
+  motion step tables and routine labels (python3 serial_protocol.py).
 */
 
+#include "koko_protocol.h"
+
 #define ENA 5     // PWM Left motor
 #define IN1 6
 #define IN2 7
@@ -20,12 +40,27 @@
 #define IN3 8
 #define IN4 9
 
-String emotion = "";
+uint8_t frame[KOKO_FRAME_LEN];
+uint8_t frameLen = 0;
+char textBuf[32];
+uint8_t textLen = 0;
+
+/* ---------------- Motion State ---------------- */
+
+const Routine *active = NULL;   // running routine, NULL when idle
+uint8_t activeAction = 0;       // index into KOKO_ACTION_NAMES
+uint8_t activeSeq = 0;
+bool activeText = false;        // started from a text command: reply in text
+uint8_t activeSpeed = 0;        // 0 = step default
+uint16_t activeStepMs = DEFAULT_STEP_MS;
+uint8_t stepIndex = 0;
+unsigned long stepStart = 0;
+unsigned long stepLen = 0;
 
 void setup() {
   Serial.begin(9600);
   Serial.println("=== KOKO Emotion Test ===");
-  Serial.println("Type an emotion (HAPPY / SAD / ANGRY / NEUTRAL / SURPRISE)");
+  Serial.println("Type an action (e.g. GENTLE_FORWARD / SLOW_BACK / SHOW_SURPRISED_EYES)");
   Serial.println("and press ENTER.\n");
 
   pinMode(ENA, OUTPUT);
@@ -39,32 +74,188 @@ void setup() {
 }
 
 void loop() {
-  if (Serial.available() > 0) {
-    emotion = Serial.readStringUntil('\n');
-    emotion.trim();
-    emotion.toUpperCase();
-    Serial.print("Emotion received: ");
-    Serial.println(emotion);
-
-    if (emotion == "REWARD_LEARNING") {
-      actionHappy();
-    } 
-    else if (emotion == "GENTLE_FORWARD") {
-      actionSad();
-    } 
-    else if (emotion == "SLOW_BACK") {
-      actionAngry();
-    } 
-    else if (emotion == "INTERACTIVE_PROMPT") {
-      actionNeutral();
-    } 
-    else if (emotion == "SHOW_SURPRISED_EYES") {
-      actionSurprise();
-    } 
-    else {
-      Serial.println("Unknown emotion! Try again.");
+  while (Serial.available() > 0) {
+    uint8_t b = Serial.read();
+
+    // Binary frame: starts with the magic byte, fixed length
+    if (frameLen > 0 || b == KOKO_FRAME_MAGIC) {
+      frame[frameLen++] = b;
+      if (frameLen == KOKO_FRAME_LEN) {
+        frameLen = 0;
+        handleFrame();
+      }
+      continue;
+    }
+
+    // Text line
+    if (b == '\n' || b == '\r') {
+      if (textLen > 0) {
+        textBuf[textLen] = '\0';
+        textLen = 0;
+        handleText(textBuf);
+      }
+    } else if (textLen < sizeof(textBuf) - 1) {
+      textBuf[textLen++] = toupper(b);
     }
   }
+
+  updateMotion();
+}
+
+/* ---------------- Protocol ---------------- */
+
+uint8_t koko_crc8(const uint8_t *data, uint8_t len) {
+  uint8_t crc = 0;
+  for (uint8_t i = 0; i < len; i++) {
+    crc ^= data[i];
+    for (uint8_t bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x80) ? (uint8_t)((crc << 1) ^ 0x07) : (uint8_t)(crc << 1);
+    }
+  }
+  return crc;
+}
+
+void sendReply(uint8_t seq, uint8_t type, uint8_t opcode, uint8_t arg) {
+  uint8_t reply[KOKO_REPLY_LEN] = {KOKO_REPLY_MAGIC, seq, type, opcode, arg, 0};
+  reply[5] = koko_crc8(reply + 1, 4);
+  Serial.write(reply, KOKO_REPLY_LEN);
+}
+
+void printActionName(uint8_t action) {
+  Serial.println((const __FlashStringHelper *)pgm_read_word(&KOKO_ACTION_NAMES[action]));
+}
+
+void handleFrame() {
+  uint8_t seq = frame[1];
+  uint8_t opcode = frame[2];
+  if (koko_crc8(frame + 1, 5) != frame[6]) {
+    sendReply(seq, REPLY_BAD_FRAME, opcode, 0);
+    return;
+  }
+  uint8_t speed = frame[3];
+  uint16_t stepMs = frame[4] | ((uint16_t)frame[5] << 8);
+
+  if (opcode == OP_PING) {
+    sendReply(seq, REPLY_ACK, opcode, 0);
+  }
+  else if (opcode == OP_STATUS) {
+    if (active) {
+      sendReply(seq, REPLY_STATUS, KOKO_FIRST_ACTION + activeAction, stepIndex);
+    } else {
+      sendReply(seq, REPLY_STATUS, 0, KOKO_STATUS_IDLE);
+    }
+  }
+  else if (opcode == OP_STOP) {
+    interruptMotion();
+    sendReply(seq, REPLY_ACK, opcode, 0);
+  }
+  else if (opcode == OP_SET_BAUD && speed < KOKO_NUM_BAUD_RATES) {
+    sendReply(seq, REPLY_ACK, opcode, speed);
+    Serial.flush();
+    Serial.begin(pgm_read_dword(&KOKO_BAUD_RATES[speed]));
+  }
+  else if (opcode >= KOKO_FIRST_ACTION && opcode < KOKO_FIRST_ACTION + KOKO_NUM_ACTIONS) {
+    sendReply(seq, REPLY_ACK, opcode, 0);
+    startMotion(opcode - KOKO_FIRST_ACTION, seq, false, speed, stepMs);
+  }
+  else {
+    sendReply(seq, REPLY_UNKNOWN, opcode, 0);
+  }
+}
+
+void handleText(const char *cmd) {
+  Serial.print("Emotion received: ");
+  Serial.println(cmd);
+  if (strcmp(cmd, "STOP") == 0) {
+    interruptMotion();
+    return;
+  }
+  if (strcmp(cmd, "STATUS") == 0) {
+    Serial.print("Status: ");
+    if (!active) {
+      Serial.println("idle");
+      return;
+    }
+    Serial.print("step ");
+    Serial.print(stepIndex);
+    Serial.print(" of ");
+    printActionName(activeAction);
+    return;
+  }
+  for (uint8_t i = 0; i < KOKO_NUM_ACTIONS; i++) {
+    if (strcmp_P(cmd, (PGM_P)pgm_read_word(&KOKO_ACTION_NAMES[i])) == 0) {
+      startMotion(i, 0, true, 0, 0);
+      return;
+    }
+  }
+  Serial.println("Unknown emotion! Try again.");
+}
+
+/* ---------------- Motion Scheduler ---------------- */
+
+void startMotion(uint8_t action, uint8_t seq, bool text, uint8_t speed, uint16_t stepMs) {
+  interruptMotion();
+  active = &KOKO_ROUTINES[pgm_read_byte(&KOKO_ACTION_ROUTINE[action])];
+  activeAction = action;
+  activeSeq = seq;
+  activeText = text;
+  activeSpeed = speed;
+  activeStepMs = stepMs ? stepMs : DEFAULT_STEP_MS;
+  if (text) Serial.println((const __FlashStringHelper *)active->label);
+  enterStep(0);
+}
+
+void enterStep(uint8_t i) {
+  if (i >= active->count) {
+    finishMotion();
+    return;
+  }
+  MotionStep step;
+  memcpy_P(&step, &active->steps[i], sizeof(step));
+  stepIndex = i;
+  stepStart = millis();
+  stepLen = (unsigned long)activeStepMs * step.length / 100;
+  applyMotion(step.motion, activeSpeed ? activeSpeed : step.speed);
+}
+
+// Called every loop(): advance to the next step once the current one has run its time
+void updateMotion() {
+  if (active && millis() - stepStart >= stepLen) {
+    enterStep(stepIndex + 1);
+  }
+}
+
+void finishMotion() {
+  stopMotion();
+  active = NULL;
+  if (activeText) {
+    Serial.print("Done: ");
+    printActionName(activeAction);
+  } else {
+    sendReply(activeSeq, REPLY_DONE, KOKO_FIRST_ACTION + activeAction, 0);
+  }
+}
+
+// Stop the running routine (if any) and tell the host it was cut short
+void interruptMotion() {
+  stopMotion();
+  if (!active) return;
+  active = NULL;
+  if (activeText) {
+    Serial.print("Interrupted: ");
+    printActionName(activeAction);
+  } else {
+    sendReply(activeSeq, REPLY_PREEMPTED, KOKO_FIRST_ACTION + activeAction, stepIndex);
+  }
+}
+
+void applyMotion(uint8_t motion, int speedVal) {
+  switch (motion) {
+    case M_FORWARD:    forward(speedVal); break;
+    case M_BACKWARD:   backward(speedVal); break;
+    case M_SPIN_RIGHT: spinRight(speedVal); break;
+    default:           stopMotion(); break;
+  }
 }
 
 /* ---------------- Motor Control ---------------- */
@@ -77,7 +268,7 @@ void forward(int speedVal) {
   digitalWrite(IN3, LOW);
   digitalWrite(IN4, HIGH);
 
-  
+
 }
 
 void backward(int speedVal) {
@@ -94,11 +285,11 @@ void backward(int speedVal) {
 void spinRight(int speedVal) {
   analogWrite(ENA, speedVal);  // Left motor speed
   analogWrite(ENB, speedVal);  // Right motor speed
-  
+
   // Left motors FORWARD
   digitalWrite(IN1, HIGH);
   digitalWrite(IN2, LOW);
-  
+
   // Right motors BACKWARD
   digitalWrite(IN3, LOW);
   digitalWrite(IN4, HIGH);
@@ -113,68 +304,3 @@ void stopMotion() {
   digitalWrite(IN3, LOW);
   digitalWrite(IN4, LOW);
 }
-
-/* ---------------- Emotion Actions ---------------- */
-
-void actionHappy() {
-  Serial.println("🙂 HAPPY → forward spin + backward spin (fast)");
-  spinRight(255);
-  delay(1000);
-  backward(255);
-  delay(1000);
-  stopMotion();
-  spinRight(255);
-  delay(1000);
-  backward(255);
-  delay(1000);
-  stopMotion();
-  spinRight(255);
-  delay(1000);
-  backward(255);
-  delay(1000);
-  stopMotion();
-}
-
-void actionSad() {
-  Serial.println("😔 SAD → slow spin");
-  spinRight(200);
-  delay(1000);
-  stopMotion();
-}
-
-void actionAngry() {
-  Serial.println("😠 ANGRY → slow backward");
-  backward(200);
-  delay(1000);
-  stopMotion();
-  backward(200);
-  delay(1000);
-  stopMotion();
-  backward(200);
-  delay(1000);
-  stopMotion();
-}
-
-void actionNeutral() {
-  Serial.println("😐 NEUTRAL → stay still");
-  stopMotion();
-}
-
-void actionSurprise() {
-  Serial.println("😲 SURPRISE → quick forward + backward");
-  forward(255);
-  delay(1000);
-  backward(255);
-  delay(1000);
-  stopMotion();
-  forward(255);
-  delay(1000);
-  backward(255);
-  delay(1000);
-  stopMotion();
-  forward(255);
-  delay(1000);
-  backward(255);
-  delay(1000);
-  stopMotion();
-}
@@ -0,0 +1,375 @@
+"""
+koko_emulator.py
+Virtual Arduino running koko.ino's command handling on a pseudo-terminal.
+- Opens a pty pair; RobotController (or any pyserial client) connects to
+  emulator.port exactly as it would to /dev/ttyUSB0
+- Speaks both protocols like the firmware: binary frames with CRC-8 replies
+  (ack / done / preempted / status / unknown / bad frame) and text lines
+  ("Emotion received: ...", the routine label, "Done: ...",
+  "Unknown emotion! Try again.")
+- Motion routines, step lengths and labels come from serial_protocol.py,
+  which generates the firmware's tables too, so both run the same steps
+- Link faults to test against:
+    latency         one-way delay added to every byte, seconds
+    baud / max_baud the emulated UART speed; bytes take 10 bits each, a
+                    host on another speed reads garbage, and SET_BAUD above
+                    max_baud is refused like an out-of-range index
+    drop_rate       probability that any byte, either way, is lost
+    reset_delay     bootloader time after start()/reset() during which
+                    input is discarded, as when DTR resets the board
+    blocking=True   the old firmware: each routine runs with delay(), input
+                    waits in the 64-byte RX buffer (overflow is lost) and
+                    nothing can be preempted
+
+Usage:
+    python3 koko_emulator.py                 # prints the port, runs until Ctrl+C
+    python3 koko_emulator.py --latency 0.005 --drop 0.01
+"""
+
+import argparse
+import os
+import pty
+import random
+import select
+import termios
+import threading
+import time
+import tty
+from collections import deque
+
+from serial_protocol import (
+    ACTION_ROUTINES,
+    ACTIONS,
+    BAUD_RATES,
+    DEFAULT_ROUTINE,
+    DEFAULT_STEP_MS,
+    FIRST_ACTION_OPCODE,
+    FRAME_LEN,
+    FRAME_MAGIC,
+    OP_PING,
+    OP_SET_BAUD,
+    OP_STATUS,
+    OP_STOP,
+    REPLY_ACK,
+    REPLY_BAD_FRAME,
+    REPLY_DONE,
+    REPLY_PREEMPTED,
+    REPLY_STATUS,
+    REPLY_UNKNOWN,
+    ROUTINE_LABELS,
+    ROUTINE_STEPS,
+    STATUS_IDLE,
+    crc8,
+    encode_reply,
+)
+
+RX_BUFFER = 64             # Arduino hardware serial receive buffer, bytes
+TEXT_BUFFER = 32           # koko.ino textBuf
+BANNER = ("=== KOKO Emotion Test ===",
+          "Type an action (e.g. GENTLE_FORWARD / SLOW_BACK / SHOW_SURPRISED_EYES)",
+          "and press ENTER.\n")
+
+
+class KokoEmulator:
+    def __init__(self, latency=0.0, baud=9600, max_baud=max(BAUD_RATES), drop_rate=0.0,
+                 reset_delay=2.0, blocking=False, step_ms=None, seed=None):
+        self.latency = latency
+        self.boot_baud = baud
+        self.max_baud = max_baud
+        self.drop_rate = drop_rate
+        self.reset_delay = reset_delay
+        self.blocking = blocking
+        self.step_ms = step_ms or DEFAULT_STEP_MS
+        self.rng = random.Random(seed)
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self._speeds = {getattr(termios, f"B{b}"): b for b in BAUD_RATES if hasattr(termios, f"B{b}")}
+        self.running = False
+        self._thread = None
+        self.counts = {"bytes_in": 0, "bytes_out": 0, "dropped": 0, "garbled": 0, "overflow": 0,
+                       "frames": 0, "bad_frames": 0, "lines": 0, "unknown": 0,
+                       "done": 0, "preempted": 0, "resets": 0}
+        self._reset_state(time.monotonic())
+
+    # ---------------- Board state ----------------
+
+    def _reset_state(self, now):
+        self.baud = self.boot_baud
+        self.boot_until = now + self.reset_delay
+        self.booted = False
+        self.inbox = deque()       # (arrival time, byte) on the wire towards the board
+        self.outbox = []           # [(delivery time, bytes)] on the wire towards the host
+        self.rx_free = now         # when the wire towards the board is idle again
+        self.tx_free = now
+        self.rx = bytearray()
+        self.frame = bytearray()
+        self.text = bytearray()
+        self.active = None         # {"action", "seq", "text", "speed", "step_ms", "steps", "index", ...}
+
+    def reset(self):
+        """Reset the board, as when the host toggles DTR."""
+        self.counts["resets"] += 1
+        self._reset_state(time.monotonic())
+
+    def byte_time(self, n=1):
+        return n * 10.0 / self.baud
+
+    def host_baud(self):
+        try:
+            return self._speeds.get(termios.tcgetattr(self.slave)[5], self.baud)
+        except termios.error:
+            return self.baud
+
+    # ---------------- Wire ----------------
+
+    def _receive(self, data, now):
+        """Bytes written by the host: apply faults and schedule their arrival."""
+        self.counts["bytes_in"] += len(data)
+        if self.drop_rate:
+            kept = bytes(b for b in data if self.rng.random() >= self.drop_rate)
+            self.counts["dropped"] += len(data) - len(kept)
+            data = kept
+        if data and self.host_baud() != self.baud:
+            self.counts["garbled"] += len(data)
+            data = bytes(self.rng.randrange(256) for _ in data)
+        start, step = max(self.rx_free, now) + self.latency, self.byte_time()
+        self.inbox.extend((start + (i + 1) * step, b) for i, b in enumerate(data))
+        self.rx_free = max(self.rx_free, now) + self.byte_time(len(data))
+
+    def _send(self, data):
+        """Bytes written by the firmware: serialise at the board's baud rate."""
+        now = time.monotonic()
+        if self.drop_rate:
+            kept = bytes(b for b in data if self.rng.random() >= self.drop_rate)
+            self.counts["dropped"] += len(data) - len(kept)
+            data = kept
+        self.tx_free = max(self.tx_free, now) + self.byte_time(len(data))
+        if data:
+            self.outbox.append((self.tx_free + self.latency, data))
+
+    def println(self, line=""):
+        self._send((line + "\r\n").encode())
+
+    def reply(self, seq, reply_type, opcode, arg=0):
+        self._send(encode_reply(seq, reply_type, opcode, arg))
+
+    def _flush_outbox(self, now):
+        while self.outbox and self.outbox[0][0] <= now:
+            _, data = self.outbox.pop(0)
+            os.write(self.master, data)
+            self.counts["bytes_out"] += len(data)
+
+    def _deliver_inbox(self, now):
+        while self.inbox and self.inbox[0][0] <= now:
+            _, b = self.inbox.popleft()
+            if now < self.boot_until:
+                continue          # bootloader: input is lost
+            if len(self.rx) >= RX_BUFFER:
+                self.counts["overflow"] += 1
+                continue
+            self.rx.append(b)
+
+    # ---------------- Firmware loop ----------------
+
+    def _loop(self, now):
+        if not self.booted and now >= self.boot_until:
+            self.booted = True
+            for line in BANNER:
+                self.println(line)
+        if not self.booted:
+            return
+        if self.blocking and self.active:
+            self._update_motion(now)
+            return                # stuck in delay(); input waits in the RX buffer
+        while self.rx:
+            b = self.rx.pop(0)
+            if self.frame or b == FRAME_MAGIC:
+                self.frame.append(b)
+                if len(self.frame) == FRAME_LEN:
+                    frame, self.frame = bytes(self.frame), bytearray()
+                    self._handle_frame(frame, now)
+            elif b in (0x0A, 0x0D):
+                if self.text:
+                    line, self.text = self.text.decode(errors="replace"), bytearray()
+                    self._handle_text(line, now)
+            elif len(self.text) < TEXT_BUFFER - 1:
+                self.text.append(ord(chr(b).upper()) if b < 0x80 else b)
+            if self.blocking and self.active:
+                break
+        self._update_motion(now)
+
+    def _handle_frame(self, frame, now):
+        self.counts["frames"] += 1
+        seq, opcode = frame[1], frame[2]
+        if crc8(frame[1:6]) != frame[6]:
+            self.counts["bad_frames"] += 1
+            self.reply(seq, REPLY_BAD_FRAME, opcode)
+            return
+        speed = frame[3]
+        step_ms = frame[4] | frame[5] << 8
+        if opcode == OP_PING:
+            self.reply(seq, REPLY_ACK, opcode)
+        elif opcode == OP_STATUS:
+            if self.active:
+                self.reply(seq, REPLY_STATUS, FIRST_ACTION_OPCODE + self.active["action"],
+                           self.active["index"])
+            else:
+                self.reply(seq, REPLY_STATUS, 0, STATUS_IDLE)
+        elif opcode == OP_STOP:
+            self._interrupt()
+            self.reply(seq, REPLY_ACK, opcode)
+        elif opcode == OP_SET_BAUD and speed < len(BAUD_RATES) and BAUD_RATES[speed] <= self.max_baud:
+            self.reply(seq, REPLY_ACK, opcode, speed)
+            # Serial.flush() then Serial.begin(): the ack still leaves at the old rate
+            self.tx_free = max(self.tx_free, now)
+            self.baud = BAUD_RATES[speed]
+        elif FIRST_ACTION_OPCODE <= opcode < FIRST_ACTION_OPCODE + len(ACTIONS):
+            self.reply(seq, REPLY_ACK, opcode)
+            self._start(opcode - FIRST_ACTION_OPCODE, seq, False, speed, step_ms, now)
+        else:
+            self.counts["unknown"] += 1
+            self.reply(seq, REPLY_UNKNOWN, opcode)
+
+    def _handle_text(self, cmd, now):
+        self.counts["lines"] += 1
+        self.println(f"Emotion received: {cmd}")
+        if cmd == "STOP":
+            self._interrupt()
+            return
+        if cmd == "STATUS":
+            if not self.active:
+                self.println("Status: idle")
+            else:
+                self.println(f"Status: step {self.active['index']} of {ACTIONS[self.active['action']].upper()}")
+            return
+        names = [a.upper() for a in ACTIONS]
+        if cmd in names:
+            self._start(names.index(cmd), 0, True, 0, 0, now)
+            return
+        self.counts["unknown"] += 1
+        self.println("Unknown emotion! Try again.")
+
+    # ---------------- Motion scheduler ----------------
+
+    def _start(self, action, seq, text, speed, step_ms, now):
+        self._interrupt()
+        routine = ACTION_ROUTINES.get(ACTIONS[action], DEFAULT_ROUTINE)
+        self.active = {"action": action, "seq": seq, "text": text, "speed": speed,
+                       "step_ms": step_ms or self.step_ms, "steps": ROUTINE_STEPS.get(routine, []),
+                       "index": 0, "step_end": now}
+        if text:
+            self.println(ROUTINE_LABELS.get(routine, routine))
+        self._enter_step(0, now)
+
+    def _enter_step(self, i, now):
+        active = self.active
+        if i >= len(active["steps"]):
+            self._finish()
+            return
+        active["index"] = i
+        active["step_end"] = now + active["step_ms"] * active["steps"][i][2] / 100 / 1000.0
+
+    def _update_motion(self, now):
+        if self.active and now >= self.active["step_end"]:
+            self._enter_step(self.active["index"] + 1, now)
+
+    def _finish(self):
+        active, self.active = self.active, None
+        self.counts["done"] += 1
+        if active["text"]:
+            self.println(f"Done: {ACTIONS[active['action']].upper()}")
+        else:
+            self.reply(active["seq"], REPLY_DONE, FIRST_ACTION_OPCODE + active["action"])
+
+    def _interrupt(self):
+        active, self.active = self.active, None
+        if active is None:
+            return
+        self.counts["preempted"] += 1
+        if active["text"]:
+            self.println(f"Interrupted: {ACTIONS[active['action']].upper()}")
+        else:
+            self.reply(active["seq"], REPLY_PREEMPTED, FIRST_ACTION_OPCODE + active["action"],
+                       active["index"])
+
+    # ---------------- Thread ----------------
+
+    def _next_wakeup(self, now):
+        times = [queue[0][0] for queue in (self.inbox, self.outbox) if queue]
+        if self.active:
+            times.append(self.active["step_end"])
+        if not self.booted:
+            times.append(self.boot_until)
+        return min(0.01, max(0.0, min(times, default=now + 0.01) - now))
+
+    def _run(self):
+        while self.running:
+            now = time.monotonic()
+            readable, _, _ = select.select([self.master], [], [], self._next_wakeup(now))
+            now = time.monotonic()
+            if readable:
+                try:
+                    data = os.read(self.master, 4096)
+                except OSError:
+                    data = b""
+                if data:
+                    self._receive(data, now)
+            self._deliver_inbox(now)
+            self._loop(now)
+            self._flush_outbox(now)
+
+    def start(self):
+        """Power on: the board boots (reset_delay) and the emulator thread starts."""
+        self._reset_state(time.monotonic())
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self._thread:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulate koko.ino on a pseudo-terminal")
+    parser.add_argument("--latency", type=float, default=0.0, help="one-way latency, seconds")
+    parser.add_argument("--baud", type=int, default=9600, choices=BAUD_RATES)
+    parser.add_argument("--max-baud", type=int, default=max(BAUD_RATES), choices=BAUD_RATES)
+    parser.add_argument("--drop", type=float, default=0.0, help="byte drop probability")
+    parser.add_argument("--reset-delay", type=float, default=2.0)
+    parser.add_argument("--step-ms", type=int, default=None, help="default motion step length")
+    parser.add_argument("--blocking", action="store_true", help="emulate the old delay()-based firmware")
+    args = parser.parse_args()
+
+    emulator = KokoEmulator(latency=args.latency, baud=args.baud, max_baud=args.max_baud,
+                            drop_rate=args.drop, reset_delay=args.reset_delay,
+                            blocking=args.blocking, step_ms=args.step_ms).start()
+    print(f"[EMULATOR] koko.ino on {emulator.port} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(5.0)
+            print(f"[EMULATOR] {emulator.counts}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+// koko_protocol.h
+// Generated by serial_protocol.py from recommender_engine.py -- do not edit.
+// Regenerate with: python3 serial_protocol.py
+
+#ifndef KOKO_PROTOCOL_H
+#define KOKO_PROTOCOL_H
+
+#include <avr/pgmspace.h>
+
+#define KOKO_FRAME_MAGIC 0xA5
+#define KOKO_REPLY_MAGIC 0x5A
+#define KOKO_FRAME_LEN 7
+#define KOKO_REPLY_LEN 6
+
+#define OP_PING 0x00
+#define OP_STOP 0x01
+#define OP_STATUS 0x02
+#define OP_SET_BAUD 0x03
+#define KOKO_FIRST_ACTION 0x10
+#define KOKO_NUM_ACTIONS 17
+
+#define OP_DANCE_MOVE 0x10
+#define OP_REWARD_LEARNING 0x11
+#define OP_CELEBRATE 0x12
+#define OP_PLAY_CHEER_MUSIC 0x13
+#define OP_GENTLE_FORWARD 0x14
+#define OP_COMFORT_VIDEO 0x15
+#define OP_CALM_BREATHING 0x16
+#define OP_SLOW_BACK 0x17
+#define OP_BLINK_ALERT 0x18
+#define OP_IDLE_PATROL 0x19
+#define OP_INTERACTIVE_PROMPT 0x1A
+#define OP_MUSIC_SNIPPET 0x1B
+#define OP_QUICK_SPIN 0x1C
+#define OP_SHOW_SURPRISED_EYES 0x1D
+#define OP_RETREAT_SLOW 0x1E
+#define OP_SOOTHING_AUDIO 0x1F
+#define OP_PARENT_NOTIFY 0x20
+
+#define REPLY_ACK 1
+#define REPLY_DONE 2
+#define REPLY_UNKNOWN 3
+#define REPLY_BAD_FRAME 4
+#define REPLY_STATUS 5
+#define REPLY_PREEMPTED 6
+#define KOKO_STATUS_IDLE 0xFF
+
+// Motion routines
+#define ROUTINE_NEUTRAL 0
+#define ROUTINE_HAPPY 1
+#define ROUTINE_SAD 2
+#define ROUTINE_ANGRY 3
+#define ROUTINE_SURPRISE 4
+#define ROUTINE_SPIN 5
+#define ROUTINE_PATROL 6
+#define KOKO_NUM_ROUTINES 7
+
+#define DEFAULT_STEP_MS 1000
+
+enum Motion { M_STOP, M_FORWARD, M_BACKWARD, M_SPIN_RIGHT };
+
+struct MotionStep {
+  uint8_t motion;
+  uint8_t speed;    // PWM; the command's speed overrides it when non-zero
+  uint8_t length;   // percent of the step duration (100 = one step)
+};
+
+struct Routine {
+  const MotionStep *steps;   // PROGMEM
+  uint8_t count;
+  const char *label;         // PROGMEM, printed for text commands
+};
+
+const MotionStep HAPPY_STEPS[] PROGMEM = {
+  {M_SPIN_RIGHT, 255, 100},
+  {M_BACKWARD, 255, 100},
+  {M_SPIN_RIGHT, 255, 100},
+  {M_BACKWARD, 255, 100},
+  {M_SPIN_RIGHT, 255, 100},
+  {M_BACKWARD, 255, 100},
+};
+const MotionStep SAD_STEPS[] PROGMEM = {
+  {M_SPIN_RIGHT, 200, 100},
+};
+const MotionStep ANGRY_STEPS[] PROGMEM = {
+  {M_BACKWARD, 200, 100},
+  {M_BACKWARD, 200, 100},
+  {M_BACKWARD, 200, 100},
+};
+const MotionStep SURPRISE_STEPS[] PROGMEM = {
+  {M_FORWARD, 255, 100},
+  {M_BACKWARD, 255, 100},
+  {M_FORWARD, 255, 100},
+  {M_BACKWARD, 255, 100},
+  {M_FORWARD, 255, 100},
+  {M_BACKWARD, 255, 100},
+};
+const MotionStep SPIN_STEPS[] PROGMEM = {
+  {M_SPIN_RIGHT, 255, 100},
+};
+const MotionStep PATROL_STEPS[] PROGMEM = {
+  {M_FORWARD, 150, 100},
+  {M_SPIN_RIGHT, 150, 50},
+  {M_FORWARD, 150, 100},
+};
+const char NEUTRAL_LABEL[] PROGMEM = "😐 NEUTRAL → stay still";
+const char HAPPY_LABEL[] PROGMEM = "🙂 HAPPY → forward spin + backward spin (fast)";
+const char SAD_LABEL[] PROGMEM = "😔 SAD → slow spin";
+const char ANGRY_LABEL[] PROGMEM = "😠 ANGRY → slow backward";
+const char SURPRISE_LABEL[] PROGMEM = "😲 SURPRISE → quick forward + backward";
+const char SPIN_LABEL[] PROGMEM = "🌀 SPIN → quick spin";
+const char PATROL_LABEL[] PROGMEM = "🚶 PATROL → slow forward + turn";
+
+// Indexed by the ROUTINE_* ids
+const Routine KOKO_ROUTINES[KOKO_NUM_ROUTINES] = {
+  {NULL, 0, NEUTRAL_LABEL},  // ROUTINE_NEUTRAL
+  {HAPPY_STEPS, 6, HAPPY_LABEL},  // ROUTINE_HAPPY
+  {SAD_STEPS, 1, SAD_LABEL},  // ROUTINE_SAD
+  {ANGRY_STEPS, 3, ANGRY_LABEL},  // ROUTINE_ANGRY
+  {SURPRISE_STEPS, 6, SURPRISE_LABEL},  // ROUTINE_SURPRISE
+  {SPIN_STEPS, 1, SPIN_LABEL},  // ROUTINE_SPIN
+  {PATROL_STEPS, 3, PATROL_LABEL},  // ROUTINE_PATROL
+};
+
+// Routine per action, indexed by opcode - KOKO_FIRST_ACTION
+const uint8_t KOKO_ACTION_ROUTINE[KOKO_NUM_ACTIONS] PROGMEM = {
+  ROUTINE_HAPPY,  // dance_move
+  ROUTINE_HAPPY,  // reward_learning
+  ROUTINE_HAPPY,  // celebrate
+  ROUTINE_NEUTRAL,  // play_cheer_music
+  ROUTINE_SAD,  // gentle_forward
+  ROUTINE_NEUTRAL,  // comfort_video
+  ROUTINE_NEUTRAL,  // calm_breathing
+  ROUTINE_ANGRY,  // slow_back
+  ROUTINE_NEUTRAL,  // blink_alert
+  ROUTINE_PATROL,  // idle_patrol
+  ROUTINE_NEUTRAL,  // interactive_prompt
+  ROUTINE_NEUTRAL,  // music_snippet
+  ROUTINE_SPIN,  // quick_spin
+  ROUTINE_SURPRISE,  // show_surprised_eyes
+  ROUTINE_ANGRY,  // retreat_slow
+  ROUTINE_NEUTRAL,  // soothing_audio
+  ROUTINE_NEUTRAL,  // parent_notify
+};
+
+// Action names for the text protocol
+const char KOKO_NAME_0[] PROGMEM = "DANCE_MOVE";
+const char KOKO_NAME_1[] PROGMEM = "REWARD_LEARNING";
+const char KOKO_NAME_2[] PROGMEM = "CELEBRATE";
+const char KOKO_NAME_3[] PROGMEM = "PLAY_CHEER_MUSIC";
+const char KOKO_NAME_4[] PROGMEM = "GENTLE_FORWARD";
+const char KOKO_NAME_5[] PROGMEM = "COMFORT_VIDEO";
+const char KOKO_NAME_6[] PROGMEM = "CALM_BREATHING";
+const char KOKO_NAME_7[] PROGMEM = "SLOW_BACK";
+const char KOKO_NAME_8[] PROGMEM = "BLINK_ALERT";
+const char KOKO_NAME_9[] PROGMEM = "IDLE_PATROL";
+const char KOKO_NAME_10[] PROGMEM = "INTERACTIVE_PROMPT";
+const char KOKO_NAME_11[] PROGMEM = "MUSIC_SNIPPET";
+const char KOKO_NAME_12[] PROGMEM = "QUICK_SPIN";
+const char KOKO_NAME_13[] PROGMEM = "SHOW_SURPRISED_EYES";
+const char KOKO_NAME_14[] PROGMEM = "RETREAT_SLOW";
+const char KOKO_NAME_15[] PROGMEM = "SOOTHING_AUDIO";
+const char KOKO_NAME_16[] PROGMEM = "PARENT_NOTIFY";
+const char* const KOKO_ACTION_NAMES[KOKO_NUM_ACTIONS] PROGMEM = {
+  KOKO_NAME_0, KOKO_NAME_1, KOKO_NAME_2, KOKO_NAME_3, KOKO_NAME_4, KOKO_NAME_5, KOKO_NAME_6, KOKO_NAME_7, KOKO_NAME_8, KOKO_NAME_9, KOKO_NAME_10, KOKO_NAME_11, KOKO_NAME_12, KOKO_NAME_13, KOKO_NAME_14, KOKO_NAME_15, KOKO_NAME_16
+};
+
+const uint32_t KOKO_BAUD_RATES[5] PROGMEM = {9600UL, 19200UL, 38400UL, 57600UL, 115200UL};
+#define KOKO_NUM_BAUD_RATES 5
+
+#endif
@@ -6,155 +6,398 @@ Fully integrated with Recommender Engine + Feedback Learning.
 - Shows eyes on 9.7" display via display_eyes.py
 - Sends robot actions
 - Learns which actions improve emotions over time
+- Recognises each child in view and learns per child
+- Shows the eyes first, then starts camera, serial and the emotion model
+  concurrently (startup.py); heavy modules are imported inside those phases
+- Runs the detector only as often as the scene needs (governor.py)
+- Scores each action on the child's emotions over the whole time it runs
+  (outcome_tracker.py), without pausing the loop to wait for the result
+- Plays the actions' music and videos from memory (media_engine.py)
 """
 
 import time
-import random
-import cv2
-from picamera2 import Picamera2
-from fer import FER
 import pygame
 
 from display_eyes import EyeDisplay
-from robot_controller import RobotController
-from recommender_engine import (
-    load_profiles,
-    save_profiles,
-    recommend_for_child,
-    apply_feedback,
-    get_assets
-)
+from emotion_state import EmotionAggregator
+from pipeline import Pipeline
+from startup import Startup
+import profiler
 
 # ---------------- Configuration ----------------
 ROBOT_SERIAL = "/dev/ttyUSB0"       # e.g., '/dev/ttyUSB0' for Arduino
 CAMERA_DEVICE = 0
+CAMERA_SOURCE = "picamera"          # or "synthetic" / a recording (.npy, video, image dir)
+LORES_SIZE = (320, 240)   # PiCamera stream that face detection searches; None = full frame
+EMOTION_BACKEND = "fer"   # "fer" (FER + MTCNN), "onnx" (YuNet + int8 FER+, much lighter) or "remote"
+INFERENCE_SERVER = "127.0.0.1:9200"   # inference_server.py address for EMOTION_BACKEND = "remote"
 LOOP_DELAY = 0.1          # seconds between detections
-AFTER_DELAY = 1.0         # seconds to keep eyes/action active
 ITERATIONS = None         # None = infinite loop
+REPORT_INTERVAL = 30.0    # seconds between pipeline stats reports
+DETECT_EVERY = 10         # full face detection every N frames; tracked in between
+EMOTION_TAU = 0.5         # seconds; smoothing time constant for emotion readings
+MIN_CONFIDENCE = 0.4      # readings below this top score are ignored
+MAX_FACES = 4             # faces tracked at once
+DEFAULT_CHILD = "child_001"   # profile for faces that match no enrolled child
+FAST_START = True         # run startup phases concurrently; False = one after another
+WARMUP_MODEL = True       # dummy inference at startup so the first real frame isn't slow
+PROFILE = True            # per-stage span timings (profiler.py); off = near-zero overhead
+METRICS_PORT = 9108       # Prometheus text at http://127.0.0.1:9108/metrics; None = off
+ADAPTIVE_RATE = True      # motion-gated, activity-paced detection (governor.py); False = every frame
+IDLE_PATROL_EVERY = 60.0  # seconds between idle patrols while nobody is in view
+MEDIA_CACHE_MB = 64       # decoded action sounds / video openings kept in memory
+
+# ---------------- Helpers ----------------
+def wait_for_result(pipeline, display, min_wait=0.0):
+    """
+    Wait until the pipeline delivers a detection result and min_wait has
+    passed. The eyes keep animating on their own render thread meanwhile.
+    Returns None if the display was closed.
+    """
+    t0 = time.monotonic()
+    result = None
+    with profiler.span("main.wait"):
+        while display.running:
+            newest = pipeline.next_result(timeout=0.05)
+            if newest is not None:
+                result = newest
+            if result is not None and time.monotonic() - t0 >= min_wait:
+                return result
+    return None
+
+
+def visible_children(faces, emotion_states, profiles):
+    """
+    One entry per child in view, largest (closest) face first:
+    {"child_id", "track_id", "emotion", "conf", "dist"}. Faces of children without a
+    profile fall back to DEFAULT_CHILD; if nobody is in view, DEFAULT_CHILD
+    is returned with a neutral, zero-confidence reading.
+    """
+    children = {}
+    tracks = emotion_states.tracks()
+    for face in sorted(faces or [], key=lambda f: f['box'][2]*f['box'][3], reverse=True):
+        if face.get('track_id') is None:
+            continue
+        child_id = face.get('child_id', DEFAULT_CHILD)
+        if child_id not in profiles:
+            child_id = DEFAULT_CHILD
+        if child_id in children:
+            continue
+        emotion, conf = emotion_states.current(face['track_id'])
+        dist = tracks.get(face['track_id'], {}).get("dist")
+        children[child_id] = {"child_id": child_id, "track_id": face['track_id'],
+                              "emotion": emotion, "conf": conf, "dist": dist}
+    if not children:
+        emotion, conf = emotion_states.current()
+        return [{"child_id": DEFAULT_CHILD, "track_id": None, "emotion": emotion, "conf": conf,
+                 "dist": None}]
+    return list(children.values())
+
+
+# ---------------- Startup Phases ----------------
+# Each runs on its own thread (see startup.py) and imports what it needs there
+
+def start_profiles():
+    """Profiles; learned-score changes are logged and snapshotted in the background."""
+    from profile_store import ProfileStore
+
+    store = ProfileStore()
+    return store, store.start()
+
+
+def start_camera():
+    """Upright RGB frames from the PiCamera (or a recording / synthetic source)."""
+    from frame_source import open_source
+
+    camera_options = {"lores_size": LORES_SIZE} if CAMERA_SOURCE == "picamera" else {}
+    camera = open_source(CAMERA_SOURCE, **camera_options)
+    camera.start()
+    return camera
+
+
+def start_robot():
+    """Serial link to the Arduino; it waits out the board reset on its own threads."""
+    from robot_controller import RobotController
+
+    return RobotController(serial_port=ROBOT_SERIAL)
+
+
+def load_detector(startup):
+    """The emotion model, optionally warmed up with a dummy frame."""
+    with startup.phase("detector.import"):
+        from emotion_detector import create_detector
+    with startup.phase("detector.load"):
+        detector_options = {"address": INFERENCE_SERVER} if EMOTION_BACKEND == "remote" else {}
+        detector = create_detector(EMOTION_BACKEND, **detector_options)
+    if WARMUP_MODEL:
+        with startup.phase("detector.warmup"):
+            detector.warm_up(lores_size=LORES_SIZE if CAMERA_SOURCE == "picamera" else None)
+    return detector
+
+
+def start_media(startup, display):
+    """Action sounds and videos, decoded into memory once the profiles are known."""
+    from media_engine import MediaEngine, profile_media
+
+    media = MediaEngine(display=display, max_bytes=MEDIA_CACHE_MB * 1024 * 1024)
+    media.preload(profile_media(startup.result("profiles")[1]))
+    return media
+
+
+def load_identifier():
+    """Face embedder and the enrolled children's reference index."""
+    from child_identity import create_identifier
+
+    return create_identifier(DEFAULT_CHILD)
+
+
+def close_started(startup):
+    """Close whatever the startup phases managed to open."""
+    camera = startup.completed("camera")
+    if camera is not None:
+        camera.stop()
+    robot = startup.completed("robot")
+    if robot is not None:
+        robot.close()
+    media = startup.completed("media")
+    if media is not None:
+        media.close()
+    profiles = startup.completed("profiles")
+    if profiles is not None:
+        profiles[0].close()
+
 
 # ---------------- Main Loop ----------------
 def main():
     print("Starting KOKO main loop... Press 'q' or ESC to quit safely.")
+    startup = Startup(concurrent=FAST_START)
+    profiler.enable(PROFILE)
+    if PROFILE or ADAPTIVE_RATE:
+        profiler.start_sampler()      # CPU temperature, also read by the governor
+    if PROFILE and METRICS_PORT:
+        profiler.serve(METRICS_PORT)
+
+    # Eyes first, so KOKO looks awake while everything else loads
+    with startup.phase("display"):
+        display = EyeDisplay(fullscreen=True)
+
+    startup.run("detector", load_detector, startup)
+    startup.run("camera", start_camera)
+    startup.run("robot", start_robot)
+    startup.run("profiles", start_profiles)
+    startup.run("media", start_media, startup, display)
+    startup.run("identifier", load_identifier)
+
+    # The eyes keep animating meanwhile; closing the window aborts startup
+    try:
+        ready = startup.wait(poll=lambda: display.running)
+    except KeyboardInterrupt:
+        ready = False
+    startup.report()
+    if not ready or startup.failed():
+        print("[MAIN] Startup did not complete; shutting down.")
+        close_started(startup)
+        display.close()
+        return
+
+    store, profiles = startup.result("profiles")
+    camera = startup.result("camera")
+    robot = startup.result("robot")
+    detector = startup.result("detector")
+    identifier = startup.result("identifier")
+    media = startup.result("media")
+    # Small modules whose heavy dependencies (numpy, cv2) the phases above
+    # already imported
+    import bandit_engine
+    from event_log import EventLog
+    from face_tracker import FaceTracker
+    from governor import InferenceGovernor
+    from outcome_tracker import OutcomeTracker
+
+    face_tracker = FaceTracker(detector, detect_every=DETECT_EVERY, max_faces=MAX_FACES)
+    emotion_states = EmotionAggregator(tau=EMOTION_TAU, min_confidence=MIN_CONFIDENCE)
+    # Per-interaction history, flushed to events/ by a background thread
+    events = EventLog().start()
+    governor = InferenceGovernor() if ADAPTIVE_RATE else None
+    # Emotion readings over each action's run, scored once it is over
+    outcomes = OutcomeTracker(min_confidence=MIN_CONFIDENCE)
 
-    # Load profiles
-    profiles = load_profiles()
-    child_id = "child_001"
-    profile = profiles[child_id]
+    def perceive(frames):
+        frame, lores = frames
+        results = face_tracker.process(frame, lores)
+        identifier.identify(frame, results)
+        emotion_states.observe(results)
+        outcomes.observe(results)
+        if governor:
+            governor.observe(results)
+        return results
 
-    # Initialize modules
-    detector = FER(mtcnn=True)
-    picam2 = Picamera2()
-    config = picam2.create_preview_configuration(
-        main={"format": "XRGB8888", "size": (640, 480)}
-    )
-    picam2.configure(config)
-    picam2.start()
-    time.sleep(2)  # warm-up
+    # Capture and inference run on their own threads; this loop is the action stage.
+    # With the governor, frames are captured only when it asks for one.
+    pipeline = Pipeline(camera.read_streams, perceive, release_fn=camera.release,
+                        on_demand=governor is not None,
+                        gate_fn=governor.admit if governor else None,
+                        pace_fn=governor.delay if governor else None)
+    pipeline.start()
 
-    robot = RobotController(serial_port=ROBOT_SERIAL)
-    display = EyeDisplay(fullscreen=True)
+    def apply_outcome(window):
+        """
+        Feedback for one closed outcome window. Learning needs confident
+        readings before and during the action; children who were in a
+        different emotion from the target had a different set of candidate
+        actions, so only those sharing it learn. Every window is logged,
+        learned from or not.
+        """
+        child = window["child"]
+        action_key = window["action"]
+        after_emotion, conf2 = window["after_emotion"], window["after_conf"]
+        confident = child["conf"] > 0 and conf2 > 0
+        learn = confident and child["emotion"] == window["emotion"]
+        outcome = bandit_engine.feedback_reward(child["emotion"], after_emotion) if confident else None
+        cut = " (preempted)" if window["preempted"] else ""
+        if learn:
+            print(f"[MAIN] After Emotion: {child['child_id']} {after_emotion} (conf {conf2:.2f}, "
+                  f"{window['samples']} readings over {action_key}{cut})")
+            # Under the store's lock, so a background snapshot never sees half of it
+            reward = store.update(child["child_id"], bandit_engine.feedback, action_key,
+                                  child["emotion"], after_emotion)
+            print(f"[MAIN] Feedback applied: {reward:+.2f} to {action_key} for {child['child_id']}")
+        elif window["target"]:
+            print(f"[MAIN] No confident face reading during {action_key}{cut}; feedback skipped")
+        profile = profiles[child["child_id"]]
+        events.record(
+            t=window["t_wall"], child=child["child_id"], track=child["track_id"], action=action_key,
+            policy=bandit_engine.policy_of(profile),
+            emotion=child["emotion"], conf=child["conf"], dist=child["dist"],
+            after_emotion=after_emotion, after_conf=conf2, after_dist=window["after_dist"],
+            reward=outcome, target=window["target"], learned=learn,
+            perceive_ms=window["perceive_ms"], decide_ms=window["decide_ms"])
 
     counter = 0
-    running = True
     paused = False
+    last_report = time.monotonic()
+    last_patrol = 0.0
 
     try:
-        while running:
+        while display.running:
             counter += 1
             if ITERATIONS and counter > ITERATIONS:
                 break
 
-            # Capture frame
-            frame = picam2.capture_array()
-            frame = cv2.rotate(frame, cv2.ROTATE_180)
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-            # Detect emotion
-            results = detector.detect_emotions(frame_rgb)
-            if results:
-                face = max(results, key=lambda x: x['box'][2]*x['box'][3])
-                emotions = face['emotions']
-                emotion = max(emotions, key=emotions.get)
-                conf = emotions[emotion]
-            else:
-                emotion, conf = "neutral", 0.0
+            if time.monotonic() - last_report >= REPORT_INTERVAL:
+                pipeline.report()
+                print(f"[MAIN] Face tracker: {face_tracker.stats()}")
+                print(f"[MAIN] Identity: {identifier.stats()}")
+                print(f"[MAIN] Events: {events.stats()}")
+                outcomes.report()
+                if governor:
+                    governor.report()
+                profiler.report()
+                display.report()
+                print(f"[MAIN] Robot: {robot.stats()}")
+                media.report()
+                last_report = time.monotonic()
 
-            print(f"[MAIN] Emotion Detected: {emotion} (conf {conf:.2f})")
+            # Smoothed emotion of every child in view, fresh from the inference stage
+            result = wait_for_result(pipeline, display, min_wait=LOOP_DELAY)
+            if result is None:
+                break
+            children = visible_children(result["faces"], emotion_states, profiles)
 
-            # Show eyes
+            # SPACE toggles pause; the display thread owns the window events
+            for key in display.poll_keys():
+                if key == pygame.K_SPACE:
+                    paused = not paused
+                    state = "⏸️ PAUSED" if paused else "▶️ RESUMED"
+                    print(f"[MAIN] {state}")
+            if paused:
+                continue
+
+            # Learn from every action whose outcome window has closed
+            with profiler.span("main.feedback"):
+                for window in outcomes.due():
+                    apply_outcome(window)
+
+            # Nobody in view: nothing to react to; patrol now and then
+            if children[0]["track_id"] is None:
+                display.show_emotion("neutral")
+                if time.monotonic() - last_patrol >= IDLE_PATROL_EVERY:
+                    robot.send_action("idle_patrol", preempt=True)
+                    media.play("idle_patrol")
+                    last_patrol = time.monotonic()
+                    print("[MAIN] Nobody in view; Action Triggered: idle_patrol")
+                continue
+
+            # The robot responds to the closest child
+            target = children[0]
+            emotion = target["emotion"]
             display.show_emotion(emotion)
 
-            # Get top recommendation(s)
-            picks = recommend_for_child(profile, emotion, top_k=1)
-            if picks:
-                action_key = picks[0]
+            # Let the current action run out unless the closest child changed
+            # or their emotion got worse; then it is interrupted for a new one.
+            # A child cheering up is the action working, not a reason to stop it
+            running = outcomes.running()
+            if (running and running["track_id"] == target["track_id"]
+                    and (running["emotion"] == emotion
+                         or bandit_engine.feedback_reward(running["emotion"], emotion) > 0)):
+                continue
+
+            for child in children:
+                print(f"[MAIN] Emotion Detected: {child['child_id']} {child['emotion']} "
+                      f"(conf {child['conf']:.2f})")
+
+            # Top recommendation for every child in view, scored in one batch
+            t_action = time.monotonic()
+            t_wall = time.time()
+            with profiler.span("main.recommend"):
+                picks = bandit_engine.recommend_batch([profiles[c["child_id"]] for c in children],
+                                                      [c["emotion"] for c in children], top_k=1)
+            if picks[0]:
+                action_key = picks[0][0]
             else:
                 action_key = "idle_patrol"
 
-            # Trigger robot action
-            robot.send_action(action_key)
-            print(f"[MAIN] Action Triggered: {action_key}")
-
-            # Keep display active while action runs
-            t0 = time.time()
-            while time.time() - t0 < AFTER_DELAY:
-                display.update(fps=30)
-                if not display.running:
-                    running = False
-                    break
-
-            # Re-evaluate emotion after action for feedback
-            frame2 = picam2.capture_array()
-            frame2_rgb = cv2.cvtColor(frame2, cv2.COLOR_BGR2RGB)
-            results2 = detector.detect_emotions(frame2_rgb)
-            if results2:
-                face2 = max(results2, key=lambda x: x['box'][2]*x['box'][3])
-                emotions2 = face2['emotions']
-                after_emotion = max(emotions2, key=emotions2.get)
-                conf2 = emotions2[after_emotion]
-            else:
-                after_emotion, conf2 = "neutral", 0.0
-
-            print(f"[MAIN] After Emotion: {after_emotion} (conf {conf2:.2f})")
-
-            # Apply feedback to improve recommendations
-            delta = apply_feedback(profile, action_key, emotion, after_emotion)
-            print(f"[MAIN] Feedback applied: {delta:+.2f} to {action_key}")
-
-            # Persist profiles
-            save_profiles(profiles)
-
-            # Wait for next iteration
-            t1 = time.time()
-            while time.time() - t1 < LOOP_DELAY:
-                display.update(fps=30)
-                if not display.running:
-                    running = False
-                    break
-
-
-            # Handle quit events
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_q or event.key == pygame.K_ESCAPE:
-                        running = False
-                elif event.key == pygame.K_SPACE:
-                    paused = not paused
-                    state = "⏸️ PAUSED" if paused else "▶️ RESUMED"
-                print(f"[MAIN] {state}")
+            # Trigger robot action (the controller's threads do the serial I/O);
+            # it interrupts whatever motion is still running from the last one
+            # Its sound or video starts too, from memory; both return at once
+            with profiler.span("main.send"):
+                robot.send_action(action_key, preempt=True)
+                played = media.play(action_key, profiles[target["child_id"]])
+            decide_time = time.monotonic() - t_action
+            pipeline.record_action(decide_time)
+            duration = media.length(played) or outcomes.duration(action_key)
+            print(f"[MAIN] Action Triggered: {action_key} ({duration:.0f}s{', ' if played else ''}"
+                  f"{', '.join(played)})")
 
+            # Readings from here on are collected by perceive; the windows are
+            # scored in a later iteration, once the action is over
+            outcomes.open(action_key, children, t=t_action, duration=duration,
+                          t_wall=t_wall, emotion=emotion,
+                          perceive_ms=(result["t_done"] - result["t_capture"]) * 1000,
+                          decide_ms=decide_time * 1000)
 
     except KeyboardInterrupt:
         print("Interrupted by user.")
 
     finally:
         print("Cleaning up...")
-        picam2.stop()
-        display.close()
+        pipeline.stop()
+        # Windows still open are scored on what they collected so far
+        for window in outcomes.close_all():
+            apply_outcome(window)
+        outcomes.report()
+        pipeline.report()
+        if governor:
+            governor.report()
+        camera.stop()
         robot.close()
-        save_profiles(profiles)
+        media.close()
+        media.report()
+        store.close()
+        events.close()
+        display.close()
+        profiler.report()
+        profiler.stop()
         print("Shutdown complete.")
 
 
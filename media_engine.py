@@ -0,0 +1,430 @@
+"""
+media_engine.py
+Plays the sound and video assets of KOKO's actions (ASSETS in recommender_engine.py).
+- Assets live in media/. preload() decodes them into memory at startup:
+  audio as pygame.mixer Sounds, and the first PRELOAD_FRAMES of each
+  video as surfaces the size of VIDEO_SIZE
+- A bounded LRU cache (MediaCache, by decoded bytes) holds them; the least
+  recently played asset is evicted first. An asset that is not cached is
+  decoded on a loader thread and starts when it is ready
+- play() never blocks: sound goes to a reserved pygame.mixer channel, and
+  video frames are handed to the EyeDisplay render thread, which shows
+  them instead of the eyes. Preloaded frames play at once while a decoder
+  thread reads the rest of the file; an audio file with the same stem
+  (comfort_clip.ogg for comfort_clip.mp4) plays along with it
+- Music and video actions play the child's fav_music / fav_videos, in
+  turn, when the profile likes music / videos
+- A new action stops whatever is still playing, like the robot's motions
+- Reports start latency (play() -> sound playing / first video frame on
+  screen), cache hits, misses and evictions
+"""
+
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import pygame
+
+import profiler
+from pipeline import StageStats
+from recommender_engine import ASSETS, PREF_TAGS, get_assets
+
+MEDIA_DIR = Path(__file__).with_name("media")
+AUDIO_EXTENSIONS = (".mp3", ".ogg", ".wav")
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".mov")
+CACHE_BYTES = 64 * 1024 * 1024   # decoded media kept in memory
+VIDEO_SIZE = (512, 384)          # decoded frame size; scaled to the screen when drawn
+PRELOAD_FRAMES = 12              # video frames decoded ahead at startup
+STREAM_BUFFER = 8                # decoded frames queued ahead of the screen
+MIXER_BUFFER = 512               # samples per audio callback; smaller starts sooner
+FAVOURITES = {"music": "fav_music", "videos": "fav_videos"}
+
+
+def media_kind(name):
+    """'audio', 'video' or None (motion patterns and other non-file assets)."""
+    suffix = Path(name).suffix.lower()
+    if suffix in AUDIO_EXTENSIONS:
+        return "audio"
+    if suffix in VIDEO_EXTENSIONS:
+        return "video"
+    return None
+
+
+def profile_media(profiles):
+    """Every media file the action table and the profiles' favourites refer to."""
+    names = [n for assets in ASSETS.values() for n in assets if media_kind(n)]
+    for profile in profiles.values():
+        for key in FAVOURITES.values():
+            names.extend(profile.get(key, []))
+    return list(dict.fromkeys(names))
+
+
+class MediaCache:
+    """Bounded LRU cache of decoded media, sized by bytes."""
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()   # name -> (media, nbytes)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        with self.lock:
+            item = self.items.get(name)
+            if item is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(name)
+            self.hits += 1
+            return item[0]
+
+    def peek(self, name):
+        """Cached media without counting a hit or miss or touching the LRU order."""
+        with self.lock:
+            item = self.items.get(name)
+            return item[0] if item is not None else None
+
+    def put(self, name, media, nbytes):
+        """Store media; False if it alone is larger than the cache."""
+        if nbytes > self.max_bytes:
+            return False
+        with self.lock:
+            old = self.items.pop(name, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.items[name] = (media, nbytes)
+            self.bytes += nbytes
+            while self.bytes > self.max_bytes:
+                _, (_, freed) = self.items.popitem(last=False)
+                self.bytes -= freed
+                self.evictions += 1
+        return True
+
+
+class VideoStream:
+    """
+    One playing video: preloaded head frames first, then frames from a
+    decoder thread. frame() is called by the render thread each frame.
+    """
+
+    END = object()
+
+    def __init__(self, path, head, fps, size=VIDEO_SIZE, t_request=None, on_start=None):
+        self.path = path
+        self.head = head
+        self.fps = fps
+        self.size = size
+        self.t_request = time.monotonic() if t_request is None else t_request
+        self.on_start = on_start
+        self.t0 = None
+        self.shown = False
+        self.index = 0             # next frame to show
+        self.dropped = 0
+        self.done = False
+        self.frames = queue.Queue(maxsize=STREAM_BUFFER)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._decode, name="media-video", daemon=True)
+        self.thread.start()
+
+    def _decode(self):
+        cap = cv2.VideoCapture(str(self.path))
+        try:
+            if self.head:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, len(self.head))
+            while not self.stopped.is_set():
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                self._put(frame_surface(frame, self.size))
+        finally:
+            cap.release()
+            self._put(self.END)
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _next(self):
+        if self.index < len(self.head):
+            return self.head[self.index]
+        try:
+            return self.frames.get_nowait()
+        except queue.Empty:
+            return None
+
+    def frame(self, now):
+        """The frame due at monotonic time now, or None if the screen needn't change."""
+        if self.t0 is None:
+            self.t0 = now
+        due = int((now - self.t0) * self.fps)
+        surface = None
+        while self.index <= due:
+            nxt = self._next()
+            if nxt is None:
+                break              # decoder is behind; keep the last frame up
+            if nxt is self.END:
+                self.done = True
+                break
+            if surface is not None:
+                self.dropped += 1
+            surface = nxt
+            self.index += 1
+        if surface is not None and not self.shown:
+            self.shown = True
+            if self.on_start:
+                self.on_start(now - self.t_request)
+        return surface
+
+    def stop(self):
+        self.stopped.set()
+        self.done = True
+
+
+def frame_surface(frame, size):
+    """BGR frame from OpenCV -> pygame surface of the given size."""
+    rgb = cv2.cvtColor(cv2.resize(frame, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2RGB)
+    return pygame.image.frombuffer(rgb.tobytes(), size, "RGB")
+
+
+class MediaEngine:
+    def __init__(self, display=None, media_dir=MEDIA_DIR, max_bytes=CACHE_BYTES,
+                 video_size=VIDEO_SIZE, preload_frames=PRELOAD_FRAMES):
+        self.display = display
+        self.media_dir = Path(media_dir)
+        self.cache = MediaCache(max_bytes)
+        self.video_size = video_size
+        self.preload_frames = preload_frames
+        self.loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="media-load")
+        self.lock = threading.Lock()
+        self.missing = set()
+        self.turns = {}            # action key -> favourites played so far
+        self.generation = 0        # bumped by every play()/stop(); stale loads don't start
+        self.video = None
+        self.counts = {"plays": 0, "late": 0, "failed": 0}
+        self.start = StageStats("media.start")
+        self.channel = self._init_mixer()
+
+    def _init_mixer(self):
+        """Reserved mixer channel for action audio; None without an audio device."""
+        try:
+            if not pygame.mixer.get_init():
+                pygame.mixer.init(buffer=MIXER_BUFFER)
+            pygame.mixer.set_reserved(1)
+            return pygame.mixer.Channel(0)
+        except pygame.error as e:
+            print(f"[MEDIA] No audio output ({e}); sounds are skipped")
+            return None
+
+    # ---------------- Decoding ----------------
+
+    def path(self, name):
+        return self.media_dir / name
+
+    def _load(self, name):
+        """Decode one asset into the cache; returns it, or None if unavailable."""
+        media = self.cache.peek(name)
+        if media is not None:
+            return media
+        path = self.path(name)
+        if not path.exists():
+            # preload() on the main thread and the loader thread both get here
+            with self.lock:
+                new = name not in self.missing
+                self.missing.add(name)
+            if new:
+                print(f"[MEDIA] Missing asset: {path}")
+            return None
+        kind = media_kind(name)
+        try:
+            if kind == "audio":
+                if self.channel is None:
+                    return None
+                media, nbytes = self._decode_audio(path)
+            else:
+                media, nbytes = self._decode_video(path)
+        except (pygame.error, cv2.error, ValueError) as e:
+            with self.lock:
+                self.counts["failed"] += 1
+            print(f"[MEDIA] Could not decode {path.name}: {e}")
+            return None
+        if not self.cache.put(name, media, nbytes):
+            print(f"[MEDIA] {name} ({nbytes / 1e6:.1f} MB) is larger than the cache; not kept")
+        return media
+
+    def _decode_audio(self, path):
+        sound = pygame.mixer.Sound(str(path))
+        freq, fmt, channels = pygame.mixer.get_init()
+        return sound, int(sound.get_length() * freq) * channels * (abs(fmt) // 8)
+
+    def _decode_video(self, path):
+        """Head frames, frame rate and the audio file that goes with the video."""
+        cap = cv2.VideoCapture(str(path))
+        if not cap.isOpened():
+            raise ValueError("cannot open the file")
+        try:
+            fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+            frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+            head = []
+            while len(head) < self.preload_frames:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                head.append(frame_surface(frame, self.video_size))
+        finally:
+            cap.release()
+        audio = next((path.with_suffix(ext).name for ext in AUDIO_EXTENSIONS
+                      if path.with_suffix(ext).exists()), None)
+        if audio:
+            self._load(audio)
+        video = {"head": head, "fps": fps, "audio": audio,
+                 "length": frames / fps if frames > 0 else None}
+        w, h = self.video_size
+        return video, len(head) * w * h * 3
+
+    def preload(self, names):
+        """Decode the given assets into the cache now; returns how many are cached."""
+        t0 = time.perf_counter()
+        names = [name for name in names if media_kind(name)]
+        for name in names:
+            self._load(name)
+        loaded = sum(self.cache.peek(name) is not None for name in names)
+        print(f"[MEDIA] Preloaded {loaded} assets ({self.cache.bytes / 1e6:.1f} MB) "
+              f"in {time.perf_counter() - t0:.2f}s")
+        return loaded
+
+    # ---------------- Playback ----------------
+
+    def available(self, name):
+        return self.cache.peek(name) is not None or self.path(name).exists()
+
+    def media_for(self, action_key, profile=None):
+        """
+        Media file names an action plays for this child (empty for motions);
+        each call moves on to the child's next favourite.
+        """
+        names = [n for n in get_assets(action_key) if media_kind(n)]
+        if not names or profile is None:
+            return names
+        prefs = profile.get("prefs", {})
+        for kind, key in FAVOURITES.items():
+            favourites = [n for n in profile.get(key) or [] if self.available(n)]
+            if favourites and prefs.get(kind) and any(tag in action_key for tag in PREF_TAGS[kind]):
+                turn = self.turns.get(action_key, 0)
+                self.turns[action_key] = turn + 1
+                return [favourites[turn % len(favourites)]]
+        return names
+
+    def length(self, names):
+        """Seconds the longest of these cached assets plays; None if unknown."""
+        lengths = []
+        for name in names:
+            media = self.cache.peek(name)
+            if isinstance(media, pygame.mixer.Sound):
+                lengths.append(media.get_length())
+            elif isinstance(media, dict) and media["length"]:
+                lengths.append(media["length"])
+        return max(lengths, default=None)
+
+    def play(self, action_key, profile=None):
+        """
+        Start the action's media and return at once; whatever was playing
+        stops. Returns the names started (or being loaded).
+        """
+        t_request = time.monotonic()
+        self.stop()
+        names = self.media_for(action_key, profile)
+        with self.lock:
+            generation = self.generation
+        for name in names:
+            media = self.cache.get(name)
+            if media is not None:
+                self._start(name, media, t_request, generation)
+            else:
+                self.loader.submit(self._load_and_start, name, t_request, generation)
+        return names
+
+    def _load_and_start(self, name, t_request, generation):
+        media = self._load(name)
+        if media is not None:
+            with self.lock:
+                self.counts["late"] += 1
+            self._start(name, media, t_request, generation)
+
+    def _start(self, name, media, t_request, generation):
+        with self.lock:
+            if generation != self.generation:
+                return             # another action started meanwhile
+            if isinstance(media, pygame.mixer.Sound):
+                if self.channel is not None:
+                    self.channel.play(media)
+                    self.counts["plays"] += 1
+                    self._started(time.monotonic() - t_request)
+                return
+            if self.display is None:
+                return
+            self.counts["plays"] += 1
+            self.video = VideoStream(self.path(name), media["head"], media["fps"],
+                                     self.video_size, t_request, on_start=self._started)
+            self.display.play_video(self.video)
+            # Still under the lock, so a stop() in between can't leave the audio playing
+            if media["audio"] and self.channel is not None:
+                audio = self.cache.peek(media["audio"])
+                if audio is not None:
+                    self.channel.play(audio)
+
+    def _started(self, latency):
+        self.start.record(latency)
+        profiler.record("media.start", latency)
+
+    def stop(self):
+        """Stop the sound and video that are playing, including ones still loading."""
+        with self.lock:
+            self.generation += 1
+            video, self.video = self.video, None
+        if self.channel is not None:
+            self.channel.stop()
+        if video is not None:
+            video.stop()
+            if self.display is not None:
+                self.display.stop_video(video)
+
+    def playing(self):
+        video = self.video
+        return bool((self.channel is not None and self.channel.get_busy())
+                    or (video is not None and not video.done))
+
+    def close(self):
+        self.stop()
+        self.loader.shutdown(wait=False, cancel_futures=True)
+
+    # ---------------- Metrics ----------------
+
+    def stats(self):
+        s = self.start.summary()
+        video = self.video
+        with self.lock:
+            counts, missing = dict(self.counts), len(self.missing)
+        return {**counts, "cached": len(self.cache.items), "cache_mb": self.cache.bytes / 1e6,
+                "hits": self.cache.hits, "misses": self.cache.misses,
+                "evictions": self.cache.evictions, "missing": missing,
+                "start_p50_ms": s["p50_ms"], "start_max_ms": s["max_ms"],
+                "video_dropped": video.dropped if video else 0}
+
+    def report(self):
+        s = self.stats()
+        print(f"[MEDIA] {s['plays']} plays ({s['late']} decoded on demand), start p50 "
+              f"{s['start_p50_ms']:.1f} ms (max {s['start_max_ms']:.1f} ms); cache {s['cached']} assets, "
+              f"{s['cache_mb']:.1f} MB, {s['hits']} hits / {s['misses']} misses, "
+              f"{s['evictions']} evicted, {s['missing']} missing")
+        return s
@@ -0,0 +1,181 @@
+"""
+outcome_tracker.py
+Action outcome windows for KOKO's feedback learning.
+- Each action opens one window per child in view. The child's emotion
+  readings from the perception stream are collected over that window, so
+  the reward no longer comes from a single snapshot taken 1 s after the
+  action was sent
+- A window starts SETTLE seconds after the action, giving the child time
+  to react, and ends LINGER seconds after the action's declared duration
+  (serial_protocol.action_duration: the routine's steps for motions,
+  ACTION_DURATIONS for media). A 6 s dance or a 30 s
+  video is scored on how the child felt while it ran
+- The after-emotion is the average of the later half of the window's
+  readings (by time, at least MIN_SAMPLES of them): a child who was sad
+  when the action started and cheered up during it is scored on how they
+  ended up, not on the readings from before they reacted
+- Windows overlap freely. A child can have several open at once, and a
+  late reading counts towards every window it falls in. An action cut
+  short by a new one keeps collecting for LINGER seconds after it was
+  preempted, so the reaction that prompted the new action still counts
+- observe() is called by the inference stage and due() by the main loop;
+  neither waits on the other
+- Only confident readings (top score >= min_confidence) are counted. A
+  window that collected fewer than MIN_SAMPLES gives no after-emotion
+"""
+
+import threading
+import time
+
+from serial_protocol import action_duration
+
+SETTLE = 0.5          # seconds after the action starts before readings count
+LINGER = 1.0          # seconds after the action ends that still count
+MIN_SAMPLES = 2       # confident readings needed for an after-emotion
+
+
+class OutcomeTracker:
+    """
+    Open outcome windows keyed by track id. Fed from the inference stage
+    with observe(), drained by the action stage with due().
+    """
+
+    def __init__(self, settle=SETTLE, linger=LINGER, min_samples=MIN_SAMPLES,
+                 min_confidence=0.4, durations=None):
+        self.settle = settle
+        self.linger = linger
+        self.min_samples = min_samples
+        self.min_confidence = min_confidence
+        self.durations = durations or {}
+        self.windows = []          # open windows, oldest first
+        self.action = None         # the action running now: {"action", "track_id", "emotion", "t_end"}
+        self.lock = threading.Lock()
+        self.counts = {"opened": 0, "closed": 0, "scored": 0, "preempted": 0, "readings": 0}
+
+    def duration(self, action_key):
+        return self.durations.get(action_key, action_duration(action_key))
+
+    # ---------------- Action stage ----------------
+
+    def open(self, action_key, children, t=None, duration=None, **info):
+        """
+        Start windows for an action sent at monotonic time t, one per child
+        dict in `children` (children without a track_id are skipped).
+        duration overrides the declared one (e.g. the length of the clip played).
+        Extra keyword arguments are kept on every window (e.g. wall time,
+        latencies) for whoever consumes due().
+        """
+        t = time.monotonic() if t is None else t
+        t_end = t + (duration or self.duration(action_key))
+        with self.lock:
+            self._preempt(t)
+            target = children[0] if children else {}
+            self.action = {"action": action_key, "track_id": target.get("track_id"),
+                           "emotion": target.get("emotion"), "t_start": t, "t_end": t_end}
+            for child in children:
+                if child.get("track_id") is None:
+                    continue
+                self.windows.append({
+                    **info, "action": action_key, "child": child, "target": child is target,
+                    "t_start": t, "t_end": t_end,
+                    "t_from": t + self.settle, "t_to": t_end + self.linger,
+                    "readings": [], "samples": 0, "preempted": False})
+                self.counts["opened"] += 1
+
+    def _preempt(self, t):
+        """Mark windows whose action is still running at t as preempted; they collect until t + linger."""
+        if self.action is None or self.action["t_end"] <= t:
+            return
+        self.counts["preempted"] += 1
+        for window in self.windows:
+            if window["t_end"] > t:
+                window["t_end"] = t
+                window["t_to"] = min(window["t_to"], t + self.linger)
+                window["preempted"] = True
+
+    def running(self, t=None):
+        """The action still running at t, or None."""
+        t = time.monotonic() if t is None else t
+        with self.lock:
+            if self.action is not None and self.action["t_end"] > t:
+                return dict(self.action)
+            return None
+
+    def due(self, t=None):
+        """
+        Remove and return the windows that closed by t, each with
+        after_emotion / after_conf / after_dist: the dominant emotion of the
+        later half of the readings averaged, its mean score and the averaged
+        vector ("", 0.0, None with fewer than min_samples readings).
+        """
+        t = time.monotonic() if t is None else t
+        with self.lock:
+            closed = [w for w in self.windows if w["t_to"] <= t]
+            if closed:
+                self.windows = [w for w in self.windows if w["t_to"] > t]
+        for window in closed:
+            self._finish(window)
+        return closed
+
+    def close_all(self):
+        """Close every open window now (shutdown); returns them like due()."""
+        with self.lock:
+            closed, self.windows = self.windows, []
+            self.action = None
+        for window in closed:
+            self._finish(window)
+        return closed
+
+    def _finish(self, window):
+        self.counts["closed"] += 1
+        readings = sorted(window.pop("readings"), key=lambda r: r[0])
+        if len(readings) < self.min_samples:
+            window.update(after_emotion="", after_conf=0.0, after_dist=None)
+            return
+        # The settled response: readings from the middle of the window on
+        middle = (readings[0][0] + readings[-1][0]) / 2
+        settled = [r for r in readings if r[0] >= middle]
+        if len(settled) < self.min_samples:
+            settled = readings[-self.min_samples:]
+        sums = {}
+        for _, emotions in settled:
+            for key, value in emotions.items():
+                sums[key] = sums.get(key, 0.0) + value
+        dist = {k: v / len(settled) for k, v in sums.items()}
+        emotion = max(dist, key=dist.get)
+        window.update(after_emotion=emotion, after_conf=dist[emotion], after_dist=dist)
+        self.counts["scored"] += 1
+
+    # ---------------- Inference stage ----------------
+
+    def observe(self, results, t=None):
+        """Add FER-style results carrying 'track_id' to every window they fall in."""
+        t = time.monotonic() if t is None else t
+        with self.lock:
+            if not self.windows:
+                return
+            for face in results or []:
+                track_id = face.get("track_id")
+                emotions = face.get("emotions")
+                if track_id is None or not emotions or max(emotions.values()) < self.min_confidence:
+                    continue
+                for window in self.windows:
+                    if (window["child"]["track_id"] != track_id
+                            or not window["t_from"] <= t <= window["t_to"]):
+                        continue
+                    window["readings"].append((t, emotions))
+                    window["samples"] += 1
+                    self.counts["readings"] += 1
+
+    # ---------------- Metrics ----------------
+
+    def stats(self):
+        with self.lock:
+            return {**self.counts, "open": len(self.windows)}
+
+    def report(self):
+        s = self.stats()
+        print(f"[OUTCOME] {s['opened']} windows opened, {s['closed']} closed "
+              f"({s['scored']} scored), {s['open']} open, {s['preempted']} actions preempted, "
+              f"{s['readings']} readings")
+        return s
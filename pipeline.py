@@ -0,0 +1,246 @@
+"""
+pipeline.py
+Staged capture -> inference -> action pipeline for KOKO.
+- Capture thread grabs camera frames continuously
+- Inference worker always processes the newest frame; stale frames are dropped
+- Action/feedback stage (main thread) consumes the newest detection result
+- Stages are joined by bounded queues and keep latency/throughput counters
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+
+
+class StageStats:
+    """Rolling latency and throughput counters for one pipeline stage."""
+
+    def __init__(self, name, window=100):
+        self.name = name
+        self.count = 0
+        self.dropped = 0
+        self.latencies = deque(maxlen=window)
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def record(self, latency):
+        with self.lock:
+            self.count += 1
+            self.latencies.append(latency)
+
+    def drop(self, n=1):
+        with self.lock:
+            self.dropped += n
+
+    def summary(self):
+        with self.lock:
+            latencies = list(self.latencies)
+            count, dropped = self.count, self.dropped
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        avg = sum(latencies) / len(latencies) if latencies else 0.0
+        latencies.sort()
+        return {
+            "stage": self.name,
+            "count": count,
+            "dropped": dropped,
+            "rate": count / elapsed,
+            "avg_ms": avg * 1000,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "max_ms": max(latencies, default=0.0) * 1000,
+        }
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list; 0.0 if it is empty."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, -(-pct * len(sorted_values) // 100) - 1)
+    return sorted_values[int(rank)]
+
+
+def put_latest(q, item, stats=None, on_drop=None):
+    """Put item on a bounded queue, discarding the oldest entries if it is full."""
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                dropped = q.get_nowait()
+                if stats:
+                    stats.drop()
+                if on_drop:
+                    on_drop(dropped)
+            except queue.Empty:
+                pass
+
+
+class Pipeline:
+    """
+    Runs capture and inference on background threads.
+
+    capture_fn() -> frame          called in a loop by the capture thread
+    infer_fn(frame) -> results     called by the inference worker on the newest frame
+
+    Results are dicts: {"seq", "t_capture", "t_done", "faces"} where "faces"
+    is whatever infer_fn returned (FER-style list of {'box', 'emotions'}).
+
+    on_demand=True captures a frame only after the worker has taken the
+    previous one, for sources that never block (recordings read at max speed).
+    release_fn(frame) is called once a frame has been inferred or dropped,
+    so pooled capture buffers can be reused.
+    gate_fn(frame) -> bool         False skips inference for that frame (counted as gated)
+    pace_fn() -> seconds           the worker waits this long before taking the next
+                                   frame; with on_demand, nothing is captured meanwhile
+    """
+
+    def __init__(self, capture_fn, infer_fn, queue_size=1, window=100, on_demand=False,
+                 release_fn=None, gate_fn=None, pace_fn=None):
+        self.capture_fn = capture_fn
+        self.infer_fn = infer_fn
+        self.on_demand = on_demand
+        self.release_fn = release_fn
+        self.gate_fn = gate_fn
+        self.pace_fn = pace_fn
+        self.paced = False
+        self.gated = 0
+        self._wanted = threading.Event()
+        self._wanted.set()
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.results = queue.Queue(maxsize=queue_size)
+        self.stats = {
+            "capture": StageStats("capture", window),
+            "inference": StageStats("inference", window),
+            "action": StageStats("action", window),
+            "end_to_end": StageStats("end_to_end", window),
+        }
+        self.running = False
+        self._threads = []
+
+    def start(self):
+        self.running = True
+        for target in (self._capture_loop, self._inference_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print("[PIPELINE] Capture and inference stages started.")
+
+    def stop(self):
+        self.running = False
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+        self._threads = []
+        print("[PIPELINE] Stopped.")
+
+    def _capture_loop(self):
+        seq = 0
+        stats = self.stats["capture"]
+        while self.running:
+            if self.on_demand:
+                if not self._wanted.wait(timeout=0.1):
+                    continue
+                self._wanted.clear()
+            t0 = time.monotonic()
+            try:
+                frame = self.capture_fn()
+            except Exception as e:
+                print(f"[PIPELINE] Capture failed: {e}")
+                time.sleep(0.1)
+                continue
+            t1 = time.monotonic()
+            stats.record(t1 - t0)
+            seq += 1
+            put_latest(self.frames, (seq, t1, frame), stats, self._release_item)
+
+    def _inference_loop(self):
+        stats = self.stats["inference"]
+        while self.running:
+            try:
+                seq, t_capture, frame = self.frames.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            # Ask for the next frame now, unless a pause will follow this one
+            requested = not self.paced
+            if requested:
+                self._wanted.set()
+            self._infer(seq, t_capture, frame, stats)
+            if self.pace_fn:
+                delay = self.pace_fn()
+                self.paced = delay > 0
+                if self.paced:
+                    self._pause(delay)
+                if self.paced or not requested:
+                    self._wanted.set()
+
+    def _infer(self, seq, t_capture, frame, stats):
+        try:
+            if self.gate_fn and not self.gate_fn(frame):
+                self.gated += 1
+                return
+            t0 = time.monotonic()
+            faces = self.infer_fn(frame)
+        except Exception as e:
+            print(f"[PIPELINE] Inference failed: {e}")
+            return
+        finally:
+            if self.release_fn:
+                self.release_fn(frame)
+        t1 = time.monotonic()
+        stats.record(t1 - t0)
+        result = {"seq": seq, "t_capture": t_capture, "t_done": t1, "faces": faces}
+        put_latest(self.results, result, stats)
+
+    def _pause(self, delay):
+        """Sleep between paced frames, then drop frames captured before the pause ended."""
+        end = time.monotonic() + delay
+        while self.running and time.monotonic() < end:
+            time.sleep(min(0.05, end - time.monotonic()))
+        while True:
+            try:
+                self._release_item(self.frames.get_nowait())
+            except queue.Empty:
+                return
+
+    def _release_item(self, item):
+        if self.release_fn:
+            self.release_fn(item[2])
+
+    def next_result(self, timeout=None, after=None):
+        """
+        Return the newest detection result, or None if none arrives within timeout.
+        If `after` is given, results from frames captured before it are skipped.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            try:
+                if remaining is None or remaining > 0:
+                    result = self.results.get(timeout=remaining)
+                else:
+                    result = self.results.get_nowait()
+            except queue.Empty:
+                return None
+            if after is None or result["t_capture"] >= after:
+                self.stats["end_to_end"].record(time.monotonic() - result["t_capture"])
+                return result
+
+    def record_action(self, latency):
+        self.stats["action"].record(latency)
+
+    def report(self):
+        """Print per-stage counters and name the stage limiting detections/sec."""
+        summaries = [s.summary() for s in self.stats.values()]
+        for s in summaries:
+            print(f"[PIPELINE] {s['stage']:<10} n={s['count']:<6} dropped={s['dropped']:<5} "
+                  f"{s['rate']:6.2f}/s  avg {s['avg_ms']:7.1f} ms  p95 {s['p95_ms']:7.1f} ms  "
+                  f"max {s['max_ms']:7.1f} ms")
+        if self.gate_fn:
+            print(f"[PIPELINE] gated      {self.gated} frames skipped inference")
+        busy = [s for s in summaries if s["stage"] in ("capture", "inference") and s["count"]]
+        if busy:
+            slowest = max(busy, key=lambda s: s["avg_ms"])
+            print(f"[PIPELINE] Bottleneck: {slowest['stage']}")
+        return summaries
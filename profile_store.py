@@ -0,0 +1,174 @@
+"""
+profile_store.py
+Batched, crash-safe persistence for KOKO child profiles.
+- Every learned-score change is appended as one compact line to a log file
+- A background thread folds the log into an atomic profiles.json snapshot
+  on a timer or once the log grows past a size threshold
+- On startup the snapshot is loaded and any logged changes are replayed
+- Profiles are only changed under the store's lock (record / update), so
+  a snapshot never sees a half-applied change
+- The log is only dropped once the snapshot covering it is written; a
+  failed snapshot leaves it in profiles.json.log.old for the next one
+
+Log lines record the new value (not the increment), e.g.
+    ["child_001","rec_scores","dance_move",1.5]
+so replaying a line twice is harmless.
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from recommender_engine import PROFILE_PATH, load_profiles, save_profiles
+
+
+class ProfileStore:
+    def __init__(self, path=PROFILE_PATH, flush_interval=60.0, max_log_bytes=64 * 1024,
+                 sync_interval=1.0):
+        self.path = Path(path)
+        self.log_path = self.path.with_name(self.path.name + ".log")
+        self.old_log_path = self.path.with_name(self.path.name + ".log.old")
+        self.flush_interval = flush_interval
+        self.max_log_bytes = max_log_bytes
+        self.sync_interval = sync_interval
+        self.profiles = None
+        self.lock = threading.Lock()
+        self._log = None
+        self._log_bytes = 0
+        self._dirty = False
+        self._running = False
+        self._thread = None
+
+    # ---------------- Loading ----------------
+
+    def load(self):
+        """Load the snapshot, replay logged changes and open the log for appending."""
+        self.profiles = load_profiles(self.path)
+        replayed = 0
+        for log_path in (self.old_log_path, self.log_path):
+            replayed += self._replay(log_path)
+        if replayed:
+            print(f"[STORE] Replayed {replayed} logged profile changes.")
+        self._log = open(self.log_path, "a")
+        self._log_bytes = self.log_path.stat().st_size
+        self._dirty = replayed > 0
+        return self.profiles
+
+    def _replay(self, log_path):
+        if not log_path.exists():
+            return 0
+        count = 0
+        with open(log_path) as f:
+            for line in f:
+                try:
+                    child_id, field, key, value = json.loads(line)
+                except ValueError:
+                    # Torn last line from a crash mid-append; nothing after it was written
+                    break
+                self._apply(child_id, field, key, value)
+                count += 1
+        return count
+
+    def _apply(self, child_id, field, key, value):
+        profile = self.profiles.setdefault(child_id, {})
+        profile.setdefault(field, {})[key] = value
+
+    # ---------------- Recording ----------------
+
+    def record(self, child_id, field, key, value):
+        """Set profiles[child_id][field][key] = value and append it to the log."""
+        with self.lock:
+            self._record(child_id, field, key, value)
+
+    def update(self, child_id, fn, *args):
+        """
+        Run fn(profile, *args) -> (result, records) under the store's lock,
+        log the (field, key, value) records it returns and return result.
+        For learners that change the profile in place (bandit_engine.feedback).
+        """
+        with self.lock:
+            result, records = fn(self.profiles[child_id], *args)
+            for field, key, value in records:
+                self._record(child_id, field, key, value)
+        return result
+
+    def _record(self, child_id, field, key, value):
+        line = json.dumps([child_id, field, key, value], separators=(",", ":")) + "\n"
+        self._apply(child_id, field, key, value)
+        self._log.write(line)
+        self._log.flush()
+        self._log_bytes += len(line)
+        self._dirty = True
+
+    # ---------------- Snapshots ----------------
+
+    def compact(self):
+        """
+        Write an atomic snapshot and drop the log entries it covers. If the
+        snapshot can't be written the entries are kept for the next try.
+        """
+        with self.lock:
+            if not self._dirty:
+                return False
+            snapshot = json.loads(json.dumps(self.profiles))
+            # Rotate the log so new records keep flowing while the snapshot is written
+            self._log.close()
+            if self.old_log_path.exists():
+                # A previous snapshot failed: its records are still only in .log.old
+                with open(self.old_log_path, "a") as old:
+                    old.write(self.log_path.read_text())
+                os.remove(self.log_path)
+            else:
+                os.replace(self.log_path, self.old_log_path)
+            self._log = open(self.log_path, "a")
+            self._log_bytes = 0
+        save_profiles(snapshot, self.path)
+        with self.lock:
+            os.remove(self.old_log_path)
+            # Records logged while the snapshot was written still need one
+            self._dirty = self._log_bytes > 0
+        return True
+
+    def _sync(self):
+        with self.lock:
+            if self._log:
+                self._log.flush()
+                os.fsync(self._log.fileno())
+
+    def _run(self):
+        last_compact = time.monotonic()
+        while self._running:
+            time.sleep(self.sync_interval)
+            try:
+                self._sync()
+                if (self._log_bytes >= self.max_log_bytes
+                        or time.monotonic() - last_compact >= self.flush_interval):
+                    self.compact()
+                    last_compact = time.monotonic()
+            except Exception as e:
+                print(f"[STORE] Background flush failed: {e}")
+
+    def start(self):
+        """Start the background sync/compaction thread."""
+        if self.profiles is None:
+            self.load()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self.profiles
+
+    def close(self):
+        """Stop the background thread and write a final snapshot."""
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=self.sync_interval + 1.0)
+            self._thread = None
+        if self._log:
+            self._sync()
+            self.compact()
+            with self.lock:
+                self._log.close()
+                self._log = None
+            print("[STORE] Profiles saved.")
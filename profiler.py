@@ -0,0 +1,265 @@
+"""
+profiler.py
+Lightweight runtime profiler and metrics endpoint for KOKO.
+- span("name") times a block on the monotonic clock; spans of the same name
+  feed one rolling window with p50/p95/p99 (pipeline.StageStats)
+- Disabled (KOKO_PROFILE=0 or enable(False)), span() hands back one shared
+  no-op object, so instrumented code pays a function call and a branch
+- record(name, seconds) adds a sample measured elsewhere (e.g. serial RTT)
+- A sampler thread reads the CPU temperature, clock and the Raspberry Pi
+  throttling flags (vcgencmd get_throttled) every few seconds
+- serve(port) exposes everything as Prometheus text on
+  http://127.0.0.1:<port>/metrics
+
+Instrumented: capture and colour conversion (frame_source), detection and
+tracked classification (face_tracker), recommendation and profile saves
+(recommender_engine), serial writes and round trips (robot_controller),
+eye frames (display_eyes), and the main loop's stages.
+"""
+
+import functools
+import os
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pipeline import StageStats
+
+WINDOW = 500               # samples per span kept for percentiles
+SAMPLE_INTERVAL = 5.0      # seconds between temperature / throttle readings
+THERMAL_PATH = "/sys/class/thermal/thermal_zone0/temp"
+FREQ_PATH = "/sys/devices/system/cpu/cpu0/cpufreq/scaling_cur_freq"
+THROTTLE_BITS = {          # vcgencmd get_throttled bit -> flag name
+    0: "under_voltage",
+    1: "freq_capped",
+    2: "throttled",
+    3: "soft_temp_limit",
+    16: "under_voltage_occurred",
+    17: "freq_capped_occurred",
+    18: "throttled_occurred",
+    19: "soft_temp_limit_occurred",
+}
+
+_enabled = os.environ.get("KOKO_PROFILE", "1") != "0"
+_stats = {}
+_lock = threading.Lock()
+_system = {}       # replaced whole by each sample, so readers never see it half-filled
+_sampler = None
+_server = None
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+
+def enabled():
+    return _enabled
+
+
+def _get(name):
+    stats = _stats.get(name)
+    if stats is None:
+        with _lock:
+            stats = _stats.setdefault(name, StageStats(name, window=WINDOW))
+    return stats
+
+
+def record(name, seconds):
+    """Add one duration sample to span `name`."""
+    if _enabled:
+        _get(name).record(seconds)
+
+
+class _Span:
+    __slots__ = ("stats", "t0")
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.record(time.perf_counter() - self.t0)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name):
+    """Context manager timing its block as span `name`."""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(_get(name))
+
+
+def timed(name):
+    """Decorator form of span(); checks the enabled flag on every call."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Span(_get(name)):
+                return fn(*args, **kwargs)
+        return wrapper
+    return wrap
+
+
+def summaries():
+    with _lock:
+        stats = list(_stats.values())
+    return sorted((s.summary() for s in stats), key=lambda s: s["stage"])
+
+
+# ---------------- System ----------------
+
+def _read_number(path, scale):
+    try:
+        with open(path) as f:
+            return int(f.read().strip()) / scale
+    except (OSError, ValueError):
+        return None
+
+
+def throttle_flags():
+    """{flag: bool} from vcgencmd get_throttled, or {} off a Raspberry Pi."""
+    try:
+        out = subprocess.run(["vcgencmd", "get_throttled"], capture_output=True,
+                             text=True, timeout=2.0).stdout
+        value = int(out.strip().split("=")[1], 16)
+    except (OSError, IndexError, ValueError, subprocess.SubprocessError):
+        return {}
+    return {name: bool(value >> bit & 1) for bit, name in THROTTLE_BITS.items()}
+
+
+def sample_system():
+    """Read CPU temperature (C), clock (MHz) and throttle flags into the latest snapshot."""
+    global _system
+    snapshot = {
+        "cpu_temp_c": _read_number(THERMAL_PATH, 1000.0),
+        "cpu_freq_mhz": _read_number(FREQ_PATH, 1000.0),
+        "throttle": throttle_flags(),
+        "load1": os.getloadavg()[0] if hasattr(os, "getloadavg") else None,
+    }
+    was, now = _system.get("throttle", {}), snapshot["throttle"]
+    started = [f for f in ("under_voltage", "throttled", "soft_temp_limit") if now.get(f) and not was.get(f)]
+    if started:
+        print(f"[PROFILER] CPU {', '.join(started)} at {snapshot['cpu_temp_c']} C")
+    _system = snapshot
+    return snapshot
+
+
+def system():
+    return dict(_system)
+
+
+def start_sampler(interval=SAMPLE_INTERVAL):
+    """Sample system metrics on a daemon thread every `interval` seconds."""
+    global _sampler
+    if _sampler is not None:
+        return
+
+    def run():
+        while True:
+            try:
+                sample_system()
+            except Exception as e:
+                print(f"[PROFILER] System sample failed: {e}")
+            time.sleep(interval)
+
+    _sampler = threading.Thread(target=run, daemon=True)
+    _sampler.start()
+
+
+# ---------------- Export ----------------
+
+def prometheus_text():
+    """All spans and system metrics in the Prometheus text exposition format."""
+    lines = ["# HELP koko_span_seconds Duration of instrumented KOKO stages.",
+             "# TYPE koko_span_seconds summary"]
+    for s in summaries():
+        label = f'span="{s["stage"]}"'
+        for q, pct in (("0.5", 50), ("0.95", 95), ("0.99", 99)):
+            lines.append(f'koko_span_seconds{{{label},quantile="{q}"}} {s[f"p{pct}_ms"] / 1000:.6f}')
+        lines.append(f"koko_span_seconds_count{{{label}}} {s['count']}")
+        lines.append(f"koko_span_max_seconds{{{label}}} {s['max_ms'] / 1000:.6f}")
+    snap = system()
+    for key, metric in (("cpu_temp_c", "koko_cpu_temperature_celsius"),
+                        ("cpu_freq_mhz", "koko_cpu_frequency_mhz"),
+                        ("load1", "koko_load1")):
+        if snap.get(key) is not None:
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {snap[key]:.2f}")
+    if snap.get("throttle"):
+        lines.append("# TYPE koko_throttle gauge")
+        for flag, on in snap["throttle"].items():
+            lines.append(f'koko_throttle{{flag="{flag}"}} {int(on)}')
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=9108, host="127.0.0.1"):
+    """Serve /metrics on a daemon thread; returns the server (None if the port is taken)."""
+    global _server
+    if _server is not None:
+        return _server
+    try:
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"[PROFILER] Metrics endpoint not started: {e}")
+        return None
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    print(f"[PROFILER] Metrics at http://{host}:{_server.server_address[1]}/metrics")
+    return _server
+
+
+def stop():
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
+
+
+def report():
+    """Print per-span percentiles and the latest system readings."""
+    for s in summaries():
+        print(f"[PROFILER] {s['stage']:<20} n={s['count']:<7} p50 {s['p50_ms']:7.2f} ms  "
+              f"p95 {s['p95_ms']:7.2f} ms  p99 {s['p99_ms']:7.2f} ms  max {s['max_ms']:7.2f} ms")
+    snap = system()
+    if snap:
+        temp = f"{snap['cpu_temp_c']:.1f} C" if snap.get("cpu_temp_c") is not None else "temp n/a"
+        freq = f"{snap['cpu_freq_mhz']:.0f} MHz" if snap.get("cpu_freq_mhz") is not None else "freq n/a"
+        active = [flag for flag, on in snap.get("throttle", {}).items() if on]
+        print(f"[PROFILER] CPU {temp}, {freq}, throttle flags: {', '.join(active) or 'none'}")
@@ -4,12 +4,19 @@ Fully functional KOKO recommender engine with learning feedback.
 - Uses child profiles stored in profiles.json
 - Maps detected emotions to actions
 - Adjusts recommendation scores based on feedback (before vs after emotion)
+- Scores candidates with precompiled NumPy action tables (single or batched)
 """
 
+import copy
 import json
+import os
 from pathlib import Path
 import random
 
+import numpy as np
+
+import profiler
+
 PROFILE_PATH = Path("profiles.json")
 
 # Default child profiles
@@ -55,57 +62,175 @@ ASSETS = {
     "parent_notify": ["notify_parent"]
 }
 
+# Seconds each media/prompt action runs once started (the clips' lengths).
+# Motions take theirs from their routine's steps (serial_protocol.action_duration).
+# The feedback window of an action spans this duration (outcome_tracker.py).
+ACTION_DURATIONS = {
+    "play_cheer_music": 20.0,
+    "comfort_video": 30.0,
+    "calm_breathing": 25.0,
+    "blink_alert": 2.0,
+    "interactive_prompt": 5.0,
+    "music_snippet": 8.0,
+    "soothing_audio": 30.0,
+    "parent_notify": 2.0,
+}
+DEFAULT_DURATION = 1.0
+
 # Emotion valence for feedback learning
 VALENCE = {"happy": 2, "surprise": 1, "neutral": 0, "sad": -1, "fear": -2, "angry": -2}
 
 # ---------------- Profile Management ----------------
 
-def load_profiles():
+def load_profiles(path=PROFILE_PATH):
     """Load child profiles; create default if not present or corrupted."""
-    if PROFILE_PATH.exists():
+    path = Path(path)
+    if path.exists():
         try:
-            return json.loads(PROFILE_PATH.read_text())
+            return json.loads(path.read_text())
         except Exception:
-            print("[Recommender] Could not load profiles.json; creating default.")
-    PROFILE_PATH.write_text(json.dumps(DEFAULT_PROFILES, indent=2))
-    return DEFAULT_PROFILES.copy()
+            # Keep the damaged file for recovery instead of overwriting learned scores
+            backup = path.with_name(path.name + ".corrupt")
+            os.replace(path, backup)
+            print(f"[Recommender] Could not load {path.name}; moved to {backup.name}, creating default.")
+    profiles = copy.deepcopy(DEFAULT_PROFILES)
+    save_profiles(profiles, path)
+    return profiles
 
-def save_profiles(profiles):
-    """Persist profiles.json"""
-    PROFILE_PATH.write_text(json.dumps(profiles, indent=2))
+@profiler.timed("profiles.save")
+def save_profiles(profiles, path=PROFILE_PATH):
+    """Persist profiles.json atomically (write temp file, fsync, rename)."""
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(profiles, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
 
 # ---------------- Recommendation Engine ----------------
 
+BASE_SCORE = 1.0
+PREF_BONUS = 0.7
+PREF_KEYS = ("music", "videos", "movement")
+# Substrings in an action key that tag it as music / video / movement
+PREF_TAGS = {
+    "music": ("music", "cheer", "soothing"),
+    "videos": ("video", "comfort"),
+    "movement": ("forward", "spin", "move", "retreat"),
+}
+
+
+class CompiledRecommender:
+    """
+    Precompiled scoring tables built once from BASE_MAPPING / ASSETS.
+
+    features    (actions x prefs)  1.0 where an action carries a preference tag
+    candidates  (emotions x width) action indices in BASE_MAPPING order, -1 padded
+
+    Score of an action = BASE_SCORE + PREF_BONUS * (features @ prefs) + learned,
+    summed in that order so results match the original per-candidate loop.
+    """
+
+    def __init__(self, mapping=BASE_MAPPING, assets=ASSETS):
+        actions = []
+        for acts in mapping.values():
+            actions.extend(a for a in acts if a not in actions)
+        actions.extend(a for a in assets if a not in actions)
+        self.actions = actions
+        self.action_index = {a: i for i, a in enumerate(actions)}
+
+        self.features = np.array(
+            [[any(tag in a for tag in PREF_TAGS[k]) for k in PREF_KEYS] for a in actions],
+            dtype=np.float64)
+
+        self.emotions = list(mapping)
+        self.emotion_index = {e: i for i, e in enumerate(self.emotions)}
+        self.default_emotion = self.emotion_index["neutral"]
+        width = max(len(acts) for acts in mapping.values())
+        self.candidates = np.full((len(self.emotions), width), -1, dtype=np.intp)
+        for e, acts in enumerate(mapping.values()):
+            self.candidates[e, :len(acts)] = [self.action_index[a] for a in acts]
+
+    def pref_vector(self, profile):
+        prefs = profile["prefs"]
+        return np.array([bool(prefs.get(k)) for k in PREF_KEYS], dtype=np.float64)
+
+    def learned_vector(self, profile):
+        rec_scores = profile.get("rec_scores", {})
+        return np.fromiter((rec_scores.get(a, 0.0) for a in self.actions),
+                           dtype=np.float64, count=len(self.actions))
+
+    def _emotion_rows(self, emotions):
+        return np.array([self.emotion_index.get(e, self.default_emotion) for e in emotions],
+                        dtype=np.intp)
+
+    def recommend(self, profile, emotion, top_k=1):
+        """Top_k action keys for one child and emotion."""
+        cand = self.candidates[self.emotion_index.get(emotion, self.default_emotion)]
+        cand = cand[cand >= 0]
+        bonus = self.features[cand] @ self.pref_vector(profile)
+        scores = (BASE_SCORE + PREF_BONUS * bonus) + self.learned_vector(profile)[cand]
+        return [self.actions[cand[i]] for i in _top_k(scores, top_k)]
+
+    def score_batch(self, profiles, emotions):
+        """
+        Score many (profile, emotion) pairs at once.
+        Returns (candidates, scores): both (n x width); padded slots are -1 / -inf.
+        """
+        prefs = np.stack([self.pref_vector(p) for p in profiles])
+        learned = np.stack([self.learned_vector(p) for p in profiles])
+        totals = (BASE_SCORE + PREF_BONUS * (prefs @ self.features.T)) + learned
+        cand = self.candidates[self._emotion_rows(emotions)]
+        scores = np.take_along_axis(totals, np.maximum(cand, 0), axis=1)
+        scores[cand < 0] = -np.inf
+        return cand, scores
+
+    def recommend_batch(self, profiles, emotions, top_k=1):
+        """
+        Top_k action keys for each (profile, emotion) pair; `emotions` may be a
+        single emotion applied to every profile. Same output as calling
+        recommend_for_child on each pair.
+        """
+        if isinstance(emotions, str):
+            emotions = [emotions] * len(profiles)
+        if not profiles:
+            return []
+        cand, scores = self.score_batch(profiles, emotions)
+        # Stable sort keeps BASE_MAPPING order among equal scores
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :top_k]
+        picks = np.take_along_axis(cand, order, axis=1)
+        return [[self.actions[a] for a in row if a >= 0] for row in picks]
+
+
+def _top_k(scores, k):
+    """Indices of the k highest scores; ties keep their original order."""
+    n = scores.shape[0]
+    if k >= n:
+        return np.argsort(-scores, kind="stable")
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    kth = -np.partition(-scores, k - 1)[k - 1]
+    idx = np.flatnonzero(scores >= kth)
+    return idx[np.argsort(-scores[idx], kind="stable")][:k]
+
+
+RECOMMENDER = CompiledRecommender()
+
+
+@profiler.timed("recommend")
 def recommend_for_child(profile, emotion, top_k=1):
     """
     Returns the top_k recommended action keys for a child given the detected emotion.
     Scoring = base + preference bonus + learned feedback
     """
-    candidates = BASE_MAPPING.get(emotion, BASE_MAPPING["neutral"])[:]
-    scored = []
-
-    for c in candidates:
-        base = 1.0
-        pref_bonus = 0.0
-        # Preference bonus heuristics
-        if "music" in c or "cheer" in c or "soothing" in c:
-            if profile["prefs"].get("music"):
-                pref_bonus += 0.7
-        if "video" in c or "comfort" in c:
-            if profile["prefs"].get("videos"):
-                pref_bonus += 0.7
-        if "forward" in c or "spin" in c or "move" in c or "retreat" in c:
-            if profile["prefs"].get("movement"):
-                pref_bonus += 0.7
-
-        # Learned feedback score
-        learned = profile.get("rec_scores", {}).get(c, 0.0)
-        score = base + pref_bonus + learned
-        scored.append((c, score))
-
-    scored.sort(key=lambda x: x[1], reverse=True)
-    picks = [c for c, _ in scored[:top_k]]
-    return picks
+    return RECOMMENDER.recommend(profile, emotion, top_k)
+
+
+@profiler.timed("recommend.batch")
+def recommend_batch(profiles, emotions, top_k=1):
+    """Batched recommend_for_child over many children and/or emotions."""
+    return RECOMMENDER.recommend_batch(profiles, emotions, top_k)
 
 # ---------------- Feedback Learning ----------------
 
@@ -134,3 +259,8 @@ def apply_feedback(profile, recommendation, before_emotion, after_emotion):
 def get_assets(action_key):
     """Return the list of asset names for an action key"""
     return ASSETS.get(action_key, [action_key])
+
+
+def get_duration(action_key):
+    """Return how many seconds a media/prompt action runs once started"""
+    return ACTION_DURATIONS.get(action_key, DEFAULT_DURATION)
@@ -0,0 +1,287 @@
+"""
+recommender_sim.py
+Headless simulation and replay harness for the KOKO recommender.
+- Synthetic children: per (emotion, action) stochastic emotion-transition
+  responses built from BASE_MAPPING, VALENCE and random profile prefs
+- Runs many simulated children in parallel with NumPy (one step = one
+  interaction for every child) and reports cumulative regret, convergence
+  time (steps until regret falls well below uniform choice) and throughput
+- Replays logged real sessions (JSON lines, or the event_log.py history
+  directory) deterministically with the bandit_engine policies, so learning
+  policies can be compared on a laptop
+
+Usage:
+    python3 recommender_sim.py --children 2000 --steps 200
+    python3 recommender_sim.py --replay sessions.jsonl
+    python3 recommender_sim.py --replay events/
+"""
+
+import argparse
+import copy
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+import bandit_engine
+from recommender_engine import (
+    BASE_SCORE,
+    DEFAULT_PROFILES,
+    PREF_BONUS,
+    PREF_KEYS,
+    RECOMMENDER,
+    VALENCE,
+    recommend_batch,
+    recommend_for_child,
+)
+
+SIM_POLICIES = ("random", "greedy", "ucb", "thompson")
+EFFECT_SCALE = 0.8     # spread of true per-(child, emotion, action) effects
+PREF_EFFECT = 0.4      # extra true effect when an action matches a child's prefs
+STAY_BIAS = 1.0        # tendency to stay in the current emotion
+CONVERGED_FRACTION = 0.25  # converged once regret is this fraction of uniform choice
+
+
+# ---------------- Synthetic Children ----------------
+
+class SyntheticChildren:
+    """
+    A population of simulated children.
+
+    transitions  (children x emotions x actions x emotions)  P(after | before, action)
+    expected     (children x emotions x actions)             expected reward
+    """
+
+    def __init__(self, n_children, rng):
+        rec = RECOMMENDER
+        self.n = n_children
+        self.emotions = rec.emotions
+        n_emotions, n_actions = len(rec.emotions), len(rec.actions)
+        self.valence = np.array([VALENCE.get(e, 0) for e in rec.emotions], dtype=np.float64)
+        self.prefs = (rng.random((n_children, len(PREF_KEYS))) < 0.5).astype(np.float64)
+
+        effect = EFFECT_SCALE * rng.standard_normal((n_children, n_emotions, n_actions))
+        effect += PREF_EFFECT * (self.prefs @ rec.features.T)[:, None, :]
+        logits = effect[..., None] * self.valence / 2.0
+        logits += STAY_BIAS * np.eye(n_emotions)[None, :, None, :]
+        logits -= logits.max(axis=-1, keepdims=True)
+        probs = np.exp(logits)
+        self.transitions = probs / probs.sum(axis=-1, keepdims=True)
+        self.cdf = np.cumsum(self.transitions, axis=-1)
+
+        delta = (self.valence[None, :] - self.valence[:, None]) / bandit_engine.VALENCE_RANGE
+        self.expected = np.einsum("cbaj,bj->cba", self.transitions, delta)
+
+    def profiles(self):
+        """Profile dicts matching the simulated prefs (for dict-based policies)."""
+        template = DEFAULT_PROFILES["child_001"]
+        out = []
+        for row in self.prefs:
+            profile = copy.deepcopy(template)
+            profile["prefs"] = {k: bool(v) for k, v in zip(PREF_KEYS, row)}
+            out.append(profile)
+        return out
+
+    def respond(self, before, actions, rng):
+        """Sample after-emotion indices for every child."""
+        cdf = self.cdf[np.arange(self.n), before, actions]
+        u = rng.random((self.n, 1))
+        return np.minimum((cdf < u).sum(axis=1), len(self.emotions) - 1)
+
+
+# ---------------- Vectorized Policies ----------------
+
+def simulate(children, policy, steps, rng):
+    """Run `steps` interactions for every child; return per-step regret (steps x children)."""
+    rec = RECOMMENDER
+    n = children.n
+    rows = np.arange(n)
+    n_emotions, n_actions = len(rec.emotions), len(rec.actions)
+    counts = np.zeros((n, n_emotions, n_actions))
+    means = np.zeros_like(counts)
+    m2 = np.zeros_like(counts)
+    learned = np.zeros((n, n_actions))
+    prior = bandit_engine.PRIOR_BONUS * (children.prefs @ rec.features.T)
+    static = BASE_SCORE + PREF_BONUS * (children.prefs @ rec.features.T)
+
+    regret = np.zeros((steps, n))
+    chosen = np.zeros((steps, n), dtype=np.intp)
+    best_arm = np.zeros((steps, n), dtype=np.intp)
+    for t in range(steps):
+        before = rng.integers(0, n_emotions, n)
+        cand = rec.candidates[before]
+        valid = cand >= 0
+        safe = np.maximum(cand, 0)
+
+        if policy == "random":
+            values = rng.random(cand.shape)
+        elif policy == "greedy":
+            values = np.take_along_axis(static + learned, safe, axis=1)
+        else:
+            ctx = (rows[:, None], before[:, None], safe)
+            values = bandit_engine.policy_values(
+                policy, counts[ctx], means[ctx], m2[ctx],
+                np.take_along_axis(prior, safe, axis=1), rng)
+        values = np.where(valid, values, -np.inf)
+        action = safe[rows, values.argmax(axis=1)]
+
+        after = children.respond(before, action, rng)
+        reward = (children.valence[after] - children.valence[before]) / bandit_engine.VALENCE_RANGE
+
+        if policy == "greedy":
+            # Same step rule and clamp as recommender_engine.apply_feedback
+            change = np.where(reward > 0, 1.0, np.where(reward == 0, 0.1, -0.5))
+            learned[rows, action] = np.clip(learned[rows, action] + change, -3.0, 5.0)
+        elif policy != "random":
+            ctx = (rows, before, action)
+            counts[ctx] += 1
+            d = reward - means[ctx]
+            means[ctx] += d / counts[ctx]
+            m2[ctx] += d * (reward - means[ctx])
+
+        exp = np.where(valid, np.take_along_axis(children.expected[rows, before], safe, axis=1), -np.inf)
+        best_arm[t] = safe[rows, exp.argmax(axis=1)]
+        chosen[t] = action
+        regret[t] = exp.max(axis=1) - children.expected[rows, before, action]
+    return regret, chosen, best_arm
+
+
+def uniform_regret(children):
+    """Expected per-step regret of picking uniformly among the candidates."""
+    cand = RECOMMENDER.candidates
+    valid = cand >= 0
+    exp = children.expected[:, np.arange(len(cand))[:, None], np.maximum(cand, 0)]
+    exp = np.where(valid, exp, np.nan)
+    gap = np.nanmax(exp, axis=-1, keepdims=True) - exp
+    return float(np.nanmean(gap))
+
+
+def convergence_step(regret, baseline, window=10):
+    """
+    First step at which the window-averaged regret falls to CONVERGED_FRACTION
+    of the uniform-choice regret; None if it never does.
+    """
+    per_step = regret.mean(axis=1)
+    if per_step.shape[0] < window:
+        return None
+    smoothed = np.convolve(per_step, np.ones(window) / window, mode="valid")
+    reached = np.flatnonzero(smoothed <= CONVERGED_FRACTION * baseline)
+    return int(reached[0] + window) if reached.size else None
+
+
+def run_simulation(n_children, steps, policies, seed):
+    print(f"[SIM] {n_children} children x {steps} interactions, seed {seed}")
+    results = {}
+    for policy in policies:
+        rng = np.random.default_rng(seed)
+        children = SyntheticChildren(n_children, rng)
+        t0 = time.perf_counter()
+        regret, chosen, best_arm = simulate(children, policy, steps, rng)
+        elapsed = time.perf_counter() - t0
+        conv = convergence_step(regret, uniform_regret(children))
+        tail = max(1, steps // 10)
+        results[policy] = {
+            "cumulative_regret": float(regret.sum(axis=0).mean()),
+            "final_regret": float(regret[-tail:].mean()),
+            "convergence_step": conv,
+            "best_arm_rate": float((chosen[-tail:] == best_arm[-tail:]).mean()),
+            "interactions_per_sec": n_children * steps / elapsed,
+        }
+        r = results[policy]
+        print(f"[SIM] {policy:<9} regret {r['cumulative_regret']:8.2f}  "
+              f"last-10% {r['final_regret']:.4f}/step  "
+              f"best arm {r['best_arm_rate']:.0%}  "
+              f"converged @ {conv if conv is not None else '-':>4}  "
+              f"{r['interactions_per_sec']:,.0f} interactions/s")
+    return results
+
+
+# ---------------- Scoring Throughput ----------------
+
+def scoring_throughput(n_profiles=2000, seed=0):
+    """Recommendations/sec for recommend_for_child and recommend_batch."""
+    rng = np.random.default_rng(seed)
+    children = SyntheticChildren(n_profiles, rng)
+    profiles = children.profiles()
+    emotions = [RECOMMENDER.emotions[i] for i in rng.integers(0, len(RECOMMENDER.emotions), n_profiles)]
+
+    t0 = time.perf_counter()
+    for profile, emotion in zip(profiles, emotions):
+        recommend_for_child(profile, emotion)
+    single = n_profiles / (time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    recommend_batch(profiles, emotions)
+    batch = n_profiles / (time.perf_counter() - t0)
+    print(f"[SIM] Scoring: recommend_for_child {single:,.0f}/s, recommend_batch {batch:,.0f}/s")
+    return {"single_per_sec": single, "batch_per_sec": batch}
+
+
+# ---------------- Replay ----------------
+
+def load_sessions(path):
+    """
+    Logged interactions, one JSON object per line:
+        {"child_id": ..., "emotion": ..., "action": ..., "after_emotion": ...}
+    A directory is read as event_log.py history (events that updated a profile).
+    """
+    if Path(path).is_dir():
+        from event_query import EventHistory
+
+        return list(EventHistory(path).sessions())
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def replay(events, policies, seed=0, profiles=None):
+    """
+    Offline replay evaluation: step through logged events in order; when a
+    policy picks the logged action, it sees the logged outcome and learns from
+    it, otherwise the event is skipped. Deterministic for a given seed.
+    """
+    profiles = profiles or DEFAULT_PROFILES
+    results = {}
+    for policy in policies:
+        rng = np.random.default_rng(seed)
+        state = {}
+        matched, total = 0, 0.0
+        for ev in events:
+            child_id = ev["child_id"]
+            if child_id not in state:
+                base = profiles.get(child_id, DEFAULT_PROFILES["child_001"])
+                state[child_id] = {"prefs": dict(base["prefs"]), "rec_scores": {},
+                                   "bandit": {}, "bandit_policy": policy}
+            profile = state[child_id]
+            if bandit_engine.recommend(profile, ev["emotion"], rng=rng)[0] != ev["action"]:
+                continue
+            bandit_engine.feedback(profile, ev["action"], ev["emotion"], ev["after_emotion"])
+            matched += 1
+            total += bandit_engine.feedback_reward(ev["emotion"], ev["after_emotion"])
+        results[policy] = {"matched": matched,
+                           "mean_reward": total / matched if matched else 0.0}
+        print(f"[REPLAY] {policy:<9} matched {matched}/{len(events)}  "
+              f"mean reward {results[policy]['mean_reward']:+.3f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KOKO recommender simulation harness")
+    parser.add_argument("--children", type=int, default=2000)
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--policies", nargs="+", default=list(SIM_POLICIES), choices=SIM_POLICIES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--replay", help="JSON-lines session log, or event_log.py history "
+                                         "directory, to replay instead of simulating")
+    args = parser.parse_args()
+
+    if args.replay:
+        policies = [p for p in args.policies if p in bandit_engine.POLICIES]
+        replay(load_sessions(args.replay), policies, args.seed)
+    else:
+        run_simulation(args.children, args.steps, args.policies, args.seed)
+        scoring_throughput(seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,58 +2,365 @@
 robot_controller.py
 Handles serial communication between Raspberry Pi and Arduino Nano.
 
-- Sends emotion commands as plain text (e.g., 'HAPPY', 'SAD', etc.)
-- Reads and prints Arduino responses for debugging
-- Baud Rate: 9600
+- Sends action commands as compact binary frames (see serial_protocol.py);
+  protocol="text" keeps the plain 'GENTLE_FORWARD\\n' lines for older firmware
+- A writer thread sends one command at a time; a reader thread matches the
+  Arduino's acknowledgement and completion replies by sequence number
+- send_action returns a Future resolved when the Arduino finishes the command
+- A newer action replaces a queued one that has not been sent yet;
+  send_action(..., preempt=True) interrupts the running action instead of
+  waiting for it to finish
+- stop() halts the motors at once; status() reports the running action and step
+- Keeps per-command round-trip latency stats
+- Baud Rate: opens at 9600, then negotiates target_baud (binary protocol)
 """
 
 import serial
+import threading
 import time
+from collections import deque
+from concurrent.futures import Future
+
+import profiler
+from serial_protocol import (
+    BAUD_RATES,
+    FIRST_ACTION_OPCODE,
+    OP_PING,
+    OP_SET_BAUD,
+    OP_STATUS,
+    OP_STOP,
+    OPCODE_NAMES,
+    OPCODES,
+    STATUS_IDLE,
+    ReplyParser,
+    TextReplyParser,
+    encode_command,
+)
+
+ACK_TIMEOUT = 1.0      # seconds to wait for the acknowledgement
+DONE_TIMEOUT = 10.0    # seconds to wait for completion before assuming the Arduino is idle
+
+
+class _Command:
+    def __init__(self, name, opcode=None, speed=0, duration=0, callback=None, preempt=False):
+        self.name = name
+        self.opcode = opcode
+        self.speed = speed
+        self.duration = duration
+        self.preempt = preempt
+        self.seq = None
+        self.key = None           # what the Arduino's replies are matched on
+        self.future = Future()
+        if callback:
+            self.future.add_done_callback(callback)
+        self.t_queued = time.monotonic()
+        self.t_sent = None
+        self.t_ack = None
+
+    @property
+    def expects_done(self):
+        """Actions reply ack then done; control commands only ack."""
+        return self.opcode is None or self.opcode >= FIRST_ACTION_OPCODE
+
 
 class RobotController:
-    def __init__(self, serial_port="/dev/ttyUSB0", baud_rate=9600):
+    def __init__(self, serial_port="/dev/ttyUSB0", baud_rate=9600, reset_delay=2.0,
+                 protocol="binary", target_baud=115200):
         self.serial_port = serial_port
         self.baud_rate = baud_rate
+        self.reset_delay = reset_delay
+        self.binary = protocol == "binary"
+        self.target_baud = target_baud if self.binary else baud_rate
+        self.parser = ReplyParser() if self.binary else TextReplyParser()
         self.ser = None
+        self.running = True
+        self.cond = threading.Condition()
+        self.pending = None       # next action to send (latest wins)
+        self.control = deque()    # STOP / STATUS, sent even while an action runs
+        self.inflight = None      # running action, waiting for done
+        self.sent = {}            # reply key (seq, or name for text) -> unfinished command
+        self.last_sent = None
+        self.seq = 0
+        self.latencies = deque(maxlen=100)
+        self.counts = {"sent": 0, "acked": 0, "done": 0, "coalesced": 0,
+                       "preempted": 0, "timeouts": 0}
+        self._threads = []
 
         if serial_port:
             try:
                 print(f"[ROBOT] Connecting to {serial_port} at {baud_rate} baud...")
-                self.ser = serial.Serial(serial_port, baud_rate, timeout=1)
-                time.sleep(2)  # Allow Arduino to reset
-                print("[ROBOT] Connection established.")
+                self.ser = serial.Serial(serial_port, baud_rate, timeout=0.1)
+                print("[ROBOT] Port open; waiting for Arduino reset in the background.")
             except Exception as e:
                 print(f"[ERROR] Could not open serial port: {e}")
                 self.ser = None
         else:
             print("[ROBOT] No serial port provided. Running in simulation mode.")
 
-    def send_action(self, emotion):
-        """Send an emotion command to the Arduino and print any response."""
+        if self.ser:
+            for target in (self._writer_loop, self._reader_loop):
+                thread = threading.Thread(target=target, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def send_action(self, emotion, callback=None, speed=0, duration=0, preempt=False):
+        """
+        Queue an action command for the Arduino and return immediately.
+        speed (PWM 1-255) and duration (ms per motion step) override the
+        firmware defaults when non-zero; the text protocol ignores them.
+        Returns a Future whose result is a dict with the command name, the
+        Arduino's reply and round-trip timings. A command still waiting to be
+        sent is cancelled when a newer one arrives. With preempt=True (binary
+        protocol) the command is sent right away and the running action ends
+        with the response "preempted".
+        """
         emotion = emotion.strip().upper()
+        cmd = _Command(emotion, OPCODES.get(emotion), speed, duration, callback, preempt)
 
-        if self.ser:
+        if not self.ser:
+            # Simulation mode (no Arduino connected)
+            print(f"[ROBOT SIM] Would send: {emotion}")
+            cmd.future.set_result({"action": emotion, "response": None, "rtt": 0.0, "duration": 0.0})
+            return cmd.future
+
+        if self.binary and cmd.opcode is None:
+            cmd.future.set_exception(ValueError(f"No opcode for action {emotion}"))
+            return cmd.future
+
+        with self.cond:
+            if self.pending is not None:
+                self.pending.future.cancel()
+                self.counts["coalesced"] += 1
+            self.pending = cmd
+            self.cond.notify_all()
+        return cmd.future
+
+    def stop(self):
+        """Stop the motors now: drops the queued action and interrupts the running one."""
+        with self.cond:
+            if self.pending is not None:
+                self.pending.future.cancel()
+                self.pending = None
+        return self._queue_control("STOP", OP_STOP)
+
+    def status(self):
+        """
+        Ask the Arduino what it is doing. The Future's response is
+        {"action": name or None, "step": index or None} (binary protocol).
+        """
+        return self._queue_control("STATUS", OP_STATUS)
+
+    def _queue_control(self, name, opcode):
+        cmd = _Command(name, opcode)
+        if not self.ser:
+            print(f"[ROBOT SIM] Would send: {name}")
+            cmd.future.set_result({"action": name, "response": None, "rtt": 0.0, "duration": 0.0})
+            return cmd.future
+        with self.cond:
+            self.control.append(cmd)
+            self.cond.notify_all()
+        return cmd.future
+
+    # ---------------- Writer ----------------
+
+    def _writer_loop(self):
+        time.sleep(self.reset_delay)  # Allow Arduino to reset
+        if self.target_baud != self.baud_rate:
+            self._negotiate_baud()
+        print("[ROBOT] Connection established.")
+        while self.running:
+            with self.cond:
+                while self.running and not self._ready():
+                    self.cond.wait(timeout=0.1)
+                    self._check_timeouts()
+                if not self.running:
+                    return
+                if self.control:
+                    cmd = self.control.popleft()
+                else:
+                    cmd, self.pending = self.pending, None
+                if not cmd.future.set_running_or_notify_cancel():
+                    continue
+            self._send(cmd)
+
+    def _ready(self):
+        """Called with self.cond held: is there a command that may be sent now?"""
+        if self.control:
+            return True
+        if self.pending is None:
+            return False
+        # Text replies can't tell two runs of the same action apart, so only binary preempts
+        return self.inflight is None or (self.binary and self.pending.preempt)
+
+    def _send(self, cmd):
+        with self.cond:
+            self.seq = (self.seq + 1) & 0xFF
+            cmd.seq = self.seq
+            cmd.key = cmd.seq if self.binary else cmd.name
+            cmd.t_sent = time.monotonic()
+            stale = self.sent.get(cmd.key)
+            if stale is not None:
+                self._finish(stale, error=TimeoutError(f"No reply for {stale.name}"), locked=True)
+            self.sent[cmd.key] = cmd
+            self.last_sent = cmd
+            if cmd.expects_done:
+                # A preempted action stays in self.sent until its "preempted" reply
+                self.inflight = cmd
+        if self.binary:
+            data = encode_command(cmd.seq, cmd.opcode, cmd.speed, cmd.duration)
+        else:
+            data = (cmd.name + "\n").encode()
+        try:
+            with profiler.span("robot.write"):
+                self.ser.write(data)
+            self.counts["sent"] += 1
+            print(f"[ROBOT] Sent: {cmd.name}")
+        except Exception as e:
+            print(f"[ERROR] Failed to send data: {e}")
+            self._finish(cmd, error=e)
+
+    def _control(self, name, opcode, arg=0):
+        """Send a control frame from the writer thread and wait for its ack."""
+        cmd = _Command(name, opcode, arg)
+        cmd.future.set_running_or_notify_cancel()
+        self._send(cmd)
+        deadline = time.monotonic() + ACK_TIMEOUT
+        with self.cond:
+            while not cmd.future.done() and time.monotonic() < deadline:
+                self.cond.wait(timeout=0.05)
+        if not cmd.future.done():
+            self._finish(cmd, error=TimeoutError(f"No acknowledgement for {name}"))
+        return cmd.future.exception() is None
+
+    def _negotiate_baud(self):
+        """Switch the link to target_baud; stay at baud_rate if the firmware doesn't follow."""
+        if self.target_baud not in BAUD_RATES:
+            print(f"[ROBOT] Unsupported baud rate {self.target_baud}; staying at {self.baud_rate}.")
+            return
+        if not self._control("SET_BAUD", OP_SET_BAUD, BAUD_RATES.index(self.target_baud)):
+            print(f"[ROBOT] Firmware did not accept a baud change; staying at {self.baud_rate}.")
+            return
+        time.sleep(0.05)
+        self.ser.baudrate = self.target_baud
+        if self._control("PING", OP_PING):
+            print(f"[ROBOT] Switched to {self.target_baud} baud.")
+        else:
+            print(f"[ROBOT] No reply at {self.target_baud} baud; reverting to {self.baud_rate}.")
+            self.ser.baudrate = self.baud_rate
+
+    def _check_timeouts(self):
+        """Called with self.cond held: give up on unresponsive sent commands."""
+        now = time.monotonic()
+        for cmd in list(self.sent.values()):
+            if cmd.t_ack is None and now - cmd.t_sent > ACK_TIMEOUT:
+                self.counts["timeouts"] += 1
+                self._finish(cmd, error=TimeoutError(f"No acknowledgement for {cmd.name}"), locked=True)
+            elif cmd.t_ack is not None and now - cmd.t_ack > DONE_TIMEOUT:
+                self.counts["timeouts"] += 1
+                self._finish(cmd, response=None, locked=True)
+
+    # ---------------- Reader ----------------
+
+    def _reader_loop(self):
+        while self.running:
             try:
-                # Send emotion command
-                self.ser.write((emotion + "\n").encode())
-                print(f"[ROBOT] Sent: {emotion}")
-
-                # Optional: read back Arduino response (for confirmation)
-                time.sleep(0.3)
-                if self.ser.in_waiting > 0:
-                    response = self.ser.readline().decode().strip()
-                    if response:
-                        print(f"[ROBOT] Received: {response}")
+                data = self.ser.read(max(1, self.ser.in_waiting))
             except Exception as e:
-                print(f"[ERROR] Failed to send/read data: {e}")
+                if self.running:
+                    print(f"[ERROR] Failed to read data: {e}")
+                    time.sleep(0.1)
+                continue
+            if data:
+                for event in self.parser.feed(data):
+                    self._handle_event(*event)
+
+    def _handle_event(self, kind, key, opcode, arg):
+        """
+        Match one parsed reply to its sent command. Binary replies are keyed
+        by sequence number, text replies by command name.
+        """
+        if kind == "log" or not self.binary:
+            print(f"[ROBOT] Received: {arg}")
+        if kind == "log":
+            return
+        with self.cond:
+            cmd = self.sent.get(key) if key is not None else self.last_sent
+            if cmd is None or cmd.future.done():
+                return
+            if kind == "ack":
+                if cmd.t_ack is None:
+                    cmd.t_ack = time.monotonic()
+                    self.counts["acked"] += 1
+                    self.latencies.append(cmd.t_ack - cmd.t_sent)
+                    profiler.record("robot.ack_rtt", cmd.t_ack - cmd.t_sent)
+                if not cmd.expects_done:
+                    self._finish(cmd, response=kind, locked=True)
+            elif kind == "bad_frame":
+                self._finish(cmd, error=IOError(f"Arduino rejected the frame for {cmd.name}"), locked=True)
+            elif kind == "status":
+                idle = arg == STATUS_IDLE
+                self._finish(cmd, response={"action": None if idle else OPCODE_NAMES.get(opcode),
+                                            "step": None if idle else arg}, locked=True)
+            else:
+                if kind == "preempted":
+                    self.counts["preempted"] += 1
+                self._finish(cmd, response=kind if self.binary else arg, locked=True)
+
+    def _finish(self, cmd, response=None, error=None, locked=False):
+        if not locked:
+            with self.cond:
+                return self._finish(cmd, response, error, locked=True)
+        if self.inflight is cmd:
+            self.inflight = None
+        if self.sent.get(cmd.key) is cmd:
+            del self.sent[cmd.key]
+        self.cond.notify_all()
+        if cmd.future.done():
+            return
+        now = time.monotonic()
+        if error is not None:
+            cmd.future.set_exception(error)
         else:
-            # Simulation mode (no Arduino connected)
-            print(f"[ROBOT SIM] Would send: {emotion}")
+            self.counts["done"] += 1
+            if cmd.expects_done:
+                profiler.record("robot.action", now - cmd.t_sent)
+            cmd.future.set_result({
+                "action": cmd.name,
+                "response": response,
+                "rtt": cmd.t_ack - cmd.t_sent if cmd.t_ack else None,
+                "duration": now - cmd.t_sent,
+            })
+
+    # ---------------- Stats / Shutdown ----------------
+
+    def stats(self):
+        """Command counters and acknowledgement round-trip latency (ms)."""
+        latencies = list(self.latencies)
+        out = dict(self.counts)
+        out["avg_rtt_ms"] = sum(latencies) / len(latencies) * 1000 if latencies else 0.0
+        out["max_rtt_ms"] = max(latencies, default=0.0) * 1000
+        return out
 
     def close(self):
-        """Close serial connection safely."""
+        """Stop the motors and close serial connection safely."""
+        if self.ser and self.inflight is not None:
+            try:
+                self.stop().result(timeout=ACK_TIMEOUT)
+            except Exception as e:
+                print(f"[ERROR] Could not stop the robot: {e}")
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+            if self.pending is not None:
+                self.pending.future.cancel()
+                self.pending = None
+            for cmd in list(self.control) + list(self.sent.values()):
+                self._finish(cmd, error=RuntimeError("Controller closed"), locked=True)
+            self.control.clear()
+        for thread in self._threads:
+            thread.join(timeout=1.0)
         if self.ser and self.ser.is_open:
             self.ser.close()
-            print("[ROBOT] Serial connection closed.")
+            print(f"[ROBOT] Serial connection closed. {self.stats()}")
         else:
             print("[ROBOT SIM] Closed simulation controller.")
@@ -0,0 +1,290 @@
+"""
+serial_protocol.py
+Framed binary serial protocol between RobotController and koko.ino.
+- One-byte action opcodes generated from recommender_engine's action table
+- Command frames carry a sequence number, speed/duration parameters and a CRC-8
+- Replies (ack / done / preempted / unknown / bad frame / status) echo the
+  sequence number; a newer action or STOP preempts the running one
+- The legacy text protocol ("GENTLE_FORWARD\\n" -> "Emotion received: ...") is still parsed
+- Motion routine step tables live here too and are generated into the
+  header, so action_duration() always matches what the firmware runs
+- Run this file to regenerate koko_protocol.h for the firmware:
+    python3 serial_protocol.py
+
+Command frame (host -> Arduino), 7 bytes:
+    0xA5 | seq | opcode | speed | duration_ms (uint16 LE) | crc8(seq..duration)
+Reply frame (Arduino -> host), 6 bytes:
+    0x5A | seq | type | opcode | arg | crc8(seq..arg)
+speed/duration of 0 mean "use the action's default".
+"""
+
+import struct
+from pathlib import Path
+
+from recommender_engine import RECOMMENDER, get_duration
+
+FRAME_MAGIC = 0xA5
+REPLY_MAGIC = 0x5A
+FRAME_LEN = 7
+REPLY_LEN = 6
+
+# Control opcodes; actions start at FIRST_ACTION_OPCODE
+OP_PING = 0x00
+OP_STOP = 0x01
+OP_STATUS = 0x02
+OP_SET_BAUD = 0x03
+FIRST_ACTION_OPCODE = 0x10
+
+# Reply types
+REPLY_ACK = 1
+REPLY_DONE = 2
+REPLY_UNKNOWN = 3
+REPLY_BAD_FRAME = 4
+REPLY_STATUS = 5       # opcode = running action (0 if idle), arg = current step (0xFF if idle)
+REPLY_PREEMPTED = 6    # action interrupted by a newer action or STOP, arg = step reached
+REPLY_NAMES = {REPLY_ACK: "ack", REPLY_DONE: "done", REPLY_UNKNOWN: "unknown",
+               REPLY_BAD_FRAME: "bad_frame", REPLY_STATUS: "status",
+               REPLY_PREEMPTED: "preempted"}
+STATUS_IDLE = 0xFF
+
+# Baud rates selectable with OP_SET_BAUD (speed byte = index)
+BAUD_RATES = (9600, 19200, 38400, 57600, 115200)
+
+# Firmware motion routine run for each action key
+ACTION_ROUTINES = {
+    "reward_learning": "HAPPY",
+    "dance_move": "HAPPY",
+    "celebrate": "HAPPY",
+    "gentle_forward": "SAD",
+    "slow_back": "ANGRY",
+    "retreat_slow": "ANGRY",
+    "show_surprised_eyes": "SURPRISE",
+    "quick_spin": "SPIN",
+    "idle_patrol": "PATROL",
+}
+ROUTINES = ("NEUTRAL", "HAPPY", "SAD", "ANGRY", "SURPRISE", "SPIN", "PATROL")
+DEFAULT_ROUTINE = "NEUTRAL"   # media/prompt actions: robot stays still
+
+DEFAULT_STEP_MS = 1000       # one motion step unless the command overrides it
+
+# Motor moves of a step (koko.ino's M_* ids, in this order)
+MOTIONS = ("STOP", "FORWARD", "BACKWARD", "SPIN_RIGHT")
+
+# Steps of each routine: (motion, PWM speed, length in % of a step).
+# Generated into koko_protocol.h; the command's speed overrides the PWM
+ROUTINE_STEPS = {
+    "NEUTRAL": [],
+    "HAPPY": [("SPIN_RIGHT", 255, 100), ("BACKWARD", 255, 100)] * 3,
+    "SAD": [("SPIN_RIGHT", 200, 100)],
+    "ANGRY": [("BACKWARD", 200, 100)] * 3,
+    "SURPRISE": [("FORWARD", 255, 100), ("BACKWARD", 255, 100)] * 3,
+    "SPIN": [("SPIN_RIGHT", 255, 100)],
+    "PATROL": [("FORWARD", 150, 100), ("SPIN_RIGHT", 150, 50), ("FORWARD", 150, 100)],
+}
+# Printed by the firmware when a routine starts from a text command
+ROUTINE_LABELS = {
+    "NEUTRAL": "😐 NEUTRAL → stay still",
+    "HAPPY": "🙂 HAPPY → forward spin + backward spin (fast)",
+    "SAD": "😔 SAD → slow spin",
+    "ANGRY": "😠 ANGRY → slow backward",
+    "SURPRISE": "😲 SURPRISE → quick forward + backward",
+    "SPIN": "🌀 SPIN → quick spin",
+    "PATROL": "🚶 PATROL → slow forward + turn",
+}
+
+
+def routine_seconds(routine, step_ms=None):
+    """How long a routine runs: its step lengths (% of a step) at step_ms."""
+    steps = ROUTINE_STEPS.get(routine, [])
+    return sum(length for _, _, length in steps) * (step_ms or DEFAULT_STEP_MS) / 100 / 1000
+
+
+def action_duration(action_key, step_ms=None):
+    """Seconds an action runs: its routine for motions, the declared media length otherwise."""
+    if action_key in ACTION_ROUTINES:
+        return routine_seconds(ACTION_ROUTINES[action_key], step_ms)
+    return get_duration(action_key)
+
+
+ACTIONS = tuple(RECOMMENDER.actions)
+OPCODES = {a.upper(): FIRST_ACTION_OPCODE + i for i, a in enumerate(ACTIONS)}
+OPCODES.update({"PING": OP_PING, "STOP": OP_STOP, "STATUS": OP_STATUS})
+OPCODE_NAMES = {op: name for name, op in OPCODES.items()}
+
+
+def crc8(data):
+    """CRC-8, polynomial 0x07, initial value 0 (same as koko_crc8 in the firmware)."""
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def encode_command(seq, opcode, speed=0, duration_ms=0):
+    body = struct.pack("<BBBH", seq & 0xFF, opcode, speed & 0xFF, min(duration_ms, 0xFFFF))
+    return bytes([FRAME_MAGIC]) + body + bytes([crc8(body)])
+
+
+def encode_reply(seq, reply_type, opcode, arg=0):
+    body = bytes([seq & 0xFF, reply_type, opcode, arg & 0xFF])
+    return bytes([REPLY_MAGIC]) + body + bytes([crc8(body)])
+
+
+def decode_command(frame):
+    """(seq, opcode, speed, duration_ms) from a 7-byte frame, or None if it is invalid."""
+    if len(frame) != FRAME_LEN or frame[0] != FRAME_MAGIC or crc8(frame[1:6]) != frame[6]:
+        return None
+    return struct.unpack("<BBBH", bytes(frame[1:6]))
+
+
+class ReplyParser:
+    """
+    Incremental parser for bytes from the Arduino. Yields events:
+        (kind, seq, opcode, arg) for binary replies, kind in REPLY_NAMES values
+        ("log", None, None, line) for plain text lines
+    Bytes that don't form a valid frame are treated as text, so the
+    firmware's banner and debug prints pass through.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def feed(self, data):
+        self.buf.extend(data)
+        events = []
+        buf = self.buf
+        while buf:
+            if buf[0] == REPLY_MAGIC:
+                if len(buf) < REPLY_LEN:
+                    break
+                if crc8(buf[1:5]) == buf[5]:
+                    seq, rtype, opcode, arg = buf[1:5]
+                    events.append((REPLY_NAMES.get(rtype, "unknown"), seq, opcode, arg))
+                    del buf[:REPLY_LEN]
+                    continue
+            nl = buf.find(b"\n")
+            magic = buf.find(bytes([REPLY_MAGIC]), 1)
+            if nl < 0 and magic < 0:
+                if len(buf) > 256:
+                    del buf[:]
+                break
+            end = nl + 1 if nl >= 0 and (magic < 0 or nl < magic) else magic
+            line = bytes(buf[:end]).decode(errors="replace").strip()
+            del buf[:end]
+            if line:
+                events.append(text_event(line))
+        return events
+
+
+class TextReplyParser:
+    """Line parser for the legacy text protocol; same events as ReplyParser."""
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def feed(self, data):
+        self.buf.extend(data)
+        events = []
+        while True:
+            nl = self.buf.find(b"\n")
+            if nl < 0:
+                return events
+            line = bytes(self.buf[:nl]).decode(errors="replace").strip()
+            del self.buf[:nl + 1]
+            if line:
+                events.append(text_event(line))
+
+
+def text_event(line):
+    """Map a legacy text reply to a parser event keyed by command name."""
+    if line.startswith("Emotion received:"):
+        return ("ack", line.split(":", 1)[1].strip(), None, line)
+    if line.startswith("Done:"):
+        return ("done", line.split(":", 1)[1].strip(), None, line)
+    if line.startswith("Interrupted:"):
+        return ("preempted", line.split(":", 1)[1].strip(), None, line)
+    if line.startswith("Unknown"):
+        return ("unknown", None, None, line)
+    return ("log", None, None, line)
+
+
+# ---------------- Firmware header generation ----------------
+
+HEADER_PATH = Path(__file__).with_name("koko_protocol.h")
+
+
+def generate_header():
+    lines = [
+        "// koko_protocol.h",
+        "// Generated by serial_protocol.py from recommender_engine.py -- do not edit.",
+        "// Regenerate with: python3 serial_protocol.py",
+        "",
+        "#ifndef KOKO_PROTOCOL_H",
+        "#define KOKO_PROTOCOL_H",
+        "",
+        "#include <avr/pgmspace.h>",
+        "",
+        f"#define KOKO_FRAME_MAGIC 0x{FRAME_MAGIC:02X}",
+        f"#define KOKO_REPLY_MAGIC 0x{REPLY_MAGIC:02X}",
+        f"#define KOKO_FRAME_LEN {FRAME_LEN}",
+        f"#define KOKO_REPLY_LEN {REPLY_LEN}",
+        "",
+        f"#define OP_PING 0x{OP_PING:02X}",
+        f"#define OP_STOP 0x{OP_STOP:02X}",
+        f"#define OP_STATUS 0x{OP_STATUS:02X}",
+        f"#define OP_SET_BAUD 0x{OP_SET_BAUD:02X}",
+        f"#define KOKO_FIRST_ACTION 0x{FIRST_ACTION_OPCODE:02X}",
+        f"#define KOKO_NUM_ACTIONS {len(ACTIONS)}",
+        "",
+    ]
+    for action in ACTIONS:
+        lines.append(f"#define OP_{action.upper()} 0x{OPCODES[action.upper()]:02X}")
+    lines += [""]
+    for rtype, name in REPLY_NAMES.items():
+        lines.append(f"#define REPLY_{name.upper()} {rtype}")
+    lines.append(f"#define KOKO_STATUS_IDLE 0x{STATUS_IDLE:02X}")
+    lines += ["", "// Motion routines"]
+    for i, routine in enumerate(ROUTINES):
+        lines.append(f"#define ROUTINE_{routine} {i}")
+    lines.append(f"#define KOKO_NUM_ROUTINES {len(ROUTINES)}")
+    lines += ["", f"#define DEFAULT_STEP_MS {DEFAULT_STEP_MS}",
+              "", "enum Motion { " + ", ".join(f"M_{m}" for m in MOTIONS) + " };",
+              "", "struct MotionStep {", "  uint8_t motion;",
+              "  uint8_t speed;    // PWM; the command's speed overrides it when non-zero",
+              "  uint8_t length;   // percent of the step duration (100 = one step)", "};",
+              "", "struct Routine {", "  const MotionStep *steps;   // PROGMEM", "  uint8_t count;",
+              "  const char *label;         // PROGMEM, printed for text commands", "};", ""]
+    for routine in ROUTINES:
+        if ROUTINE_STEPS[routine]:
+            lines.append(f"const MotionStep {routine}_STEPS[] PROGMEM = {{")
+            lines += [f"  {{M_{motion}, {speed}, {length}}},"
+                      for motion, speed, length in ROUTINE_STEPS[routine]]
+            lines.append("};")
+    for routine in ROUTINES:
+        lines.append(f'const char {routine}_LABEL[] PROGMEM = "{ROUTINE_LABELS[routine]}";')
+    lines += ["", "// Indexed by the ROUTINE_* ids", "const Routine KOKO_ROUTINES[KOKO_NUM_ROUTINES] = {"]
+    for routine in ROUTINES:
+        steps = f"{routine}_STEPS, {len(ROUTINE_STEPS[routine])}" if ROUTINE_STEPS[routine] else "NULL, 0"
+        lines.append(f"  {{{steps}, {routine}_LABEL}},  // ROUTINE_{routine}")
+    lines.append("};")
+    lines += ["", "// Routine per action, indexed by opcode - KOKO_FIRST_ACTION",
+              "const uint8_t KOKO_ACTION_ROUTINE[KOKO_NUM_ACTIONS] PROGMEM = {"]
+    for action in ACTIONS:
+        routine = ACTION_ROUTINES.get(action, DEFAULT_ROUTINE)
+        lines.append(f"  ROUTINE_{routine},  // {action}")
+    lines += ["};", "", "// Action names for the text protocol"]
+    for i, action in enumerate(ACTIONS):
+        lines.append(f'const char KOKO_NAME_{i}[] PROGMEM = "{action.upper()}";')
+    lines.append("const char* const KOKO_ACTION_NAMES[KOKO_NUM_ACTIONS] PROGMEM = {")
+    lines.append("  " + ", ".join(f"KOKO_NAME_{i}" for i in range(len(ACTIONS))))
+    lines += ["};", "", f"const uint32_t KOKO_BAUD_RATES[{len(BAUD_RATES)}] PROGMEM = {{"
+              + ", ".join(f"{b}UL" for b in BAUD_RATES) + "};",
+              f"#define KOKO_NUM_BAUD_RATES {len(BAUD_RATES)}", "", "#endif", ""]
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    HEADER_PATH.write_text(generate_header(), encoding="utf-8")
+    print(f"Wrote {HEADER_PATH.name}: {len(ACTIONS)} actions.")
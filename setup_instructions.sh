@@ -24,6 +24,11 @@ pip install --upgrade pip
 echo "=== Installing Python dependencies ==="
 pip install -r requirements.txt
 
+echo "=== Downloading lightweight emotion models (EMOTION_BACKEND = \"onnx\") ==="
+mkdir -p models
+wget -nc -P models https://github.com/opencv/opencv_zoo/raw/main/models/face_detection_yunet/face_detection_yunet_2023mar.onnx
+wget -nc -P models https://github.com/onnx/models/raw/main/validated/vision/body_analysis/emotion_ferplus/model/emotion-ferplus-12-int8.onnx
+
 echo "=== Setup complete! ==="
 echo "Activate environment using: source ~/koko_venv/bin/activate"
 echo "Then run: python3 main.py"
@@ -0,0 +1,102 @@
+"""
+startup.py
+Concurrent startup for KOKO.
+- Each init step (camera, serial, detector model, ...) is a named phase run
+  on its own background thread, so the slow ones overlap instead of adding up
+- A phase can wait for another with result(name); errors are re-raised there
+- Phases can nest timed sub-steps (e.g. "detector.import") with phase(name)
+- report() prints when each phase started and how long it took, plus the
+  time saved by running them concurrently
+- concurrent=False runs every phase inline, in order, for debugging
+"""
+
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+
+class Startup:
+    def __init__(self, concurrent=True):
+        self.concurrent = concurrent
+        self.t0 = time.perf_counter()
+        self.timings = {}          # name -> (start offset, duration), in seconds
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as phase `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self.lock:
+                self.timings[name] = (start - self.t0, end - start)
+
+    def run(self, name, fn, *args, **kwargs):
+        """Start fn(*args, **kwargs) as phase `name`; returns a Future for its result."""
+        future = Future()
+        self.futures[name] = future
+
+        def target():
+            try:
+                with self.phase(name):
+                    result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+        if self.concurrent:
+            threading.Thread(target=target, name=f"startup-{name}", daemon=True).start()
+        else:
+            target()
+        return future
+
+    def result(self, name, timeout=None):
+        """Wait for phase `name` and return its result (re-raising its error)."""
+        return self.futures[name].result(timeout)
+
+    def completed(self, name):
+        """Result of phase `name` if it finished successfully, else None (never waits)."""
+        future = self.futures.get(name)
+        if future is None or not future.done() or future.exception() is not None:
+            return None
+        return future.result()
+
+    def failed(self):
+        """Names of finished phases that raised."""
+        return [name for name, f in self.futures.items() if f.done() and f.exception() is not None]
+
+    def done(self, names=None):
+        return all(self.futures[n].done() for n in (names or self.futures))
+
+    def wait(self, names=None, poll=None, interval=0.05):
+        """
+        Wait until the given phases (default: all) have finished. `poll()` is
+        called between checks; returning False abandons the wait.
+        Returns True when everything finished.
+        """
+        while not self.done(names):
+            if poll is not None and not poll():
+                return False
+            time.sleep(interval)
+        return True
+
+    def elapsed(self):
+        return time.perf_counter() - self.t0
+
+    def report(self):
+        total = self.elapsed()
+        with self.lock:
+            rows = sorted(self.timings.items(), key=lambda item: item[1][0])
+        top = sum(d for name, (s, d) in rows if "." not in name)
+        print(f"[STARTUP] Ready in {total:.2f}s (phases sum to {top:.2f}s)")
+        for name, (start, duration) in rows:
+            future = self.futures.get(name)
+            failed = future is not None and future.done() and future.exception() is not None
+            note = f"  FAILED: {future.exception()!r}" if failed else ""
+            print(f"[STARTUP]   {name:<20} +{start:6.2f}s  {duration:6.2f}s{note}")
+        return {name: {"start_s": s, "duration_s": d} for name, (s, d) in rows}
@@ -1,33 +1,30 @@
-from picamera2 import Picamera2
-from fer import FER
 import cv2
-import numpy as np
-import time
+import sys
+
+from emotion_detector import create_detector
+from face_tracker import FaceTracker, largest_face
+from frame_source import PicameraSource
 
 def main():
-    # Initialize FER detector
-    detector = FER(mtcnn=True)
+    # Initialize emotion detector: python3 test_emotion.py [fer|onnx]
+    detector = create_detector(sys.argv[1] if len(sys.argv) > 1 else "fer")
+    tracker = FaceTracker(detector, detect_every=10)
     
-    # Initialize PiCamera2
-    picam2 = Picamera2()
-    config = picam2.create_preview_configuration(main={"format": "XRGB8888", "size": (640, 480)})
-    picam2.configure(config)
-    picam2.start()
-    time.sleep(2)  # Allow camera to warm up
+    # Initialize PiCamera2 (upright RGB frames; waits for camera warm-up)
+    camera = PicameraSource(size=(640, 480))
+    camera.start()
 
     print("KOKO Emotion Detection Started")
     print("Press 'q' to quit.")
 
     while True:
         # Capture frame from camera
-        frame = picam2.capture_array()
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        frame = cv2.rotate(frame, cv2.ROTATE_180)  # ?? Rotate 180 degrees
-        # Detect emotions
-        results = detector.detect_emotions(frame)
-
-        if results:
-            face = max(results, key=lambda x: x['box'][2] * x['box'][3])
+        frame = camera.read()
+        # Detect emotions (full detection every 10 frames, tracked in between)
+        results = tracker.process(frame)
+
+        face = largest_face(results)
+        if face:
             emotions = face['emotions']
             emotion = max(emotions, key=emotions.get)
             conf = emotions[emotion]
@@ -37,13 +34,14 @@ def main():
 
         # Show the live camera feed
         cv2.imshow("KOKO Emotion Detection", frame)
+        camera.release(frame)  # buffer is reused for a later frame
 
         # Press 'q' to quit safely
         if cv2.waitKey(1) & 0xFF == ord('q'):
             print("Shutting down...")
             break
 
-    picam2.stop()
+    camera.stop()
     cv2.destroyAllWindows()
 
 if __name__ == "__main__":
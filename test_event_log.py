@@ -0,0 +1,58 @@
+"""
+test_event_log.py
+Tests event_log.py and event_query.py on a temporary directory.
+- Events are logged when an action's outcome window closes, stamped with
+  the time the action started, so batches arrive out of time order; every
+  event must still be found by a time range query
+
+Run with:  python3 -m pytest test_event_log.py
+"""
+
+import pytest
+
+from event_log import EventLog
+from event_query import EventHistory
+
+NOW = 1_790_000_000.0      # fixed epoch time, so the test never crosses midnight
+
+
+def log_events(log, times, flush_every):
+    for i, t in enumerate(times, 1):
+        log.record(t=t, child="C1", action="comfort_video", emotion="sad", after_emotion="happy")
+        if i % flush_every == 0:
+            log.flush()
+    log.flush()
+
+
+def test_out_of_order_batches_are_all_found(tmp_path):
+    # A tiny max size forces a new file for nearly every batch
+    log = EventLog(log_dir=tmp_path, max_file_bytes=1)
+    # Each batch holds a late event from 100 s ago next to recent ones
+    times = []
+    for i in range(10):
+        times += [NOW - 100 + i, NOW - 5 + i * 0.1, NOW - 4 + i * 0.1]
+    log_events(log, times, flush_every=3)
+    log.close()
+
+    history = EventHistory(tmp_path)
+    assert history.count() == len(times)
+    assert history.count(until=NOW - 10) == 10
+    assert history.count(since=NOW - 10) == 20
+    assert history.count(since=NOW - 100, until=NOW - 95) == 5
+
+
+def test_time_range_follows_appends(tmp_path):
+    log = EventLog(log_dir=tmp_path)
+    log_events(log, [NOW - 50, NOW - 60], flush_every=2)
+    history = EventHistory(tmp_path)
+    (first, path), = history.files()
+    assert history.time_range(path) == (NOW - 60, NOW - 50)
+    # Later records in the same file widen the cached range
+    log_events(log, [NOW - 70], flush_every=1)
+    log.close()
+    assert history.time_range(path) == (NOW - 70, NOW - 50)
+    assert history.count(until=NOW - 65) == 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-v"]))
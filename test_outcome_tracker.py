@@ -0,0 +1,77 @@
+"""
+test_outcome_tracker.py
+Tests the outcome windows of outcome_tracker.py with explicit times.
+- An action the child cheers up to is scored happy even when a new
+  action preempts it right after the change
+- Overlapping windows each get the readings that fall in them
+- Too few readings give no after-emotion
+
+Run with:  python3 -m pytest test_outcome_tracker.py
+"""
+
+import pytest
+
+import bandit_engine
+from outcome_tracker import OutcomeTracker
+
+CHILD = {"track_id": 1, "child_id": "C1", "emotion": "sad", "conf": 0.9}
+
+
+def reading(emotion, score=0.9):
+    emotions = {"angry": 0.0, "happy": 0.0, "sad": 0.0, "neutral": 1.0 - score}
+    emotions[emotion] = score
+    return [{"track_id": CHILD["track_id"], "emotions": emotions}]
+
+
+def feed(tracker, emotion, start, end, step=0.1):
+    t = start
+    while t < end - 1e-9:
+        tracker.observe(reading(emotion), t=t)
+        t += step
+
+
+def test_preempted_action_is_scored_on_the_reaction():
+    tracker = OutcomeTracker()
+    tracker.open("comfort_video", [CHILD], t=0.0, duration=30.0)
+    feed(tracker, "sad", 0.5, 3.0)
+    feed(tracker, "happy", 3.0, 4.0)
+    # A new action cuts the video short; the child is still happy after it
+    tracker.open("play_cheer_music", [CHILD], t=4.0, duration=20.0)
+    feed(tracker, "happy", 4.0, 5.0)
+    assert tracker.due(t=4.9) == []
+    window, = [w for w in tracker.due(t=5.0) if w["action"] == "comfort_video"]
+    assert window["preempted"]
+    assert window["after_emotion"] == "happy"
+    reward, _ = bandit_engine.feedback({}, "comfort_video", CHILD["emotion"], window["after_emotion"])
+    assert reward > 0
+
+
+def test_overlapping_windows_share_readings():
+    tracker = OutcomeTracker()
+    other = dict(CHILD, track_id=2, child_id="C2")
+    # The first window collects 0.5-2.0 s, the second 1.5-3.0 s
+    tracker.open("gentle_forward", [CHILD, other], t=0.0, duration=1.0)
+    tracker.open("blink_alert", [CHILD], t=1.0, duration=1.0)
+    feed(tracker, "happy", 0.5, 3.05)
+    first, absent = tracker.due(t=2.0)
+    second, = tracker.due(t=3.0)
+    assert not first["preempted"]
+    assert first["samples"] == pytest.approx(16, abs=1)
+    assert second["samples"] == pytest.approx(16, abs=1)
+    assert first["after_emotion"] == second["after_emotion"] == "happy"
+    # Track 2 never showed up; track 1's readings only count for its own windows
+    assert absent["child"] is other and absent["samples"] == 0
+
+
+def test_too_few_readings_give_no_emotion():
+    tracker = OutcomeTracker(min_samples=3)
+    tracker.open("quick_spin", [CHILD], t=0.0, duration=1.0)
+    feed(tracker, "happy", 0.5, 0.7)
+    window, = tracker.due(t=2.0)
+    assert window["samples"] == 2
+    assert (window["after_emotion"], window["after_conf"], window["after_dist"]) == ("", 0.0, None)
+    assert tracker.stats()["scored"] == 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-v"]))
@@ -0,0 +1,48 @@
+"""
+test_profile_store.py
+Tests profile_store.py on a temporary directory.
+- A snapshot that fails to write keeps every logged change: they are
+  replayed on the next load and folded into the next snapshot that works
+
+Run with:  python3 -m pytest test_profile_store.py
+"""
+
+import pytest
+
+import profile_store
+from profile_store import ProfileStore
+
+
+def failing_save(profiles, path):
+    raise OSError("No space left on device")
+
+
+def test_failed_snapshots_keep_every_update(tmp_path, monkeypatch):
+    path = tmp_path / "profiles.json"
+    store = ProfileStore(path)
+    store.load()
+    store.record("child_001", "rec_scores", "dance_move", 1.5)
+
+    monkeypatch.setattr(profile_store, "save_profiles", failing_save)
+    with pytest.raises(OSError):
+        store.compact()
+    store.record("child_001", "rec_scores", "comfort_video", -0.5)
+    with pytest.raises(OSError):
+        store.compact()
+
+    scores = ProfileStore(path).load()["child_001"]["rec_scores"]
+    assert scores["dance_move"] == 1.5
+    assert scores["comfort_video"] == -0.5
+
+    # Once the disk recovers both changes reach the snapshot
+    monkeypatch.undo()
+    assert store.compact()
+    assert not store.old_log_path.exists()
+    assert not store.compact()
+    store.close()
+    scores = profile_store.load_profiles(path)["child_001"]["rec_scores"]
+    assert (scores["dance_move"], scores["comfort_video"]) == (1.5, -0.5)
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-v"]))
@@ -1,50 +1,157 @@
 """
 test_robotcontroller.py
-Tests two-way serial communication between Raspberry Pi/PC and Arduino.
-Sends each emotion and prints whatever Arduino sends back.
+Tests the serial link between RobotController and koko.ino without an Arduino:
+koko_emulator.py runs the firmware's protocol on a pseudo-terminal.
+- Raw frames: valid actions are acked then reported done, corrupt frames
+  are rejected with bad_frame, unknown opcodes answered with unknown, and
+  a newer action preempts the running one
+- RobotController: action futures resolve with done / preempted, STATUS
+  reports the running action, and the legacy text protocol still works
+
+Run with:  python3 -m pytest test_robotcontroller.py
 """
 
 import time
+
+import pytest
 import serial
 
-# 🔧 Change this to your actual Arduino port
-# For Raspberry Pi:  "/dev/ttyUSB0"  or  "/dev/ttyACM0"
-# For Windows:       "COM3"
-PORT = "/dev/ttyUSB0"
-BAUD_RATE = 9600
+from koko_emulator import KokoEmulator
+from robot_controller import RobotController
+from serial_protocol import (ACTIONS, OPCODES, OP_PING, ReplyParser, crc8, encode_command)
+
+BOOT_DELAY = 0.1      # emulated bootloader time
+STEP_MS = 20          # short motion steps so routines finish quickly
+TIMEOUT = 3.0
+
+
+@pytest.fixture
+def emulator():
+    with KokoEmulator(reset_delay=BOOT_DELAY, step_ms=STEP_MS, seed=0) as emu:
+        yield emu
+
+
+@pytest.fixture
+def link(emulator):
+    """Raw serial port on the emulator, once it has booted."""
+    port = serial.Serial(emulator.port, 9600, timeout=0.05)
+    time.sleep(BOOT_DELAY + 0.1)
+    port.reset_input_buffer()
+    yield port
+    port.close()
+
+
+def read_replies(port, count, timeout=TIMEOUT):
+    """The next `count` binary replies as (kind, seq, opcode, arg); banner lines are skipped."""
+    parser = ReplyParser()
+    replies = []
+    end = time.monotonic() + timeout
+    while len(replies) < count and time.monotonic() < end:
+        replies += [e for e in parser.feed(port.read(64)) if e[0] != "log"]
+    return replies
+
+
+def controller(emulator, **kwargs):
+    robot = RobotController(emulator.port, reset_delay=BOOT_DELAY + 0.1, **kwargs)
+    end = time.monotonic() + TIMEOUT
+    while time.monotonic() < end:
+        try:
+            robot.status().result(timeout=1.0)
+            return robot
+        except Exception:
+            pass
+    robot.close()
+    pytest.fail("emulated Arduino never answered")
+
+
+# ---------------- Raw frames ----------------
+
+def test_action_is_acked_then_done(link):
+    opcode = OPCODES["QUICK_SPIN"]
+    link.write(encode_command(7, opcode))
+    assert read_replies(link, 2) == [("ack", 7, opcode, 0), ("done", 7, opcode, 0)]
+
+
+def test_ping_is_acked(link):
+    link.write(encode_command(3, OP_PING))
+    assert read_replies(link, 1) == [("ack", 3, OP_PING, 0)]
+
+
+def test_corrupt_frame_is_rejected(link):
+    frame = bytearray(encode_command(9, OPCODES["QUICK_SPIN"]))
+    frame[-1] ^= 0xFF
+    link.write(bytes(frame))
+    assert read_replies(link, 1) == [("bad_frame", 9, OPCODES["QUICK_SPIN"], 0)]
+    # The board keeps listening after a bad frame
+    link.write(encode_command(10, OP_PING))
+    assert read_replies(link, 1) == [("ack", 10, OP_PING, 0)]
+
+
+def test_unknown_opcode(link):
+    body = bytes([4, 0xEE, 0, 0, 0])
+    link.write(bytes([0xA5]) + body + bytes([crc8(body)]))
+    assert read_replies(link, 1) == [("unknown", 4, 0xEE, 0)]
+
+
+def test_newer_action_preempts_running_one(link):
+    slow, quick = OPCODES["DANCE_MOVE"], OPCODES["QUICK_SPIN"]
+    link.write(encode_command(1, slow, duration_ms=1000))
+    assert read_replies(link, 1) == [("ack", 1, slow, 0)]
+    link.write(encode_command(2, quick))
+    # Like koko.ino: the new frame is acked, then the running action is cut short
+    kinds = [(kind, seq) for kind, seq, _, _ in read_replies(link, 3)]
+    assert kinds == [("ack", 2), ("preempted", 1), ("done", 2)]
+
+
+# ---------------- RobotController ----------------
 
-# Connect to Arduino
-print(f"[INFO] Connecting to {PORT} at {BAUD_RATE} baud...")
-arduino = serial.Serial(PORT, BAUD_RATE, timeout=1)
-time.sleep(2)  # Wait for Arduino reset
+def test_controller_action_done(emulator):
+    robot = controller(emulator)
+    try:
+        result = robot.send_action("quick_spin").result(timeout=TIMEOUT)
+        assert result["action"] == "QUICK_SPIN"
+        assert result["response"] == "done"
+        assert result["rtt"] is not None
+        assert robot.stats()["timeouts"] == 0
+    finally:
+        robot.close()
 
-# List of test emotions
-emotions = ["HAPPY", "SAD", "ANGRY", "NEUTRAL", "SURPRISE"]
 
-print("\n[TEST] Starting send/receive test...\n")
+def test_controller_preempt(emulator):
+    robot = controller(emulator)
+    try:
+        first = robot.send_action("dance_move", duration=1000)
+        time.sleep(0.2)
+        status = robot.status().result(timeout=TIMEOUT)["response"]
+        assert status == {"action": "DANCE_MOVE", "step": 0}
+        second = robot.send_action("quick_spin", preempt=True)
+        assert first.result(timeout=TIMEOUT)["response"] == "preempted"
+        assert second.result(timeout=TIMEOUT)["response"] == "done"
+        assert robot.stats()["preempted"] == 1
+    finally:
+        robot.close()
 
-try:
-    for emo in emotions:
-        # Send emotion
-        cmd = emo + "\n"
-        arduino.write(cmd.encode())
-        print(f"[SENT] {emo}")
 
-        # Wait a bit and read any response
-        time.sleep(0.5)
-        response = arduino.readline().decode().strip()
-        if response:
-            print(f"[RECEIVED] {response}")
-        else:
-            print("[RECEIVED] (no response)")
+def test_controller_every_action_opcode(emulator):
+    robot = controller(emulator)
+    try:
+        for action in ACTIONS:
+            result = robot.send_action(action, duration=5).result(timeout=TIMEOUT)
+            assert result["response"] == "done", action
+        assert emulator.counts["unknown"] == 0
+        assert emulator.counts["bad_frames"] == 0
+    finally:
+        robot.close()
 
-        time.sleep(2)
 
-    print("\n[TEST] Completed successfully!")
+def test_controller_text_protocol(emulator):
+    robot = controller(emulator, protocol="text")
+    try:
+        result = robot.send_action("quick_spin").result(timeout=TIMEOUT)
+        assert result["response"].startswith("Done: QUICK_SPIN")
+    finally:
+        robot.close()
 
-except KeyboardInterrupt:
-    print("\n[TEST] Interrupted by user.")
 
-finally:
-    arduino.close()
-    print("[INFO] Connection closed.")
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-v"]))